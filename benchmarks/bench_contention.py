@@ -0,0 +1,125 @@
+"""Measure the cost of cross-process locking with several desks on one data folder.
+
+Usage:
+    python benchmarks/bench_contention.py [--processes 1,2,4,8] [--ops 300] [--titles 2000]
+
+Each process opens its own CSV-backend LibraryEngine on a shared temporary
+folder, as separate desk PCs on a network share would, and alternates
+checkouts of random copies with returns of its own loans. Rejections (the
+copy was already out) and ConcurrentUpdateErrors (another desk took it since
+this one last looked) are counted separately. The report gives throughput,
+latency percentiles, time spent waiting for the shared lock, and whether the
+final book file agrees with the loan ledger.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_engine import ConcurrentUpdateError, LibraryEngine
+from synthetic import make_books, make_students, make_titles, write_csv
+
+
+def open_engine(directory):
+    return LibraryEngine(
+        'csv',
+        students_path=os.path.join(directory, 'studentdetails.csv'),
+        books_path=os.path.join(directory, 'bookdata.csv'),
+        purchases_path=os.path.join(directory, 'book_purchases.db'),
+        returns_path=os.path.join(directory, 'book_returns.db')
+    )
+
+
+def run_desk(directory, seed, ops):
+    engine = open_engine(directory)
+    engine.load()
+    engine.flush_interval = 0.5  # Compact often so desks also contend on snapshot rewrites
+    rng = random.Random(seed)
+    students = [student['school_id'] for student in engine.catalog.students]
+    barcodes = [book['barcode'] for book in engine.catalog.books]
+    counts = {'ok': 0, 'rejected': 0, 'conflict': 0, 'failed': 0}
+    latencies = []
+    on_loan = []
+    for _ in range(ops):
+        start = time.perf_counter()
+        try:
+            if on_loan and rng.random() < 0.5:
+                engine.checkin(on_loan.pop(rng.randrange(len(on_loan))))
+            else:
+                book = engine.checkout(rng.choice(students), rng.choice(barcodes))
+                on_loan.append(book['barcode'])
+            counts['ok'] += 1
+        except ConcurrentUpdateError:
+            counts['conflict'] += 1
+        except ValueError:
+            counts['rejected'] += 1
+        except Exception:
+            counts['failed'] += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+    waited, acquired = engine.shared_lock.waited, engine.shared_lock.acquired
+    engine.close()
+    return counts, latencies, waited, acquired
+
+
+def is_consistent(directory):
+    """Check that the book file marks exactly the copies the ledger has on loan."""
+    engine = open_engine(directory)
+    catalog = engine.load()
+    on_loan = {barcode for barcode, _, _ in engine.store.open_loans()}
+    marked = {book['barcode'] for book in catalog.books if book['is_purchased']}
+    engine.close()
+    return on_loan == marked
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', default='1,2,4,8')
+    parser.add_argument('--ops', type=int, default=300, help="operations per process")
+    parser.add_argument('--titles', type=int, default=2000)
+    parser.add_argument('--students', type=int, default=500)
+    parser.add_argument('--dir', help="folder to create the shared data in (e.g. on a network share)")
+    args = parser.parse_args()
+
+    print(f"{'procs':>5} {'ops/s':>7} {'p50 ms':>7} {'p95 ms':>7} {'lock wait ms':>12} "
+          f"{'rejected':>8} {'conflicts':>9} {'failed':>6} {'consistent':>10}")
+    for processes in (int(p) for p in args.processes.split(',')):
+        with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+            write_csv(os.path.join(directory, 'bookdata.csv'), make_books(make_titles(args.titles)))
+            write_csv(os.path.join(directory, 'studentdetails.csv'), make_students(args.students))
+            # Build the ledger databases and catalog cache once, before the desks race
+            open_engine(directory).close()
+
+            start = time.perf_counter()
+            with multiprocessing.Pool(processes) as pool:
+                results = pool.starmap(run_desk, [(directory, seed, args.ops) for seed in range(processes)])
+            elapsed = time.perf_counter() - start
+
+            totals = {'ok': 0, 'rejected': 0, 'conflict': 0, 'failed': 0}
+            latencies = []
+            waited = acquired = 0
+            for counts, desk_latencies, desk_waited, desk_acquired in results:
+                for outcome, count in counts.items():
+                    totals[outcome] += count
+                latencies.extend(desk_latencies)
+                waited += desk_waited
+                acquired += desk_acquired
+            consistent = is_consistent(directory)
+
+        wait_ms = waited * 1000 / acquired if acquired else 0
+        print(f"{processes:>5} {len(latencies) / elapsed:>7.0f} {percentile(latencies, 0.5):>7.2f} "
+              f"{percentile(latencies, 0.95):>7.2f} {wait_ms:>12.3f} {totals['rejected']:>8} "
+              f"{totals['conflict']:>9} {totals['failed']:>6} {'yes' if consistent else 'NO':>10}")
+
+
+if __name__ == '__main__':
+    main()
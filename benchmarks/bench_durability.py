@@ -0,0 +1,72 @@
+"""Compare SQLite durability profiles on the desk write path.
+
+Usage:
+    python benchmarks/bench_durability.py [--commits 500] [--group-size 1000] [--profiles strict,balanced,bulk]
+
+For each profile and each ledger store (the single-database 'sqlite' backend
+and the CSV backend's two-file legacy ledger) this alternates one-book
+checkouts and returns, each in its own transaction as at the desk, and
+reports commits per second. It then records --group-size checkouts per
+transaction, as batch mode does, and reports rows per second. Every run uses
+fresh files in a temporary directory, on the same disk as --dir if given.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_engine import DURABILITY_PROFILES, LegacyLedger, LibraryDatabase
+
+
+def open_store(kind, directory, profile):
+    if kind == 'sqlite':
+        return LibraryDatabase(os.path.join(directory, 'library.db'), profile)
+    return LegacyLedger(
+        os.path.join(directory, 'book_purchases.db'),
+        os.path.join(directory, 'book_returns.db'),
+        profile
+    )
+
+
+def desk_commits_per_second(store, commits):
+    start = time.perf_counter()
+    for i in range(commits // 2):
+        barcode = f"B{i:08d}"
+        store.record_loans([('S0000001', barcode)])
+        store.record_return('S0000001', barcode)
+    return (commits // 2 * 2) / (time.perf_counter() - start)
+
+
+def grouped_rows_per_second(store, group_size, groups=5):
+    start = time.perf_counter()
+    for g in range(groups):
+        store.record_loans([(f"S{i:07d}", f"G{g}-{i:08d}") for i in range(group_size)])
+    return group_size * groups / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--commits', type=int, default=500)
+    parser.add_argument('--group-size', type=int, default=1000)
+    parser.add_argument('--profiles', default=','.join(DURABILITY_PROFILES))
+    parser.add_argument('--dir', help="directory to create the temporary databases in")
+    args = parser.parse_args()
+
+    print(f"{'store':>7} {'profile':>9} {'commits/s':>10} {'grouped rows/s':>15}")
+    for kind in ('sqlite', 'ledger'):
+        for profile in args.profiles.split(','):
+            with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+                store = open_store(kind, directory, profile)
+                try:
+                    commits = desk_commits_per_second(store, args.commits)
+                    rows = grouped_rows_per_second(store, args.group_size)
+                finally:
+                    store.close()
+            print(f"{kind:>7} {profile:>9} {commits:>10.0f} {rows:>15.0f}")
+
+
+if __name__ == '__main__':
+    main()
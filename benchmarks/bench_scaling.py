@@ -0,0 +1,225 @@
+"""Measure how the desk operations scale with library size.
+
+Usage:
+    python benchmarks/bench_scaling.py [--sizes 1000,100000,1000000] [--report scaling.json]
+    python benchmarks/bench_scaling.py --sizes 100000 --baseline scaling.json [--tolerance 0.25] [--min-change-ms 5]
+
+For each catalog size (book copies, from synthetic.make_library) a roster of
+a tenth as many students, capped at --max-students, is written to a
+temporary folder. The CSV-backend engine is then measured on the paths the
+desk app uses:
+
+    load          cold load (parse and index the CSVs), snapshot save, cached load
+    memory        Python heap held by the catalog and its peak while building it
+    keystrokes    title suggestions per typed character (update_search_suggestions)
+                  and school ID / barcode suggestions (update_student_suggestions)
+    search        full fuzzy search (search_book)
+    checkout      checkouts and returns, journaled (purchase_book, return_book)
+    csv rewrite   folding the changes into bookdata.csv (update_book_csv)
+
+Results are printed and written as JSON to --report. With --baseline, each
+metric is compared with the same size in an earlier report; the exit status
+is 1 if any got worse by more than --tolerance (and, for timings, by more
+than --min-change-ms, so sub-millisecond noise is not reported).
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_engine import LibraryCatalog, LibraryEngine, get_scorer, read_csv_data
+from synthetic import make_library, make_queries, make_students, write_csv
+
+
+def open_engine(directory):
+    return LibraryEngine(
+        'csv',
+        students_path=os.path.join(directory, 'studentdetails.csv'),
+        books_path=os.path.join(directory, 'bookdata.csv'),
+        purchases_path=os.path.join(directory, 'book_purchases.db'),
+        returns_path=os.path.join(directory, 'book_returns.db')
+    )
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def latencies_ms(func, items):
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        func(item)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def add_latencies(result, name, values):
+    result[f'{name}_p50_ms'] = round(percentile(values, 0.5), 3)
+    result[f'{name}_p95_ms'] = round(percentile(values, 0.95), 3)
+    result[f'{name}_max_ms'] = round(max(values), 3)
+
+
+def keystrokes(texts):
+    """Every prefix of each text, as the desk sees them while it is typed."""
+    return [text[:i] for text in texts for i in range(1, len(text) + 1)]
+
+
+def measure(size, students, args):
+    result = {'books': size, 'students': students}
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        books = make_library(size, args.seed)
+        result['titles'] = len({book['title'].lower() for book in books})
+        books_path = os.path.join(directory, 'bookdata.csv')
+        students_path = os.path.join(directory, 'studentdetails.csv')
+        write_csv(books_path, books)
+        write_csv(students_path, make_students(students, seed=args.seed))
+        result['csv_mb'] = round((os.path.getsize(books_path) + os.path.getsize(students_path)) / 2**20, 1)
+        titles = list(dict.fromkeys(book['title'] for book in books))
+        del books
+
+        # Load: cold, then from the snapshot close() leaves behind
+        engine = open_engine(directory)
+        _, result['cold_load_s'] = timed(engine.load)
+        _, result['cache_save_s'] = timed(engine.close)
+        engine = open_engine(directory)
+        catalog, result['cached_load_s'] = timed(engine.load)
+
+        rng = random.Random(args.seed)
+
+        # Keystrokes: title suggestions and the identifier dropdowns
+        queries = make_queries(titles, args.queries, args.seed)
+        values = latencies_ms(lambda text: engine.suggest_titles(text, limit=10, score_cutoff=40), keystrokes(queries))
+        add_latencies(result, 'suggest', values)
+        ids = [rng.choice(catalog.students)['school_id'] for _ in range(args.queries // 2)]
+        ids += [rng.choice(catalog.books)['barcode'] for _ in range(args.queries // 2)]
+        values = latencies_ms(catalog.student_ids.search, keystrokes(ids[:len(ids) // 2]))
+        values += latencies_ms(catalog.available_barcodes.search, keystrokes(ids[len(ids) // 2:]))
+        add_latencies(result, 'id_suggest', values)
+
+        # Search
+        add_latencies(result, 'search', latencies_ms(lambda query: engine.search(query, limit=5), queries))
+
+        # Checkouts and returns, written behind as at the desk
+        engine.auto_flush = False
+        school_ids = [student['school_id'] for student in catalog.students]
+        barcodes = [book['barcode'] for book in catalog.books]
+        on_loan = []
+        values = []
+        start = time.perf_counter()
+        for _ in range(args.ops):
+            op_start = time.perf_counter()
+            if on_loan and rng.random() < 0.5:
+                engine.checkin(on_loan.pop(rng.randrange(len(on_loan))))
+            else:
+                try:
+                    on_loan.append(engine.checkout(rng.choice(school_ids), rng.choice(barcodes))['barcode'])
+                except ValueError:
+                    pass  # Already on loan
+            values.append((time.perf_counter() - op_start) * 1000)
+        result['checkout_return_ops_per_s'] = round(args.ops / (time.perf_counter() - start))
+        add_latencies(result, 'checkout_return', values)
+        _, result['csv_rewrite_s'] = timed(engine.update_book_csv)
+        engine.close()
+
+        # Memory, in a separate pass because tracing slows the build down
+        if not args.skip_memory:
+            del catalog, engine
+            gc.collect()
+            tracemalloc.start()
+            catalog = LibraryCatalog(read_csv_data(students_path, 'students'), read_csv_data(books_path, 'books'))
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result['memory_mb'] = round(current / 2**20, 1)
+            result['peak_memory_mb'] = round(peak / 2**20, 1)
+            del catalog
+
+    for key in ('cold_load_s', 'cache_save_s', 'cached_load_s', 'csv_rewrite_s'):
+        result[key] = round(result[key], 3)
+    return result
+
+
+def compare(results, baseline, tolerance, min_change_ms):
+    """Print metrics that moved by more than tolerance; return True if any got worse."""
+    earlier = {result['books']: result for result in baseline['results']}
+    regressed = False
+    for result in results:
+        old = earlier.get(result['books'])
+        if old is None:
+            continue
+        for key, value in result.items():
+            if not key.endswith(('_s', '_ms', '_mb', '_per_s')) or not old.get(key):
+                continue
+            scale = 1000 if key.endswith('_s') and not key.endswith('_per_s') else 1 if key.endswith('_ms') else None
+            if scale and abs(value - old[key]) * scale < min_change_ms:
+                continue
+            ratio = value / old[key]
+            worse = ratio < 1 - tolerance if key.endswith('_per_s') else ratio > 1 + tolerance
+            better = ratio > 1 + tolerance if key.endswith('_per_s') else ratio < 1 - tolerance
+            if worse or better:
+                print(f"{result['books']:>9} {key:<28} {old[key]:>10} -> {value:<10} {'WORSE' if worse else 'better'}")
+            regressed = regressed or worse
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,100000,1000000', help="book copies per run")
+    parser.add_argument('--max-students', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--ops', type=int, default=1000, help="checkouts and returns per size")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--skip-memory', action='store_true', help="skip the traced memory pass")
+    parser.add_argument('--dir', help="folder to create the temporary data in")
+    parser.add_argument('--report', default='scaling_report.json')
+    parser.add_argument('--baseline', help="earlier report to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--min-change-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{'books':>9} {'students':>8} {'cold s':>7} {'cached s':>8} {'MB':>6} {'suggest p95':>11} "
+          f"{'search p95':>10} {'ops/s':>6} {'rewrite s':>9}")
+    results = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        result = measure(size, min(max(size // 10, 100), args.max_students), args)
+        results.append(result)
+        print(f"{size:>9} {result['students']:>8} {result['cold_load_s']:>7.2f} {result['cached_load_s']:>8.2f} "
+              f"{result.get('memory_mb', 0):>6.0f} {result['suggest_p95_ms']:>11.2f} {result['search_p95_ms']:>10.2f} "
+              f"{result['checkout_return_ops_per_s']:>6} {result['csv_rewrite_s']:>9.2f}")
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scorer': get_scorer().name,
+        'seed': args.seed,
+        'results': results
+    }
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.report}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance, args.min_change_ms):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
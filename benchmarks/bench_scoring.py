@@ -0,0 +1,68 @@
+"""Compare title scoring backends on synthetic catalogs.
+
+Usage:
+    python benchmarks/bench_scoring.py [--sizes 1000,10000,100000,1000000] [--queries 20]
+
+For each catalog size and each installed backend this reports the mean
+latency of a full search over every title, a batched search over all
+queries at once, and an autocomplete lookup through the n-gram index.
+fuzzywuzzy is skipped above --fuzzywuzzy-limit titles because a single
+full scan takes minutes at that size.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_engine import FuzzyWuzzyScorer, TitleSearchIndex, get_scorer
+from synthetic import make_queries, make_titles
+
+
+def mean_ms(func, items):
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return (time.perf_counter() - start) * 1000 / len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--fuzzywuzzy-limit', type=int, default=100000)
+    args = parser.parse_args()
+
+    backends = [FuzzyWuzzyScorer()]
+    try:
+        backends.append(get_scorer('rapidfuzz'))
+    except ImportError:
+        print("rapidfuzz is not installed; only fuzzywuzzy will be measured")
+
+    print(f"{'titles':>9} {'backend':>11} {'build s':>8} {'search ms':>10} {'batch ms':>9} {'suggest ms':>11}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        titles = make_titles(size)
+        queries = make_queries(titles, args.queries)
+        for scorer in backends:
+            if scorer.name == 'fuzzywuzzy' and size > args.fuzzywuzzy_limit:
+                continue
+
+            start = time.perf_counter()
+            index = TitleSearchIndex(titles, scorer=scorer)
+            build = time.perf_counter() - start
+
+            search = mean_ms(lambda q: index.search(q, limit=5), queries)
+
+            processed = [scorer.preprocess(q) for q in queries]
+            start = time.perf_counter()
+            scorer.extract_many(processed, index.normalized, limit=5)
+            batch = (time.perf_counter() - start) * 1000 / len(queries)
+
+            suggest = mean_ms(lambda q: index.suggest(q, limit=10), queries)
+
+            print(f"{size:>9} {scorer.name:>11} {build:>8.2f} {search:>10.2f} {batch:>9.2f} {suggest:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Load-test the library service with concurrent simulated desks.
+
+Usage:
+    python benchmarks/bench_service.py [--desks 4] [--ops 500] [--backend csv|sqlite]
+    python benchmarks/bench_service.py --url http://127.0.0.1:8765 [--desks 4]
+
+Without --url a service is started in-process on a temporary synthetic
+library. Each desk runs its own keep-alive client and loops over a mix of
+searches, checkouts, returns and loan lookups; the report gives throughput
+and per-operation latency percentiles. Checkouts of a copy that another desk
+already took are counted as rejected, not as failures.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_engine import LibraryEngine
+from library_service import LibraryClient, LibraryService
+from synthetic import make_books, make_queries, make_students, make_titles, write_csv
+
+
+def start_service(directory, backend, titles, students, copies):
+    books = make_books(make_titles(titles), copies)
+    write_csv(os.path.join(directory, 'bookdata.csv'), books)
+    write_csv(os.path.join(directory, 'studentdetails.csv'), make_students(students))
+
+    def open_engine():
+        engine = LibraryEngine(
+            backend,
+            students_path=os.path.join(directory, 'studentdetails.csv'),
+            books_path=os.path.join(directory, 'bookdata.csv'),
+            db_path=os.path.join(directory, 'library.db'),
+            purchases_path=os.path.join(directory, 'book_purchases.db'),
+            returns_path=os.path.join(directory, 'book_returns.db')
+        )
+        engine.load()
+        return engine
+
+    service = LibraryService(('127.0.0.1', 0), open_engine)
+    threading.Thread(target=service.serve_forever, daemon=True).start()
+    return service, f"http://127.0.0.1:{service.server_address[1]}"
+
+
+def run_desk(client, seed, ops, students, barcodes, queries, latencies, counts):
+    rng = random.Random(seed)
+    on_loan = []
+    for _ in range(ops):
+        roll = rng.random()
+        if roll < 0.4:
+            op, call = 'search', lambda: client.search(rng.choice(queries))
+        elif roll < 0.7 or not on_loan:
+            barcode = rng.choice(barcodes)
+            school_id = rng.choice(students)
+            op, call = 'checkout', lambda: (client.checkout(school_id, barcode), on_loan.append((school_id, barcode)))
+        elif roll < 0.9:
+            school_id, barcode = on_loan.pop(rng.randrange(len(on_loan)))
+            op, call = 'return', lambda: client.checkin(barcode, school_id)
+        else:
+            op, call = 'loans', lambda: client.open_loans(rng.choice(students))
+
+        start = time.perf_counter()
+        try:
+            call()
+            outcome = 'ok'
+        except ValueError:
+            outcome = 'rejected'
+        except Exception:
+            outcome = 'failed'
+        latencies.setdefault(op, []).append((time.perf_counter() - start) * 1000)
+        counts[outcome] = counts.get(outcome, 0) + 1
+    client.close()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help="existing service to test instead of an in-process one")
+    parser.add_argument('--desks', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=500, help="operations per desk")
+    parser.add_argument('--backend', choices=['csv', 'sqlite'], default='sqlite')
+    parser.add_argument('--titles', type=int, default=5000)
+    parser.add_argument('--copies', type=int, default=3)
+    parser.add_argument('--students', type=int, default=2000)
+    args = parser.parse_args()
+
+    service = None
+    with tempfile.TemporaryDirectory() as directory:
+        url = args.url
+        if url is None:
+            service, url = start_service(directory, args.backend, args.titles, args.students, args.copies)
+
+        catalog = LibraryClient(url).request('GET', '/catalog')
+        students = [s['school_id'] for s in catalog['students']]
+        barcodes = [b['barcode'] for b in catalog['books']]
+        queries = make_queries(sorted({b['title'] for b in catalog['books']}), 50)
+
+        latencies = [{} for _ in range(args.desks)]
+        counts = [{} for _ in range(args.desks)]
+        desks = [
+            threading.Thread(
+                target=run_desk,
+                args=(LibraryClient(url), seed, args.ops, students, barcodes, queries, latencies[seed], counts[seed])
+            )
+            for seed in range(args.desks)
+        ]
+        start = time.perf_counter()
+        for desk in desks:
+            desk.start()
+        for desk in desks:
+            desk.join()
+        elapsed = time.perf_counter() - start
+
+        if service is not None:
+            service.shutdown()
+            service.server_close()
+
+    total = args.desks * args.ops
+    print(f"{args.desks} desks x {args.ops} ops: {total / elapsed:.0f} requests/s over {elapsed:.2f}s")
+    outcomes = {}
+    for desk_counts in counts:
+        for outcome, count in desk_counts.items():
+            outcomes[outcome] = outcomes.get(outcome, 0) + count
+    print("outcomes: " + ", ".join(f"{k} {v}" for k, v in sorted(outcomes.items())))
+    print(f"{'operation':>10} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for op in ('search', 'checkout', 'return', 'loans'):
+        values = [v for desk in latencies for v in desk.get(op, [])]
+        if values:
+            print(f"{op:>10} {len(values):>6} {percentile(values, 0.5):>8.2f} "
+                  f"{percentile(values, 0.95):>8.2f} {max(values):>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Deterministic synthetic data for the benchmarks.
+
+Run directly to write a synthetic library for trying the desk app at scale:
+    python benchmarks/synthetic.py --books 100000 --students 10000 --out DIR
+"""
+import argparse
+import csv
+import os
+import random
+
+TOPICS = {
+    'Programming': ['Python', 'Java', 'Algorithms', 'Data Structures', 'Web Development', 'Databases'],
+    'Mathematics': ['Algebra', 'Calculus', 'Geometry', 'Statistics', 'Topology', 'Number Theory'],
+    'Science': ['Physics', 'Chemistry', 'Biology', 'Astronomy', 'Genetics', 'Ecology'],
+    'History': ['World War II', 'Ancient Rome', 'Medieval Europe', 'Asian History', 'Cold War'],
+    'Literature': ['Poetry', 'Drama', 'Short Stories', 'Mythology', 'Classic Novels'],
+    'Economics': ['Microeconomics', 'Macroeconomics', 'Finance', 'Accounting', 'Trade'],
+}
+
+PREFIXES = ['Introduction to', 'Advanced', 'Fundamentals of', 'Applied', 'Modern',
+            'A History of', 'Essentials of', 'Principles of', 'Practical', 'Exploring']
+SUFFIXES = ['', '', 'for Beginners', 'in Practice', 'Volume 2', 'Workbook',
+            'Handbook', 'Made Simple', 'and Applications', 'Third Edition']
+
+# Share of a school library's copies per topic
+TOPIC_WEIGHTS = {'Programming': 15, 'Mathematics': 25, 'Science': 25, 'History': 15,
+                 'Literature': 12, 'Economics': 8}
+
+# Copies per title: most titles are single copies, a few textbooks come in class sets
+COPY_COUNTS = [(1, 55), (2, 18), (3, 8), (5, 7), (10, 6), (30, 4), (60, 2)]
+
+FIRST_NAMES = ['Liam', 'Emma', 'Noah', 'Olivia', 'Ava', 'Lucas', 'Mia', 'Ethan', 'Sofia', 'Amara',
+               'Kavindu', 'Nethmi', 'Ishan', 'Dilini', 'Mohamed', 'Fatima', 'Arjun', 'Priya', 'Chen', 'Yuki']
+LAST_NAMES = ['Johnson', 'Williams', 'Perera', 'Fernando', 'Silva', 'Jayawardena', 'Brown', 'Garcia',
+              'Kumar', 'Rahman', 'Wang', 'Tanaka', 'Smith', 'Dissanayake', 'Bandara', 'Lopez']
+
+
+def make_titles(count, seed=42):
+    """Return `count` distinct-ish titles; the same seed always gives the same list."""
+    rng = random.Random(seed)
+    subjects = [(topic, subject) for topic, items in TOPICS.items() for subject in items]
+    titles = []
+    for i in range(count):
+        _, subject = rng.choice(subjects)
+        title = f"{rng.choice(PREFIXES)} {subject} {rng.choice(SUFFIXES)}".strip()
+        # Keep the title space open-ended so large runs are not all duplicates
+        titles.append(f"{title} {i // 50}" if i >= 50 else title)
+    return titles
+
+
+def make_queries(titles, count, seed=7):
+    """Return typo-laden queries drawn from the given titles."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        words = rng.choice(titles).lower().split()
+        query = ' '.join(words[:rng.randint(1, len(words))])
+        if len(query) > 4:
+            # Drop one character to simulate a typo
+            cut = rng.randrange(len(query))
+            query = query[:cut] + query[cut + 1:]
+        queries.append(query)
+    return queries
+
+
+def make_students(count, classes=12, seed=42):
+    """Return `count` students spread evenly over `classes` classes."""
+    rng = random.Random(seed)
+    return [
+        {'school_id': f"S{i:07d}", 'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+         'class': f"{i % classes + 1:02d}th"}
+        for i in range(count)
+    ]
+
+
+def make_books(titles, copies=1):
+    """Return `copies` available copies of each title with sequential barcodes."""
+    return [
+        {'barcode': f"B{i * copies + c:08d}", 'title': title, 'topic': 'General', 'is_purchased': 0}
+        for i, title in enumerate(titles) for c in range(copies)
+    ]
+
+
+def make_library(copies, seed=42):
+    """Return `copies` book copies shaped like a school library's catalog.
+
+    Topics follow TOPIC_WEIGHTS and copies per title COPY_COUNTS; about one
+    copy in fifty has its title entered in different case, as hand-typed
+    catalogs do. The same seed always gives the same books.
+    """
+    rng = random.Random(seed)
+    topics = list(TOPIC_WEIGHTS)
+    topic_weights = list(TOPIC_WEIGHTS.values())
+    counts = [count for count, _ in COPY_COUNTS]
+    count_weights = [weight for _, weight in COPY_COUNTS]
+    books = []
+    title_number = 0
+    while len(books) < copies:
+        topic = rng.choices(topics, topic_weights)[0]
+        title = f"{rng.choice(PREFIXES)} {rng.choice(TOPICS[topic])} {rng.choice(SUFFIXES)}".strip()
+        if title_number >= 50:
+            title = f"{title} {title_number // 50}"
+        title_number += 1
+        for _ in range(min(rng.choices(counts, count_weights)[0], copies - len(books))):
+            entered = title.lower() if rng.random() < 0.02 else title
+            books.append({'barcode': f"B{len(books):08d}", 'title': entered, 'topic': topic, 'is_purchased': 0})
+    return books
+
+
+def write_csv(path, rows):
+    """Write dict rows to a CSV file with a header from the first row."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic bookdata.csv and studentdetails.csv")
+    parser.add_argument('--books', type=int, default=100000, help="number of book copies")
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', default='.', help="folder to write the files to")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    write_csv(os.path.join(args.out, 'bookdata.csv'), make_library(args.books, args.seed))
+    write_csv(os.path.join(args.out, 'studentdetails.csv'), make_students(args.students, seed=args.seed))
+
+
+if __name__ == '__main__':
+    main()
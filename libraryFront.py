@@ -1,18 +1,164 @@
-import csv
+import time
+STARTUP_STARTED = time.perf_counter()  # Before the heavier imports, so the timeline counts them
+
+import argparse
 import os
-import sqlite3
+import queue
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import find_spec
 import tkinter as tk
 from tkinter import ttk, messagebox, font, filedialog
-from fuzzywuzzy import process
-from PIL import Image, ImageTk
-import webbrowser
-from fuzzywuzzy import process
-from fuzzywuzzy import fuzz
+from library_engine import (
+    DURABILITY_PROFILES, CsvValidationError, LibraryEngine, preflight_csv, read_csv_data, read_transactions,
+    revert_status, stat_files, write_batch_report
+)
+# PIL, webbrowser and library_service are imported where they are used, off the startup path
+
+class BackgroundExecutor:
+    """Single worker thread for jobs that must not block the Tk mainloop.
+
+    Jobs are queued with submit(); their results are handed back to the Tk
+    mainloop by polling with root.after, so callbacks always run on the UI thread.
+    """
+    def __init__(self, root, name, poll_interval=50):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.completed = queue.Queue()
+        self.pending = 0
+        self.on_pending_change = None
+        self.root.after(self.poll_interval, self.poll)
+
+    def run(self, func, *args):
+        """Run a job on the worker and block until it finishes (startup/shutdown only)."""
+        return self.executor.submit(func, *args).result()
+
+    def submit(self, func, *args, on_success=None, on_error=None):
+        """Queue a job; its callback runs on the UI thread once it completes."""
+        self.pending += 1
+        self.notify_pending()
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(lambda f: self.completed.put((f, on_success, on_error)))
+
+    def poll(self):
+        """Deliver finished jobs to their callbacks."""
+        while True:
+            try:
+                future, on_success, on_error = self.completed.get_nowait()
+            except queue.Empty:
+                break
+            self.pending -= 1
+            self.notify_pending()
+            error = future.exception()
+            if error is not None:
+                if on_error:
+                    on_error(error)
+            elif on_success:
+                on_success(future.result())
+        self.root.after(self.poll_interval, self.poll)
+
+    def notify_pending(self):
+        if self.on_pending_change:
+            self.on_pending_change(self.pending)
+
+    def shutdown(self):
+        """Finish queued jobs and stop the worker."""
+        self.executor.shutdown(wait=True)
+
+class AutocompleteScheduler:
+    """Debounced, cancellable suggestion pipeline shared by the autocomplete fields.
+
+    Each keystroke restarts a short timer for its field; when the timer fires
+    the matching runs on a background thread, and a result is applied only if
+    no newer input arrived for that field in the meantime.
+    """
+    def __init__(self, root, delay=120):
+        self.root = root
+        self.delay = delay
+        self.worker = BackgroundExecutor(root, 'library-autocomplete', poll_interval=20)
+        self.timers = {}       # Field -> pending after() id
+        self.generations = {}  # Field -> number of the latest request
+        self.latency = {}      # Field -> latency statistics in milliseconds
+
+    def request(self, field, compute, apply, delay=None, on_error=None):
+        """Schedule compute() for a field and pass its result to apply() on the UI thread."""
+        generation = self.cancel(field)
+        requested_at = time.perf_counter()
+        self.timers[field] = self.root.after(
+            self.delay if delay is None else delay,
+            lambda: self.dispatch(field, generation, compute, apply, requested_at, on_error)
+        )
+
+    def cancel(self, field):
+        """Drop any pending or running request for a field."""
+        timer = self.timers.pop(field, None)
+        if timer is not None:
+            self.root.after_cancel(timer)
+        self.generations[field] = self.generations.get(field, 0) + 1
+        return self.generations[field]
+
+    def dispatch(self, field, generation, compute, apply, requested_at, on_error=None):
+        self.timers.pop(field, None)
+
+        def timed():
+            started_at = time.perf_counter()
+            return compute(), (time.perf_counter() - started_at) * 1000
+
+        def deliver(outcome):
+            if generation != self.generations.get(field):
+                return  # Stale; newer input is already on its way
+            result, compute_ms = outcome
+            apply(result)
+            self.record_latency(field, compute_ms, (time.perf_counter() - requested_at) * 1000)
+
+        def fail(error):
+            if on_error and generation == self.generations.get(field):
+                on_error(error)
+
+        self.worker.submit(timed, on_success=deliver, on_error=fail)
+
+    def record_latency(self, field, compute_ms, total_ms):
+        stats = self.latency.setdefault(field, {'count': 0, 'last_ms': 0.0, 'avg_ms': 0.0, 'max_ms': 0.0, 'total_ms': 0.0})
+        stats['count'] += 1
+        stats['last_ms'] = compute_ms
+        stats['avg_ms'] += (compute_ms - stats['avg_ms']) / stats['count']
+        stats['max_ms'] = max(stats['max_ms'], compute_ms)
+        stats['total_ms'] = total_ms  # Last keystroke to suggestions shown, including debounce
+
+    def shutdown(self):
+        for field in list(self.timers):
+            self.cancel(field)
+        self.worker.shutdown()
+
+class StartupTimeline:
+    """Named checkpoints from process start to first paint, for --startup-timeline."""
+    def __init__(self, started=STARTUP_STARTED, enabled=False):
+        self.started = started
+        self.enabled = enabled
+        self.marks = []
+
+    def mark(self, label):
+        self.marks.append((label, time.perf_counter()))
+
+    def report(self):
+        """Return the checkpoints as lines of elapsed and step times in milliseconds."""
+        lines = [f"{'elapsed ms':>10} {'step ms':>8}  checkpoint"]
+        previous = self.started
+        for label, at in self.marks:
+            lines.append(f"{(at - self.started) * 1000:>10.1f} {(at - previous) * 1000:>8.1f}  {label}")
+            previous = at
+        return '\n'.join(lines)
 
 class LibraryManagementSystem:
-    def __init__(self):
+    def __init__(self, storage_backend='csv', server_url=None, students=None, books=None, file_stats=None,
+                 timeline=None):
+        self.timeline = timeline or StartupTimeline()
+        
         # Initialize main window with modern styling
         self.root = tk.Tk()
+        self.timeline.mark("Tk window")
         self.root.title("Library Management System")
         self.root.geometry("1000x700")
         self.root.minsize(900, 600)
@@ -43,11 +189,38 @@ class LibraryManagementSystem:
             'students': 'studentdetails.csv',
             'books': 'bookdata.csv'
         }
-        self.students = self.load_csv_data('students')
-        self.books = self.load_csv_data('books')
         
-        # Setup database
-        self.setup_database_connections()
+        # Suggestions for the autocomplete fields are computed off the UI thread
+        self.autocomplete = AutocompleteScheduler(self.root)
+        
+        # Form field widgets registered by the tab builders, keyed by field name
+        self.field_widgets = {}
+        
+        # Storage backend: 'csv' keeps book state in bookdata.csv with separate
+        # ledger databases, 'sqlite' keeps everything in one WAL-mode database.
+        # With a server_url the desk is a thin client of a shared library service.
+        self.storage_backend = 'remote' if server_url else storage_backend
+        self.server_url = server_url
+        self.db_path = 'library.db'
+        
+        # Setup database; the engine and its connections live on the I/O worker thread
+        self.io = BackgroundExecutor(self.root, 'library-io')
+        self.engine = self.io.run(self.setup_database_connections)
+        self.closed = False
+        
+        try:
+            # Rows validated by main()'s preflight are used as-is; otherwise the engine reads the files
+            self.catalog = self.io.run(self.engine.load, students, books, file_stats)
+        except Exception:
+            # Read the CSV files here instead so load errors are shown in a dialog
+            self.catalog = self.io.run(
+                self.engine.load,
+                self.load_csv_data('students'),
+                self.load_csv_data('books')
+            )
+        self.students = self.catalog.students
+        self.books = self.catalog.books
+        self.timeline.mark("catalog loaded")
         
         # Custom fonts
         self.title_font = font.Font(family='Helvetica', size=18, weight='bold')
@@ -58,6 +231,7 @@ class LibraryManagementSystem:
         # Configure styles
         self.style = ttk.Style()
         self.configure_styles()
+        self.timeline.mark("fonts and styles")
         
         # Create header frame
         self.create_header()
@@ -66,17 +240,46 @@ class LibraryManagementSystem:
         self.notebook = ttk.Notebook(self.root, style='Custom.TNotebook')
         self.notebook.pack(expand=True, fill='both', padx=20, pady=(0, 20))
         
-        # Create tabs
-        self.create_book_search_tab()
-        self.create_purchase_tab()
-        self.create_book_return_tab()
-        self.create_help_tab()
+        # Create tabs; only the search tab is built now, the rest on first selection
+        self.tab_builders = {}
+        self.build_tab(self.add_tab("🔍 Book Search", self.create_book_search_tab))
+        self.add_tab("🛒 Book Purchase", self.create_purchase_tab)
+        self.add_tab("↩️ Book Return", self.create_book_return_tab)
+        self.add_tab("📚 Class Distribution", self.create_distribution_tab)
+        self.add_tab("❓ Help", self.create_help_tab)
+        self.notebook.bind('<<NotebookTabChanged>>', lambda e: self.build_tab(self.notebook.select()))
+        self.timeline.mark("header and search tab built")
         
         # Status bar
         self.create_status_bar()
         
+        # Write-behind flusher: folds journaled book changes into the CSV in the
+        # background, starting with any journal left over from the last session
+        self.flush_running = False
+        self.refresh_running = False
+        self.reload_running = False
+        self.last_data_file_stats = None
+        self.flush_check_interval = 1000  # ms
+        self.check_book_flush()
+        
         # Center the window
         self.center_window()
+        self.timeline.mark("window laid out")
+    
+    def add_tab(self, text, builder):
+        """Add an empty tab whose contents builder(frame) creates on first selection."""
+        frame = ttk.Frame(self.notebook, padding=20)
+        self.notebook.add(frame, text=text)
+        self.tab_builders[str(frame)] = (builder, frame, text)
+        return str(frame)
+    
+    def build_tab(self, tab):
+        """Build a tab's widgets unless they already exist."""
+        entry = self.tab_builders.pop(tab, None)
+        if entry:
+            builder, frame, text = entry
+            builder(frame)
+            self.timeline.mark(f"built tab {text}")
     
     def center_window(self):
         """Center the window on screen"""
@@ -92,15 +295,17 @@ class LibraryManagementSystem:
         header_frame = tk.Frame(self.root, bg=self.colors['primary'], height=80)
         header_frame.pack(fill='x', padx=0, pady=0)
         
-        # Try to load logo image
-        try:
-            logo_img = Image.open('library_logo.png')  # Provide your own logo
-            logo_img = logo_img.resize((60, 60), Image.Resampling.LANCZOS)
-            self.logo = ImageTk.PhotoImage(logo_img)
-            logo_label = tk.Label(header_frame, image=self.logo, bg=self.colors['primary'])
-            logo_label.pack(side='left', padx=20, pady=10)
-        except:
-            pass  # Continue without logo if image not available
+        # Try to load logo image; PIL is only imported when there is one
+        if os.path.exists('library_logo.png'):  # Provide your own logo
+            try:
+                from PIL import Image, ImageTk
+                logo_img = Image.open('library_logo.png')
+                logo_img = logo_img.resize((60, 60), Image.Resampling.LANCZOS)
+                self.logo = ImageTk.PhotoImage(logo_img)
+                logo_label = tk.Label(header_frame, image=self.logo, bg=self.colors['primary'])
+                logo_label.pack(side='left', padx=20, pady=10)
+            except:
+                pass  # Continue without logo if image not readable
         
         # Application title
         title_label = tk.Label(
@@ -178,40 +383,18 @@ class LibraryManagementSystem:
                            pady=10)
     
     def setup_database_connections(self):
-        """Set up SQLite database connections for purchases and returns."""
-        # Purchase database
-        self.purchase_conn = sqlite3.connect('book_purchases.db')
-        self.purchase_cursor = self.purchase_conn.cursor()
-        self.create_purchases_table()
-        
-        # Returns database
-        self.return_conn = sqlite3.connect('book_returns.db')
-        self.return_cursor = self.return_conn.cursor()
-        self.create_returns_table()
-    
-    def create_purchases_table(self):
-        """Create purchases table in SQLite database."""
-        self.purchase_cursor.execute('''
-        CREATE TABLE IF NOT EXISTS book_purchases (
-            purchase_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            school_id TEXT,
-            book_barcode TEXT,
-            purchase_date DATETIME DEFAULT CURRENT_TIMESTAMP
+        """Create the library engine, which opens the ledger databases."""
+        if self.server_url:
+            from library_service import RemoteEngine
+            return RemoteEngine(self.server_url)
+        engine = LibraryEngine(
+            self.storage_backend,
+            students_path=self.csv_paths['students'],
+            books_path=self.csv_paths['books'],
+            db_path=self.db_path
         )
-        ''')
-        self.purchase_conn.commit()
-    
-    def create_returns_table(self):
-        """Create returns table in SQLite database."""
-        self.return_cursor.execute('''
-        CREATE TABLE IF NOT EXISTS book_returns (
-            return_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            school_id TEXT,
-            book_barcode TEXT,
-            return_date DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        self.return_conn.commit()
+        engine.auto_flush = False  # check_book_flush() flushes instead of the next checkout
+        return engine
     
     def load_csv_data(self, data_type):
         """Load data from CSV files with error handling."""
@@ -223,31 +406,14 @@ class LibraryManagementSystem:
             return data
         
         try:
-            with open(file_path, 'r', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    if data_type == 'students':
-                        data.append({
-                            'school_id': row.get('school_id', row.get('School ID', '')).strip(),
-                            'name': row.get('name', row.get('Name', '')).strip(),
-                            'class': row.get('class', row.get('Class', '')).strip()
-                        })
-                    elif data_type == 'books':
-                        data.append({
-                            'barcode': row.get('barcode', row.get('Barcode', '')).strip(),
-                            'title': row.get('title', row.get('Title', '')).strip(),
-                            'topic': row.get('topic', row.get('Topic', '')).strip(),
-                            'is_purchased': int(row.get('is_purchased', row.get('Is Purchased', 0)))
-                        })
+            data = read_csv_data(file_path, data_type)
         except Exception as e:
             messagebox.showerror("Error", f"Error loading {data_type} data: {str(e)}")
         
         return data
     
-    def create_book_search_tab(self):
+    def create_book_search_tab(self, search_frame):
         """Create the book search tab with fuzzy matching and autocomplete."""
-        search_frame = ttk.Frame(self.notebook, padding=20)
-        self.notebook.add(search_frame, text="🔍 Book Search")
         
         # Search container
         search_container = ttk.Frame(search_frame)
@@ -263,14 +429,15 @@ class LibraryManagementSystem:
             width=40, 
             style='TCombobox',
             font=self.label_font,
-            postcommand=self.update_search_suggestions  # Add this line
+            postcommand=self.refresh_search_suggestions
         )
         self.search_entry.pack(side='left', expand=True, fill='x', padx=(0, 10))
+        self.field_widgets['search'] = self.search_entry
         self.search_entry.bind('<KeyRelease>', self.update_search_suggestions)
         self.search_entry.bind('<Return>', lambda e: self.search_book())
         
         # Initialize with all book titles
-        self.search_entry['values'] = [book['title'] for book in self.books]
+        self.search_entry['values'] = self.catalog.live_titles()
         
         # Rest of the method remains the same...
         
@@ -322,28 +489,40 @@ class LibraryManagementSystem:
         
         if not current_text:
             # Show all books when search is empty
-            self.search_entry['values'] = [book['title'] for book in self.books]
+            self.autocomplete.cancel('search')
+            self.search_entry['values'] = self.catalog.live_titles()
             return
         
-        # Get matching book titles using fuzzy matching
-        book_titles = [book['title'] for book in self.books]
-        
-        # Use fuzzy matching for better results
-        matches = process.extract(current_text, book_titles, limit=10)
-        
-        # Extract just the titles from the matches
-        suggestions = [match[0] for match in matches if match[1] > 40]  # Only show matches with score > 40
-        
-        # If we have matches, update the combobox values
-        if suggestions:
-            self.search_entry['values'] = suggestions
+        self.autocomplete.request(
+            'search',
+            lambda: self.match_titles(current_text),
+            self.set_search_suggestions
+        )
+    
+    def refresh_search_suggestions(self):
+        """Fill the title dropdown right away when it is opened."""
+        current_text = self.search_var.get().lower()
+        self.autocomplete.cancel('search')
+        if not current_text:
+            self.search_entry['values'] = self.catalog.live_titles()
         else:
-            self.search_entry['values'] = []
+            self.set_search_suggestions(self.match_titles(current_text))
+    
+    def match_titles(self, current_text):
+        """Return title suggestions for the search box."""
+        # Only show matches with score > 40
+        return self.engine.suggest_titles(current_text, limit=10, score_cutoff=40)
+    
+    def set_search_suggestions(self, suggestions):
+        """Update the search combobox values."""
+        self.set_field_suggestions('search', suggestions)
+    
+    def set_field_suggestions(self, field, values):
+        """Update the dropdown values of a registered form field."""
+        self.field_widgets[field]['values'] = values
 
-    def create_purchase_tab(self):
+    def create_purchase_tab(self, purchase_frame):
         """Create the book purchase tab with improved design and autocomplete."""
-        purchase_frame = ttk.Frame(self.notebook, padding=20)
-        self.notebook.add(purchase_frame, text="🛒 Book Purchase")
         
         # Form container
         form_frame = ttk.Frame(purchase_frame)
@@ -365,7 +544,7 @@ class LibraryManagementSystem:
         ]
         
         # Get unique classes for dropdown
-        unique_classes = sorted(set(student['class'] for student in self.students))
+        unique_classes = self.catalog.classes()
         
         for label_text, attr_name, field_type in fields:
             # Create container for each field
@@ -398,9 +577,11 @@ class LibraryManagementSystem:
                     combobox.bind('<KeyRelease>', lambda e: self.update_student_suggestions())
                 elif label_text == "Enter Book Barcode:":
                     combobox.bind('<KeyRelease>', lambda e: self.update_barcode_suggestions())
+                    combobox.bind('<Return>', lambda e: self.add_to_cart())
                 
                 combobox.pack(side='left', expand=True, fill='x')
                 setattr(self, attr_name, var)
+                self.field_widgets[attr_name[:-len('_var')]] = combobox
         
         # Button container
         button_frame = ttk.Frame(form_frame)
@@ -418,12 +599,18 @@ class LibraryManagementSystem:
         # Add some visual separation
         ttk.Separator(purchase_frame, orient='horizontal').pack(fill='x', pady=10)
         
+        # Multi-book checkout cart
+        self.create_cart_section(purchase_frame)
+        
         # Quick help section
         help_text = """Instructions:
 1. Select your class from the dropdown
 2. Enter your school ID
 3. Enter the book barcode
-4. Click 'Purchase Book' to complete the transaction"""
+4. Click 'Purchase Book' to complete the transaction
+
+Several books: after steps 1-2, press Enter in the barcode field (or click
+'Add to Cart') for each book, then click 'Check Out Cart'."""
         
         ttk.Label(
             purchase_frame, 
@@ -433,53 +620,160 @@ class LibraryManagementSystem:
             justify='left'
         ).pack(fill='x', pady=10)
     
+    def create_cart_section(self, parent):
+        """Create the pending-books cart for checking out several books at once."""
+        self.cart = []
+        self.cart_student = None
+        
+        cart_frame = ttk.Frame(parent)
+        cart_frame.pack(fill='x', pady=(0, 10))
+        
+        header = ttk.Frame(cart_frame)
+        header.pack(fill='x')
+        ttk.Label(
+            header,
+            text="Checkout Cart",
+            font=self.subtitle_font,
+            style='TLabel'
+        ).pack(side='left')
+        self.cart_owner_var = tk.StringVar(value="Empty")
+        ttk.Label(header, textvariable=self.cart_owner_var, style='TLabel').pack(side='left', padx=10)
+        
+        self.cart_list = tk.Listbox(cart_frame, height=5, font=self.label_font)
+        self.cart_list.pack(fill='x', pady=5)
+        
+        buttons = ttk.Frame(cart_frame)
+        buttons.pack(fill='x')
+        ttk.Button(buttons, text="Add to Cart", command=self.add_to_cart, style='TButton').pack(side='left', padx=(0, 10))
+        ttk.Button(buttons, text="Check Out Cart", command=self.checkout_cart, style='TButton').pack(side='left', padx=(0, 10))
+        ttk.Button(buttons, text="Clear Cart", command=self.clear_cart, style='TButton').pack(side='left')
+    
+    def add_to_cart(self):
+        """Validate the student once and add the scanned barcode to the cart."""
+        student_class = self.class_var.get().strip()
+        school_id = self.school_id_var.get().strip()
+        book_barcode = self.barcode_var.get().strip()
+        
+        if not all([student_class, school_id, book_barcode]):
+            messagebox.showwarning("Missing Information", "Please fill in all fields")
+            self.update_status("Add to cart failed - missing information")
+            return
+        
+        if self.cart_student is None:
+            student = self.catalog.find_student(school_id, student_class)
+            if not student:
+                messagebox.showerror("Error", "Invalid student details. Please check your class and school ID.")
+                self.update_status("Add to cart failed - invalid student")
+                return
+            self.cart_student = student
+            self.cart_owner_var.set(f"for {student['name']} ({school_id})")
+        elif self.cart_student['school_id'] != school_id:
+            messagebox.showerror("Error", "The cart belongs to another student. Check it out or clear it first.")
+            return
+        
+        # Instant availability check; no dialogs so scanning can continue
+        self.barcode_var.set('')
+        book = self.catalog.find_book(book_barcode, is_purchased=0)
+        if not book:
+            self.root.bell()
+            self.update_status(f"{book_barcode} is not available")
+            return
+        if any(b is book for b in self.cart):
+            self.update_status(f"{book_barcode} is already in the cart")
+            return
+        
+        self.cart.append(book)
+        self.cart_list.insert(tk.END, f"{book['barcode']}  —  {book['title']}")
+        self.update_status(f"{len(self.cart)} book(s) in cart")
+    
+    def clear_cart(self):
+        """Empty the cart."""
+        self.cart = []
+        self.cart_student = None
+        self.cart_list.delete(0, tk.END)
+        self.cart_owner_var.set("Empty")
+    
+    def checkout_cart(self):
+        """Check out every book in the cart in a single transaction."""
+        if not self.cart:
+            messagebox.showwarning("Empty Cart", "Add at least one book to the cart first")
+            return
+        
+        student = self.cart_student
+        # Books may have been checked out elsewhere since they were added
+        books = [book for book in self.cart if book['is_purchased'] == 0]
+        if len(books) < len(self.cart):
+            messagebox.showerror("Error", "Some books in the cart are no longer available. Please clear the cart and try again.")
+            return
+        
+        confirm = messagebox.askyesno(
+            "Confirm Purchase",
+            f"Check out {len(books)} book(s) to:\n\nStudent: {student['name']}\nClass: {student['class']}"
+        )
+        if not confirm:
+            self.update_status("Purchase cancelled")
+            return
+        
+        # Update book status in memory
+        for book in books:
+            self.catalog.set_purchased(book, 1)
+        self.clear_cart()
+        
+        def purchases_recorded(_):
+            messagebox.showinfo("Success", f"{len(books)} book(s) checked out to {student['name']}")
+            self.class_var.set('')
+            self.school_id_var.set('')
+            self.update_status(f"{len(books)} book(s) checked out to {student['name']}")
+        
+        def purchases_failed(e):
+            revert_status(self.catalog, books, 0, e)
+            messagebox.showerror("Database Error", f"Could not record purchase: {str(e)}")
+            self.update_status("Purchase failed - database error")
+        
+        self.update_status(f"Checking out {len(books)} book(s)...")
+        self.io.submit(
+            self.engine.record_checkouts, [(student['school_id'], book) for book in books],
+            on_success=purchases_recorded,
+            on_error=purchases_failed
+        )
+    
     def update_student_suggestions(self):
         """Update student ID suggestions as user types."""
         current_text = self.school_id_var.get().lower()
         if not current_text:
+            self.autocomplete.cancel('school_id')
             return
         
-        # Get matching student IDs
-        student_ids = [student['school_id'] for student in self.students]
-        matches = [sid for sid in student_ids if current_text in sid.lower()]
-        
-        # Find the combobox widget
-        for child in self.notebook.winfo_children():
-            if isinstance(child, ttk.Frame) and "Purchase" in child.winfo_name():
-                for widget in child.winfo_children():
-                    if isinstance(widget, ttk.Frame):
-                        for subwidget in widget.winfo_children():
-                            if isinstance(subwidget, ttk.Combobox):
-                                if subwidget.get() == current_text:
-                                    subwidget['values'] = matches[:10]
-                                    return
+        self.autocomplete.request(
+            'school_id',
+            lambda: self.match_student_ids(current_text),
+            lambda matches: self.set_field_suggestions('school_id', matches)
+        )
+    
+    def match_student_ids(self, current_text, limit=10):
+        """Return school IDs starting with or containing the typed text."""
+        return self.catalog.search_student_ids(current_text, limit)
     
     def update_barcode_suggestions(self):
         """Update book barcode suggestions as user types."""
         current_text = self.barcode_var.get().lower()
         if not current_text:
+            self.autocomplete.cancel('barcode')
             return
         
-        # Get matching barcodes (only books that are available)
-        barcodes = [book['barcode'] for book in self.books if book['is_purchased'] == 0]
-        matches = [barcode for barcode in barcodes if current_text in barcode.lower()]
-        
-        # Find the purchase barcode combobox and update its values
-        for child in self.notebook.winfo_children():
-            if isinstance(child, ttk.Frame):
-                for widget in child.winfo_children():
-                    if isinstance(widget, ttk.Frame):
-                        for subframe in widget.winfo_children():
-                            if isinstance(subframe, ttk.Frame):
-                                for subwidget in subframe.winfo_children():
-                                    if isinstance(subwidget, ttk.Combobox) and subwidget.get() == current_text:
-                                        subwidget['values'] = matches[:10]
-                                        return
+        # Only books that are available
+        self.autocomplete.request(
+            'barcode',
+            lambda: self.match_barcodes(current_text, is_purchased=0),
+            lambda matches: self.set_field_suggestions('barcode', matches)
+        )
+    
+    def match_barcodes(self, current_text, is_purchased, limit=10):
+        """Return barcodes with the given status starting with or containing the typed text."""
+        return self.catalog.search_barcodes(current_text, is_purchased, limit)
     
-    def create_book_return_tab(self):
+    def create_book_return_tab(self, return_frame):
         """Create the book return tab with autocomplete."""
-        return_frame = ttk.Frame(self.notebook, padding=20)
-        self.notebook.add(return_frame, text="↩️ Book Return")
         
         # Form container
         form_frame = ttk.Frame(return_frame)
@@ -501,7 +795,7 @@ class LibraryManagementSystem:
         ]
         
         # Get unique classes for dropdown
-        unique_classes = sorted(set(student['class'] for student in self.students))
+        unique_classes = self.catalog.classes()
         
         for label_text, attr_name, field_type in fields:
             # Create container for each field
@@ -537,6 +831,7 @@ class LibraryManagementSystem:
                 
                 combobox.pack(side='left', expand=True, fill='x')
                 setattr(self, attr_name, var)
+                self.field_widgets[attr_name[:-len('_var')]] = combobox
         
         # Button container
         button_frame = ttk.Frame(form_frame)
@@ -554,12 +849,18 @@ class LibraryManagementSystem:
         # Add some visual separation
         ttk.Separator(return_frame, orient='horizontal').pack(fill='x', pady=10)
         
+        # Express return lane: the barcode alone identifies the borrower
+        self.create_express_return_section(return_frame)
+        
         # Quick help section
         help_text = """Instructions:
 1. Select your class from the dropdown
 2. Enter your school ID
 3. Enter the book barcode
-4. Click 'Return Book' to complete the transaction"""
+4. Click 'Return Book' to complete the transaction
+
+Express return: scan a barcode into the Express Return box. The borrower is
+looked up automatically and the return is recorded without confirmation."""
         
         ttk.Label(
             return_frame, 
@@ -569,53 +870,253 @@ class LibraryManagementSystem:
             justify='left'
         ).pack(fill='x', pady=10)
     
+    def create_express_return_section(self, parent):
+        """Create the scan-only express return lane."""
+        express_frame = ttk.Frame(parent)
+        express_frame.pack(fill='x', pady=(0, 10))
+        
+        ttk.Label(
+            express_frame,
+            text="Express Return",
+            font=self.subtitle_font,
+            style='TLabel'
+        ).pack(anchor='w', pady=(0, 10))
+        
+        field_container = ttk.Frame(express_frame)
+        field_container.pack(fill='x')
+        
+        ttk.Label(
+            field_container,
+            text="Scan Book Barcode:",
+            style='TLabel',
+            width=20,
+            anchor='e'
+        ).pack(side='left', padx=(0, 10))
+        
+        self.express_barcode_var = tk.StringVar()
+        express_entry = ttk.Entry(
+            field_container,
+            textvariable=self.express_barcode_var,
+            font=self.label_font,
+            style='TEntry'
+        )
+        express_entry.pack(side='left', expand=True, fill='x')
+        express_entry.bind('<Return>', self.express_return)
+        self.field_widgets['express_barcode'] = express_entry
+        
+        # Running session counter and the outcome of the last scan
+        self.express_return_count = 0
+        self.express_count_var = tk.StringVar(value="Returned this session: 0")
+        ttk.Label(
+            field_container,
+            textvariable=self.express_count_var,
+            style='TLabel'
+        ).pack(side='left', padx=(10, 0))
+        
+        self.express_result_label = ttk.Label(express_frame, text="", style='TLabel')
+        self.express_result_label.pack(anchor='w', pady=(5, 0))
+    
+    def express_return(self, event=None):
+        """Return a scanned book to whoever holds it, without any dialogs."""
+        book_barcode = self.express_barcode_var.get().strip()
+        # Clear right away so the scanner can continue
+        self.express_barcode_var.set('')
+        if not book_barcode:
+            return
+        
+        book = self.catalog.find_book(book_barcode, is_purchased=1)
+        if not book:
+            self.show_express_result(f"✗ {book_barcode}: not checked out or unknown barcode", 'error')
+            self.update_status("Express return failed - book not checked out")
+            return
+        
+        # Update book status in memory
+        self.catalog.set_purchased(book, 0)
+        
+        def return_recorded(school_id):
+            self.express_return_count += 1
+            self.express_count_var.set(f"Returned this session: {self.express_return_count}")
+            student = self.catalog.find_student(school_id)
+            name = student['name'] if student else school_id
+            self.show_express_result(f"✓ {book['title']} ({book_barcode}) returned by {name}", 'success')
+            self.update_status(f"Book {book_barcode} returned by {name}")
+        
+        def return_failed(e):
+            revert_status(self.catalog, [book], 1, e)
+            self.show_express_result(f"✗ {book_barcode}: {str(e)}", 'error')
+            self.update_status("Express return failed - database error")
+        
+        self.io.submit(
+            self.engine.record_express_return, book,
+            on_success=return_recorded,
+            on_error=return_failed
+        )
+    
+    def show_express_result(self, message, color):
+        """Show the outcome of the last express scan."""
+        self.express_result_label.config(text=message, foreground=self.colors[color])
+    
     def update_return_student_suggestions(self):
         """Update student ID suggestions for return tab."""
         current_text = self.return_school_id_var.get().lower()
         if not current_text:
+            self.autocomplete.cancel('return_school_id')
             return
         
-        # Get matching student IDs
-        student_ids = [student['school_id'] for student in self.students]
-        matches = [sid for sid in student_ids if current_text in sid.lower()]
-        
-        # Find the combobox widget
-        for child in self.notebook.winfo_children():
-            if isinstance(child, ttk.Frame) and "Return" in child.winfo_name():
-                for widget in child.winfo_children():
-                    if isinstance(widget, ttk.Frame):
-                        for subwidget in widget.winfo_children():
-                            if isinstance(subwidget, ttk.Combobox):
-                                if subwidget.get() == current_text:
-                                    subwidget['values'] = matches[:10]
-                                    return
+        self.autocomplete.request(
+            'return_school_id',
+            lambda: self.match_student_ids(current_text),
+            lambda matches: self.set_field_suggestions('return_school_id', matches)
+        )
     
     def update_return_barcode_suggestions(self):
         """Update book barcode suggestions for return tab."""
         current_text = self.return_barcode_var.get().lower()
         if not current_text:
+            self.autocomplete.cancel('return_barcode')
             return
         
-        # Get matching barcodes (only books that are checked out)
-        barcodes = [book['barcode'] for book in self.books if book['is_purchased'] == 1]
-        matches = [barcode for barcode in barcodes if current_text in barcode.lower()]
-        
-        # Find the return barcode combobox and update its values
-        for child in self.notebook.winfo_children():
-            if isinstance(child, ttk.Frame):
-                for widget in child.winfo_children():
-                    if isinstance(widget, ttk.Frame):
-                        for subframe in widget.winfo_children():
-                            if isinstance(subframe, ttk.Frame):
-                                for subwidget in subframe.winfo_children():
-                                    if isinstance(subwidget, ttk.Combobox) and subwidget.get() == current_text:
-                                        subwidget['values'] = matches[:10]
-                                        return
+        # Only books that are checked out
+        self.autocomplete.request(
+            'return_barcode',
+            lambda: self.match_barcodes(current_text, is_purchased=1),
+            lambda matches: self.set_field_suggestions('return_barcode', matches)
+        )
     
-    def create_help_tab(self):
+    def create_distribution_tab(self, distribution_frame):
+        """Create the class-wide textbook distribution tab."""
+        
+        # Section header
+        ttk.Label(
+            distribution_frame,
+            text="Give Every Student in a Class One Copy of Each Title",
+            font=self.subtitle_font,
+            style='TLabel'
+        ).pack(pady=(0, 20))
+        
+        # Class selection
+        class_container = ttk.Frame(distribution_frame)
+        class_container.pack(fill='x', pady=10)
+        ttk.Label(
+            class_container,
+            text="Select Class:",
+            style='TLabel',
+            width=20,
+            anchor='e'
+        ).pack(side='left', padx=(0, 10))
+        self.distribution_class_var = tk.StringVar()
+        class_box = ttk.Combobox(
+            class_container,
+            textvariable=self.distribution_class_var,
+            values=self.catalog.classes(),
+            state='readonly',
+            font=self.label_font,
+            style='TCombobox'
+        )
+        class_box.pack(side='left', expand=True, fill='x')
+        self.field_widgets['distribution_class'] = class_box
+        
+        # Titles, one per line
+        titles_container = ttk.Frame(distribution_frame)
+        titles_container.pack(fill='x', pady=10)
+        ttk.Label(
+            titles_container,
+            text="Titles (one per line):",
+            style='TLabel',
+            width=20,
+            anchor='ne'
+        ).pack(side='left', anchor='n', padx=(0, 10))
+        self.distribution_titles = tk.Text(titles_container, height=6, font=self.label_font)
+        self.distribution_titles.pack(side='left', expand=True, fill='x')
+        
+        ttk.Button(
+            distribution_frame,
+            text="Allocate Books",
+            command=self.allocate_class,
+            style='TButton'
+        ).pack(pady=10, ipadx=20)
+        
+        # Allocation report
+        self.distribution_report = tk.Text(
+            distribution_frame,
+            height=8,
+            font=self.label_font,
+            state='disabled'
+        )
+        self.distribution_report.pack(fill='both', expand=True, pady=10)
+    
+    def allocate_class(self):
+        """Check out one available copy of each listed title to every student in a class."""
+        student_class = self.distribution_class_var.get().strip()
+        titles = [line.strip() for line in self.distribution_titles.get('1.0', tk.END).splitlines() if line.strip()]
+        
+        if not student_class or not titles:
+            messagebox.showwarning("Missing Information", "Please select a class and enter at least one title")
+            return
+        
+        students = self.catalog.students_in_class(student_class)
+        allocations, shortfalls = self.catalog.allocate(student_class, titles)
+        if not allocations:
+            self.show_distribution_report(student_class, titles, len(students), shortfalls, None)
+            self.update_status("Allocation failed - no copies available")
+            return
+        
+        confirm = messagebox.askyesno(
+            "Confirm Allocation",
+            f"Check out {len(allocations)} book(s) to {len(students)} student(s) in {student_class}?"
+        )
+        if not confirm:
+            self.update_status("Allocation cancelled")
+            return
+        
+        # Update book status in memory
+        for _, book in allocations:
+            self.catalog.set_purchased(book, 1)
+        
+        def allocation_recorded(_):
+            self.show_distribution_report(student_class, titles, len(students), shortfalls, len(allocations))
+            self.update_status(f"{len(allocations)} book(s) allocated to {student_class}")
+        
+        def allocation_failed(e):
+            revert_status(self.catalog, [book for _, book in allocations], 0, e)
+            messagebox.showerror("Database Error", f"Could not record allocation: {str(e)}")
+            self.update_status("Allocation failed - database error")
+        
+        self.update_status(f"Allocating {len(allocations)} book(s) to {student_class}...")
+        self.io.submit(
+            self.engine.record_checkouts,
+            [(student['school_id'], book) for student, book in allocations],
+            on_success=allocation_recorded,
+            on_error=allocation_failed
+        )
+    
+    def show_distribution_report(self, student_class, titles, student_count, shortfalls, allocated):
+        """Show per-title allocation results and shortfalls."""
+        lines = [f"Class {student_class}: {student_count} student(s)"]
+        if allocated is not None:
+            lines.append(f"Checked out {allocated} book(s)")
+        reported = set()
+        for title in titles:
+            record = self.catalog.title_record(title)
+            # Spelling variants of one title were allocated once, under the first spelling
+            if record is not None and id(record) in reported:
+                continue
+            if record is not None:
+                reported.add(id(record))
+            if record is None:
+                lines.append(f"{title}: not in catalog")
+            elif title in shortfalls:
+                lines.append(f"{record['title']}: short by {shortfalls[title]}")
+            else:
+                lines.append(f"{record['title']}: every student received a copy")
+        
+        self.distribution_report.configure(state='normal')
+        self.distribution_report.delete('1.0', tk.END)
+        self.distribution_report.insert(tk.END, '\n'.join(lines))
+        self.distribution_report.configure(state='disabled')
+    
+    def create_help_tab(self, help_frame):
         """Create a help/instructions tab."""
-        help_frame = ttk.Frame(self.notebook, padding=20)
-        self.notebook.add(help_frame, text="❓ Help")
         
         # Main container
         container = ttk.Frame(help_frame)
@@ -638,6 +1139,7 @@ Features:
 - 🔍 Book Search: Find books by title with fuzzy matching
 - 🛒 Book Purchase: Check out books to students
 - ↩️ Book Return: Process book returns
+- 📚 Class Distribution: Give a whole class one copy of each textbook
 
 Requirements:
 - studentdetails.csv - Contains student information
@@ -664,7 +1166,7 @@ For support, please contact your system administrator.
             cursor='hand2'
         )
         doc_link.pack(pady=10)
-        doc_link.bind('<Button-1>', lambda e: webbrowser.open("https://example.com/docs"))
+        doc_link.bind('<Button-1>', lambda e: open_url("https://example.com/docs"))
         
         # Version info
         version_info = ttk.Label(
@@ -679,21 +1181,152 @@ For support, please contact your system administrator.
         """Create a status bar at the bottom of the window."""
         self.status_var = tk.StringVar()
         self.status_var.set("Ready")
+        self.pending_var = tk.StringVar()
+        self.flush_var = tk.StringVar()
+        
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(side='bottom', fill='x')
+        
+        # Book changes waiting for the write-behind flush, and the last flush time
+        flush_label = ttk.Label(
+            status_frame,
+            textvariable=self.flush_var,
+            relief='sunken',
+            anchor='e',
+            width=34,
+            font=('Helvetica', 9)
+        )
+        flush_label.pack(side='right')
+        
+        # Pending background operations
+        pending_label = ttk.Label(
+            status_frame,
+            textvariable=self.pending_var,
+            relief='sunken',
+            anchor='e',
+            width=22,
+            font=('Helvetica', 9)
+        )
+        pending_label.pack(side='right')
         
         status_bar = ttk.Label(
-            self.root,
+            status_frame,
             textvariable=self.status_var,
             relief='sunken',
             anchor='w',
             font=('Helvetica', 9)
         )
-        status_bar.pack(side='bottom', fill='x')
+        status_bar.pack(side='left', fill='x', expand=True)
+        
+        self.io.on_pending_change = self.update_pending
+        self.update_pending(self.io.pending)
     
     def update_status(self, message):
         """Update the status bar message."""
         self.status_var.set(message)
         self.root.update_idletasks()
     
+    def update_pending(self, count):
+        """Show the number of queued database/file operations."""
+        self.pending_var.set(f"Pending operations: {count}" if count else "All changes saved")
+    
+    def check_book_flush(self):
+        """Take in other desks' changes, start a background CSV flush when one is due, and refresh the status."""
+        if self.closed:
+            return
+        if not self.refresh_running and self.engine.shared_changes_waiting():
+            # Another desk sharing the data folder changed some books
+            self.refresh_running = True
+            self.io.submit(
+                self.engine.refresh_shared_changes,
+                on_success=self.shared_changes_loaded,
+                on_error=lambda e: setattr(self, 'refresh_running', False)
+            )
+        if not self.reload_running and self.engine.data_files_changed():
+            # The CSV files were edited by hand; reload once the save has settled for one check
+            stats = self.engine.data_file_stats()
+            if stats == self.last_data_file_stats:
+                self.reload_running = True
+                self.io.submit(
+                    self.engine.reload_data_files,
+                    on_success=self.data_files_reloaded,
+                    on_error=self.data_file_reload_failed
+                )
+            self.last_data_file_stats = stats
+        if not self.flush_running and self.engine.flush_due():
+            self.flush_running = True
+            self.io.submit(
+                self.engine.flush_book_changes,
+                on_success=lambda _: self.book_flush_finished(),
+                on_error=self.book_flush_failed
+            )
+        self.update_flush_status()
+        self.root.after(self.flush_check_interval, self.check_book_flush)
+    
+    def shared_changes_loaded(self, books):
+        self.refresh_running = False
+        if books:
+            self.update_status(f"{len(books)} book(s) updated by another desk")
+    
+    def data_files_reloaded(self, changes):
+        self.reload_running = False
+        if not changes:
+            return  # Nothing changed, or the file is still being saved
+        classes = self.catalog.classes()
+        for field in ('class', 'return_class', 'distribution_class'):
+            if field in self.field_widgets:
+                self.field_widgets[field]['values'] = classes
+        if not self.search_var.get():
+            self.search_entry['values'] = self.catalog.live_titles()
+        summary = [
+            f"{name}: +{inserted} ~{updated} -{deleted}"
+            for name, (inserted, updated, deleted) in changes.items()
+            if inserted or updated or deleted
+        ]
+        if summary:
+            self.update_status("Reloaded edited data files (" + ", ".join(summary) + ")")
+    
+    def data_file_reload_failed(self, error):
+        self.reload_running = False
+        if isinstance(error, CsvValidationError):
+            messagebox.showwarning(
+                "Data File Not Reloaded",
+                f"{error}\n\nThe app keeps using the data it has loaded until the file is fixed and saved again."
+            )
+            self.update_status("Edited data file has errors; not reloaded")
+        else:
+            self.show_io_error("Could not reload data files", error)
+    
+    def book_flush_finished(self):
+        self.flush_running = False
+        self.update_flush_status()
+    
+    def book_flush_failed(self, error):
+        """Report a failed flush once; the engine retries with a growing wait, shown in the status bar."""
+        self.book_flush_finished()
+        if self.engine.flush_failures == 1:
+            self.show_io_error("Could not update book CSV", error)
+        else:
+            self.update_status(f"Book CSV still not updated: {error}")
+    
+    def update_flush_status(self):
+        """Show the write-behind queue depth and the latency of the last flush."""
+        if self.storage_backend != 'csv':
+            self.flush_var.set("")
+            return
+        depth = self.engine.pending_journal_entries()
+        latency = self.engine.last_flush_seconds
+        queued = f"Unflushed book changes: {depth}" if depth else "Book file up to date"
+        if self.engine.flush_failures:
+            self.flush_var.set(queued + f" · flush failed {self.engine.flush_failures}x, retrying")
+            return
+        self.flush_var.set(queued + (f" · last flush {latency * 1000:.0f} ms" if latency is not None else ""))
+    
+    def show_io_error(self, message, error):
+        """Report a failed background operation."""
+        messagebox.showerror("Error", f"{message}: {str(error)}")
+        self.update_status("Error updating book inventory")
+    
     def search_book(self):
         """Search for books with fuzzy matching."""
         # Clear previous results
@@ -710,10 +1343,28 @@ For support, please contact your system administrator.
             return
         
         self.update_status(f"Searching for: {search_query}...")
+        self.search_results.config(state='disabled')
         
-        # Perform fuzzy matching on book titles
-        book_titles = [book['title'] for book in self.books]
-        matches = process.extract(search_query, book_titles, limit=5)
+        # Fuzzy matching scores every distinct title, so it runs on the
+        # autocomplete worker; a newer search supersedes this one
+        self.autocomplete.request(
+            'search_results',
+            lambda: self.engine.search(search_query, limit=5),
+            self.show_search_results,
+            delay=0,
+            on_error=self.show_search_error
+        )
+    
+    def show_search_error(self, error):
+        """Report a search that could not be completed."""
+        self.search_results.config(state='normal')
+        self.search_results.insert(tk.END, f"Search failed: {error}\n")
+        self.search_results.config(state='disabled')
+        self.update_status("Search failed")
+    
+    def show_search_results(self, matches):
+        """Display search results with availability."""
+        self.search_results.config(state='normal')
         
         if not matches:
             self.search_results.insert(tk.END, "No books found matching your search.\n")
@@ -722,23 +1373,21 @@ For support, please contact your system administrator.
             return
         
         # Display results with availability
-        for i, (match, score) in enumerate(matches):
-            # Find books matching this title
-            matching_books = [book for book in self.books if book['title'] == match]
-            
+        for i, match in enumerate(matches):
             # Insert title with styling
             self.search_results.insert(tk.END, f"{i+1}. ", 'title')
-            self.search_results.insert(tk.END, f"{match}\n", 'title')
+            self.search_results.insert(tk.END, f"{match['title']}\n", 'title')
             
             # Insert match score
-            self.search_results.insert(tk.END, f"  Match confidence: {score}%\n", 'match_score')
+            self.search_results.insert(tk.END, f"  Match confidence: {match['score']}%\n", 'match_score')
             
             # Count available and purchased books
-            available = sum(1 for b in matching_books if b['is_purchased'] == 0)
-            purchased = len(matching_books) - available
+            total = match['copies']
+            available = match['available']
+            purchased = total - available
             
             # Insert availability info
-            self.search_results.insert(tk.END, f"  Total copies: {len(matching_books)}\n")
+            self.search_results.insert(tk.END, f"  Total copies: {total}\n")
             self.search_results.insert(tk.END, f"  Available: ", 'available')
             self.search_results.insert(tk.END, f"{available}\n")
             self.search_results.insert(tk.END, f"  Checked out: ", 'unavailable')
@@ -746,9 +1395,8 @@ For support, please contact your system administrator.
             
             # Add barcodes of available books if any
             if available > 0:
-                available_barcodes = [b['barcode'] for b in matching_books if b['is_purchased'] == 0]
                 self.search_results.insert(tk.END, "  Available barcodes: ")
-                self.search_results.insert(tk.END, ", ".join(available_barcodes) + "\n")
+                self.search_results.insert(tk.END, ", ".join(match['available_barcodes']) + "\n")
             
             # Add separator between results
             if i < len(matches) - 1:
@@ -771,10 +1419,7 @@ For support, please contact your system administrator.
             return
         
         # Validate student
-        student = next((
-            s for s in self.students 
-            if s['school_id'] == school_id and s['class'] == student_class
-        ), None)
+        student = self.catalog.find_student(school_id, student_class)
         
         if not student:
             messagebox.showerror("Error", "Invalid student details. Please check your class and school ID.")
@@ -782,10 +1427,7 @@ For support, please contact your system administrator.
             return
         
         # Check if book exists and is available
-        book = next((
-            b for b in self.books 
-            if b['barcode'] == book_barcode and b['is_purchased'] == 0
-        ), None)
+        book = self.catalog.find_book(book_barcode, is_purchased=0)
         
         if not book:
             messagebox.showerror("Error", "Book not available. It may be checked out or the barcode may be incorrect.")
@@ -803,19 +1445,9 @@ For support, please contact your system administrator.
             return
         
         # Update book status in memory
-        book['is_purchased'] = 1
+        self.catalog.set_purchased(book, 1)
         
-        # Record the purchase in database
-        try:
-            self.purchase_cursor.execute('''
-                INSERT INTO book_purchases (school_id, book_barcode) 
-                VALUES (?, ?)
-            ''', (school_id, book_barcode))
-            self.purchase_conn.commit()
-            
-            # Update CSV 
-            self.update_book_csv()
-            
+        def purchase_recorded(_):
             # Show success message
             messagebox.showinfo(
                 "Success", 
@@ -828,9 +1460,19 @@ For support, please contact your system administrator.
             self.barcode_var.set('')
             
             self.update_status(f"Book {book_barcode} checked out to {student['name']}")
-        except Exception as e:
+        
+        def purchase_failed(e):
+            revert_status(self.catalog, [book], 0, e)
             messagebox.showerror("Database Error", f"Could not record purchase: {str(e)}")
             self.update_status("Purchase failed - database error")
+        
+        # Record the purchase in database
+        self.update_status(f"Checking out {book_barcode}...")
+        self.io.submit(
+            self.engine.record_checkouts, [(school_id, book)],
+            on_success=purchase_recorded,
+            on_error=purchase_failed
+        )
     
     def return_book(self):
         """Process book return with validation."""
@@ -846,10 +1488,7 @@ For support, please contact your system administrator.
             return
         
         # Validate student
-        student = next((
-            s for s in self.students 
-            if s['school_id'] == school_id and s['class'] == student_class
-        ), None)
+        student = self.catalog.find_student(school_id, student_class)
         
         if not student:
             messagebox.showerror("Error", "Invalid student details. Please check your class and school ID.")
@@ -857,22 +1496,29 @@ For support, please contact your system administrator.
             return
         
         # Check if book was previously purchased by this student
-        self.purchase_cursor.execute('''
-            SELECT * FROM book_purchases 
-            WHERE school_id = ? AND book_barcode = ?
-        ''', (school_id, book_barcode))
-        purchase_record = self.purchase_cursor.fetchone()
+        def purchase_checked(found):
+            self.confirm_return(student, student_class, school_id, book_barcode, found)
         
-        if not purchase_record:
+        def check_failed(e):
+            messagebox.showerror("Database Error", f"Could not check purchase record: {str(e)}")
+            self.update_status("Return failed - database error")
+        
+        self.update_status(f"Checking purchase record for {book_barcode}...")
+        self.io.submit(
+            self.engine.has_purchase_record, school_id, book_barcode,
+            on_success=purchase_checked,
+            on_error=check_failed
+        )
+    
+    def confirm_return(self, student, student_class, school_id, book_barcode, has_purchase_record):
+        """Finish validating a return once the purchase record lookup completes."""
+        if not has_purchase_record:
             messagebox.showerror("Error", "No record found of this student checking out this book.")
             self.update_status("Return failed - no purchase record")
             return
         
         # Find the book in memory
-        book = next((
-            b for b in self.books 
-            if b['barcode'] == book_barcode and b['is_purchased'] == 1
-        ), None)
+        book = self.catalog.find_book(book_barcode, is_purchased=1)
         
         if not book:
             messagebox.showerror("Error", "Book not found or already returned.")
@@ -890,19 +1536,9 @@ For support, please contact your system administrator.
             return
         
         # Update book status in memory
-        book['is_purchased'] = 0
+        self.catalog.set_purchased(book, 0)
         
-        # Record the return in database
-        try:
-            self.return_cursor.execute('''
-                INSERT INTO book_returns (school_id, book_barcode) 
-                VALUES (?, ?)
-            ''', (school_id, book_barcode))
-            self.return_conn.commit()
-            
-            # Update CSV 
-            self.update_book_csv()
-            
+        def return_recorded(_):
             # Show success message
             messagebox.showinfo(
                 "Success", 
@@ -915,63 +1551,129 @@ For support, please contact your system administrator.
             self.return_barcode_var.set('')
             
             self.update_status(f"Book {book_barcode} returned by {student['name']}")
-        except Exception as e:
+        
+        def return_failed(e):
+            revert_status(self.catalog, [book], 1, e)
             messagebox.showerror("Database Error", f"Could not record return: {str(e)}")
             self.update_status("Return failed - database error")
-    
-    def update_book_csv(self):
-        """Update the book CSV file with current data."""
-        try:
-            backup_path = self.csv_paths['books'] + '.bak'
-            
-            # Create backup first
-            if os.path.exists(self.csv_paths['books']):
-                os.replace(self.csv_paths['books'], backup_path)
-            
-            # Write new file
-            with open(self.csv_paths['books'], 'w', newline='', encoding='utf-8') as csvfile:
-                fieldnames = ['barcode', 'title', 'topic', 'is_purchased']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(self.books)
-            
-            self.update_status("Book inventory updated successfully")
-            return True
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not update book CSV: {str(e)}")
-            self.update_status("Error updating book inventory")
-            
-            # Try to restore backup
-            if os.path.exists(backup_path):
-                try:
-                    os.replace(backup_path, self.csv_paths['books'])
-                except:
-                    pass
-            
-            return False
+        
+        # Record the return in database
+        self.update_status(f"Returning {book_barcode}...")
+        self.io.submit(
+            self.engine.record_return, school_id, book,
+            on_success=return_recorded,
+            on_error=return_failed
+        )
     
     def run(self):
         """Run the application."""
         self.update_status("Ready")
+        self.root.after_idle(self.first_paint)
         self.root.mainloop()
+        self.shutdown()
+    
+    def first_paint(self):
+        """Runs once the mainloop has drawn the window."""
+        self.timeline.mark("first paint")
+        if self.timeline.enabled:
+            print(self.timeline.report())
+    
+    def shutdown(self):
+        """Drain queued I/O, leave a compact snapshot behind and close connections."""
+        if getattr(self, 'closed', True):
+            return
+        self.closed = True
+        
+        try:
+            self.io.run(self.engine.close)
+        except Exception as e:
+            print(f"Could not update book CSV: {str(e)}")
+        self.io.shutdown()
+        self.autocomplete.shutdown()
     
     def __del__(self):
         """Cleanup resources."""
-        if hasattr(self, 'purchase_conn'):
-            self.purchase_conn.close()
-        if hasattr(self, 'return_conn'):
-            self.return_conn.close()
+        self.shutdown()
+
+def run_batch(argv):
+    """Apply a file of offline transactions without starting the GUI."""
+    parser = argparse.ArgumentParser(
+        prog='libraryFront.py batch',
+        description="Apply offline checkouts and returns from a CSV or JSONL file."
+    )
+    parser.add_argument('transactions', help="CSV or JSONL file with action, class, school_id, barcode")
+    parser.add_argument('--backend', choices=['csv', 'sqlite'], default='csv')
+    parser.add_argument('--db', default='library.db', help="database for the sqlite backend")
+    parser.add_argument('--report', help="result file (default: <transactions>.report.csv)")
+    parser.add_argument('--group-size', type=int, default=5000)
+    parser.add_argument('--durability', choices=list(DURABILITY_PROFILES),
+                        help="SQLite durability profile (default: strict for csv, balanced for sqlite; "
+                             "bulk can corrupt the database on a power loss)")
+    args = parser.parse_args(argv)
+    
+    engine = LibraryEngine(args.backend, db_path=args.db, durability=args.durability)
+    engine.load()
+    
+    start = time.perf_counter()
+    try:
+        results = engine.apply_transactions(read_transactions(args.transactions), group_size=args.group_size)
+    finally:
+        engine.close()
+    elapsed = time.perf_counter() - start
+    
+    report_path = args.report or args.transactions + '.report.csv'
+    write_batch_report(report_path, results)
+    
+    applied = sum(1 for r in results if r[4] == 'ok')
+    rate = len(results) / elapsed if elapsed else 0
+    print(f"{len(results)} transactions in {elapsed:.2f}s ({rate:.0f}/s): "
+          f"{applied} applied, {len(results) - applied} rejected")
+    print(f"Report written to {report_path}")
+    return 0 if applied == len(results) else 1
+
+def run_server(argv):
+    """Serve the library over HTTP so several desks share one engine."""
+    parser = argparse.ArgumentParser(
+        prog='libraryFront.py serve',
+        description="Serve search, checkout, return and loan queries as a local JSON API."
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--backend', choices=['csv', 'sqlite'], default='csv')
+    parser.add_argument('--db', default='library.db', help="database for the sqlite backend")
+    parser.add_argument('--workers', type=int, default=16, help="request handler threads")
+    parser.add_argument('--durability', choices=list(DURABILITY_PROFILES),
+                        help="SQLite durability profile (default: strict for csv, balanced for sqlite)")
+    args = parser.parse_args(argv)
+    
+    def open_engine():
+        engine = LibraryEngine(args.backend, db_path=args.db, durability=args.durability)
+        engine.load()
+        return engine
+    
+    from library_service import LibraryService
+    service = LibraryService((args.host, args.port), open_engine, workers=args.workers)
+    print(f"Library service on http://{args.host}:{service.server_address[1]} (Ctrl+C to stop)")
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server_close()
+    return 0
+
+def open_url(url):
+    """Open a link in the browser; webbrowser is imported on the first click."""
+    import webbrowser
+    webbrowser.open(url)
 
 def check_requirements():
     """Check for required packages and install if missing."""
-    required = ['fuzzywuzzy', 'pillow']
-    missing = []
-    
-    for package in required:
-        try:
-            __import__(package)
-        except ImportError:
-            missing.append(package)
+    # Module name -> pip package; find_spec checks for a module without importing it
+    required = {'fuzzywuzzy': 'fuzzywuzzy', 'PIL': 'pillow'}
+    if find_spec('rapidfuzz'):
+        del required['fuzzywuzzy']  # Search uses rapidfuzz when it is installed
+    missing = [package for module, package in required.items() if find_spec(module) is None]
     
     if missing:
         import subprocess
@@ -990,6 +1692,27 @@ def check_requirements():
 
 def main():
     """Main entry point for the Library Management System application."""
+    # Headless modes: python libraryFront.py batch transactions.csv | serve
+    if sys.argv[1:2] == ['batch']:
+        sys.exit(run_batch(sys.argv[2:]))
+    if sys.argv[1:2] == ['serve']:
+        sys.exit(run_server(sys.argv[2:]))
+    
+    # Thin client: python libraryFront.py --server http://127.0.0.1:8765
+    parser = argparse.ArgumentParser(description="Library Management System")
+    parser.add_argument('--server', help="URL of a running library service")
+    parser.add_argument('--backend', choices=['csv', 'sqlite'], default='csv',
+                        help="csv keeps book status in bookdata.csv; sqlite keeps everything in library.db")
+    parser.add_argument('--startup-timeline', action='store_true',
+                        help="print where the time to first paint goes")
+    args = parser.parse_args()
+    timeline = StartupTimeline(enabled=args.startup_timeline)
+    timeline.mark("imports")
+    if args.server:
+        app = LibraryManagementSystem(server_url=args.server, timeline=timeline)
+        app.run()
+        return
+    
     try:
         # Check for required packages
         if not check_requirements():
@@ -999,10 +1722,12 @@ def main():
                 "Please check the console for details."
             )
             return
+        timeline.mark("requirements checked")
 
-        # Check for required CSV files
+        # Check for required CSV files; the sqlite backend only reads them to create library.db
         required_files = ['studentdetails.csv', 'bookdata.csv']
-        missing_files = [f for f in required_files if not os.path.exists(f)]
+        needs_csv = args.backend == 'csv' or not os.path.exists('library.db')
+        missing_files = [f for f in required_files if not os.path.exists(f)] if needs_csv else []
         
         if missing_files:
             root = tk.Tk()
@@ -1064,21 +1789,12 @@ def main():
                     "You can add these files later and restart the application."
                 )
 
-        # Verify minimum data requirements before starting
+        # Verify the data files before starting: one streaming pass whose rows go straight to the catalog
+        students = books = None
+        file_stats = stat_files(required_files)  # Before reading, so edits made meanwhile are picked up
         try:
-            # Check if student data exists and is not empty
-            if os.path.exists('studentdetails.csv'):
-                with open('studentdetails.csv', 'r') as f:
-                    reader = csv.reader(f)
-                    if len(list(reader)) <= 1:  # Just header or empty
-                        raise ValueError("Student data file is empty or contains only headers")
-            
-            # Check if book data exists and is not empty
-            if os.path.exists('bookdata.csv'):
-                with open('bookdata.csv', 'r') as f:
-                    reader = csv.reader(f)
-                    if len(list(reader)) <= 1:  # Just header or empty
-                        raise ValueError("Book data file is empty or contains only headers")
+            if needs_csv and all(os.path.exists(f) for f in required_files):
+                students, books = preflight_csv(*required_files)
         except Exception as e:
             messagebox.showerror(
                 "Data Error",
@@ -1088,7 +1804,10 @@ def main():
             return
 
         # Run the application
-        app = LibraryManagementSystem()
+        timeline.mark("data files checked")
+        app = LibraryManagementSystem(
+            args.backend, students=students, books=books, file_stats=file_stats, timeline=timeline
+        )
         
         # Set window icon if available
         try:
@@ -1109,8 +1828,4 @@ def main():
 
 
 if __name__ == "__main__":
-    # Add these imports at the top if not already present
-    import shutil
-    import csv
-    
     main()
\ No newline at end of file
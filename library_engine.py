@@ -0,0 +1,2243 @@
+"""Headless library core: catalog, search indexes, ledgers and persistence.
+
+Nothing here imports tkinter or PIL, so the engine can be used from scripts,
+services and benchmarks as well as from the desk application.
+"""
+import bisect
+import csv
+import gc
+import hashlib
+import io
+import itertools
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+import time
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+class FuzzyWuzzyScorer:
+    """WRatio scoring through fuzzywuzzy, one choice at a time."""
+    name = 'fuzzywuzzy'
+
+    def __init__(self):
+        from fuzzywuzzy import fuzz, process, utils
+        self.process = process
+        self.utils = utils
+        self.scorer = partial(fuzz.WRatio, full_process=False)
+
+    def preprocess(self, text):
+        """Normalize text once so choices are not reprocessed on every query."""
+        return self.utils.full_process(text, force_ascii=True)
+
+    def extract(self, query, choices, limit=5, score_cutoff=0):
+        """Return up to `limit` (index, score) pairs for preprocessed choices, best first."""
+        matches = self.process.extractBests(
+            query, dict(enumerate(choices)),
+            processor=None,
+            scorer=self.scorer,
+            score_cutoff=score_cutoff,
+            limit=limit
+        )
+        return [(index, score) for _, score, index in matches]
+
+    def extract_many(self, queries, choices, limit=5, score_cutoff=0):
+        """Run extract for each preprocessed query."""
+        return [self.extract(query, choices, limit, score_cutoff) for query in queries]
+
+class RapidFuzzScorer:
+    """WRatio scoring through rapidfuzz's batched C++ extractors.
+
+    Large choice lists are scored on every core with cdist, which needs numpy
+    (an optional install); without it they are scored on the calling thread
+    in slices, since each extractor call holds the GIL until it returns.
+    """
+    name = 'rapidfuzz'
+    PARALLEL_MIN_CHOICES = 20000  # Below this, starting the threads costs more than it saves
+    CHUNK_SIZE = 5000  # Choices per call, about 10 ms of holding the GIL
+
+    def __init__(self, workers=-1):
+        from rapidfuzz import fuzz as rf_fuzz, process as rf_process, utils as rf_utils
+        self.fuzz = rf_fuzz
+        self.process = rf_process
+        self.utils = rf_utils
+        self.workers = workers
+        self.parallel = workers != 1 and (os.cpu_count() or 1) > 1
+
+    def preprocess(self, text):
+        """Normalize text once so choices are not reprocessed on every query."""
+        return self.utils.default_process(text)
+
+    def extract(self, query, choices, limit=5, score_cutoff=0):
+        """Return up to `limit` (index, score) pairs for preprocessed choices, best first."""
+        if self.parallel and len(choices) >= self.PARALLEL_MIN_CHOICES:
+            try:
+                return self.extract_parallel(query, choices, limit, score_cutoff)
+            except ImportError:
+                self.parallel = False  # cdist needs numpy
+        
+        # Other threads (the desk's UI) get the GIL back between slices; the
+        # best `limit` so far raise the cutoff for the rest
+        best = []
+        for start in range(0, len(choices), self.CHUNK_SIZE):
+            matches = self.process.extract(
+                query, choices[start:start + self.CHUNK_SIZE],
+                scorer=self.fuzz.WRatio,
+                processor=None,
+                score_cutoff=score_cutoff,
+                limit=limit
+            )
+            best.extend((score, start + index) for _, score, index in matches)
+            # Ties go to the earlier choice, as within one call
+            best.sort(key=lambda match: (-match[0], match[1]))
+            del best[limit:]
+            if len(best) == limit:
+                score_cutoff = max(score_cutoff, best[-1][0])
+        return [(index, round(score)) for score, index in best]
+
+    def extract_parallel(self, query, choices, limit=5, score_cutoff=0):
+        """Score one query against many choices with cdist, splitting the choices across threads."""
+        # cdist divides its rows between the workers, so the choices go in as
+        # rows and the query as the single column; WRatio is symmetric
+        column = self.process.cdist(
+            choices, [query],
+            scorer=self.fuzz.WRatio,
+            processor=None,
+            score_cutoff=score_cutoff,
+            workers=self.workers
+        )[:, 0]
+        if len(column) > limit:
+            # Everything scoring at least the limit-th best, so ties go to the
+            # earlier choice as with process.extract
+            kth = column[column.argpartition(-limit)[-limit:]].min()
+            top = (column >= max(kth, score_cutoff)).nonzero()[0]
+        else:
+            top = (column >= score_cutoff).nonzero()[0]
+        best = sorted(map(int, top), key=lambda i: (-column[i], i))[:limit]
+        return [(i, round(float(column[i]))) for i in best]
+
+    def extract_many(self, queries, choices, limit=5, score_cutoff=0):
+        """Score many queries at once with a multithreaded cdist when numpy is available."""
+        try:
+            matrix = self.process.cdist(
+                queries, choices,
+                scorer=self.fuzz.WRatio,
+                processor=None,
+                score_cutoff=score_cutoff,
+                workers=self.workers
+            )
+        except ImportError:
+            # cdist needs numpy; fall back to one batched extract per query
+            return [self.extract(query, choices, limit, score_cutoff) for query in queries]
+        
+        results = []
+        for row in matrix:
+            best = row.argsort()[::-1][:limit]
+            results.append([(int(i), round(float(row[i]))) for i in best if row[i] > 0 and row[i] >= score_cutoff])
+        return results
+
+def get_scorer(backend=None):
+    """Return the requested scoring backend, preferring rapidfuzz when installed."""
+    if backend in (None, 'rapidfuzz'):
+        try:
+            return RapidFuzzScorer()
+        except ImportError:
+            if backend == 'rapidfuzz':
+                raise
+    return FuzzyWuzzyScorer()
+
+class TitleSearchIndex:
+    """Deduplicated, pre-normalized book titles with a character n-gram posting list."""
+    def __init__(self, titles, ngram_size=3, max_candidates=50, posting_budget=20000, scorer=None):
+        self.ngram_size = ngram_size
+        self.max_candidates = max_candidates
+        self.posting_budget = posting_budget
+        self.scorer = scorer or get_scorer()
+        self.titles = []       # Display titles, one per distinct normalized title
+        self.normalized = []   # Normalized form of each title
+        self.ids = {}          # Normalized title -> title id
+        self.keys = {}         # Raw title -> normalized title
+        self.postings = {}     # N-gram -> array of title ids
+        # title id << 16 | offset of a word start, ordered by the text from
+        # there on, for short queries; packed so the index pickles compactly
+        self.word_starts = array('q')
+
+        for title in titles:
+            self.add(title, keep_sorted=False)
+        self.word_starts = array('q', sorted(self.word_starts, key=self.word_start_text))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Scorers hold module references; store the backend name instead
+        state['scorer'] = self.scorer.name
+        del state['ids']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.scorer = get_scorer(state['scorer'])
+        self.ids = dict(zip(self.normalized, range(len(self.normalized))))
+        self.ids.pop('', None)  # Removed titles
+
+    def normalize(self, text):
+        """Normalize text the same way the scorer does before scoring."""
+        return self.scorer.preprocess(text)
+
+    def ngrams(self, text):
+        """Return the set of padded character n-grams of normalized text."""
+        padded = f' {text} '
+        n = self.ngram_size
+        return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+    def word_start_text(self, entry):
+        """Return the normalized title text from a word_starts entry's word on."""
+        return self.normalized[entry >> 16][entry & 0xFFFF:]
+
+    def key_for(self, title):
+        """Return the normalized key of a title, caching it per raw title."""
+        key = self.keys.get(title)
+        if key is None:
+            key = self.keys[title] = self.normalize(title)
+        return key
+
+    def add(self, title, keep_sorted=True):
+        """Index a title unless an equivalent one is already present."""
+        key = self.key_for(title)
+        if not key or key in self.ids:
+            return
+        
+        title_id = len(self.titles)
+        self.ids[key] = title_id
+        self.titles.append(title)
+        self.normalized.append(key)
+        for gram in self.ngrams(key):
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array('i')
+            posting.append(title_id)
+        position = 0
+        for word in key.split(' '):
+            if keep_sorted:
+                bisect.insort(self.word_starts, title_id << 16 | position, key=self.word_start_text)
+            else:
+                self.word_starts.append(title_id << 16 | position)
+            position += len(word) + 1
+
+    def remove_key(self, key):
+        """Drop a normalized title from results; ids of the other titles do not shift."""
+        title_id = self.ids.pop(key, None)
+        if title_id is None:
+            return
+        position = 0
+        for word in key.split(' '):
+            # Entries are ordered by their text, so this word's entry is among the equal ones
+            entry = title_id << 16 | position
+            i = bisect.bisect_left(self.word_starts, key[position:], key=self.word_start_text)
+            while self.word_starts[i] != entry:
+                i += 1
+            del self.word_starts[i]
+            position += len(word) + 1
+        # An empty normalized title never matches; its posting entries are skipped
+        self.normalized[title_id] = ''
+
+    def live_titles(self):
+        """Return the display titles, leaving out removed ones."""
+        if len(self.ids) == len(self.titles):
+            return self.titles
+        return [title for title, key in zip(self.titles, self.normalized) if key]
+
+    def candidates(self, query):
+        """Return ids of the titles sharing the most n-grams with a normalized query."""
+        if len(query) < self.ngram_size:
+            # Too short for n-grams; fall back to a word-prefix range scan
+            start = bisect.bisect_left(self.word_starts, query, key=self.word_start_text)
+            found = {}
+            for entry in self.word_starts[start:start + self.max_candidates]:
+                if not self.word_start_text(entry).startswith(query):
+                    break
+                found[entry >> 16] = None
+            return list(found)
+        
+        postings = sorted(
+            (self.postings[g] for g in self.ngrams(query) if g in self.postings),
+            key=len
+        )
+        # Count the rarest n-grams first and stop once the work budget is
+        # spent; common n-grams carry little signal and dominate the cost
+        counts = Counter()
+        scanned = 0
+        for posting in postings:
+            if scanned and scanned + len(posting) > self.posting_budget:
+                break
+            counts.update(posting)
+            scanned += len(posting)
+        return [title_id for title_id, _ in counts.most_common(self.max_candidates)]
+
+    def suggest(self, query, limit=10, score_cutoff=0):
+        """Return up to `limit` (title, score) pairs, best first."""
+        query = self.normalize(query)
+        if not query:
+            return []
+        
+        candidates = [title_id for title_id in self.candidates(query) if self.normalized[title_id]]
+        choices = [self.normalized[title_id] for title_id in candidates]
+        matches = self.scorer.extract(query, choices, limit, score_cutoff)
+        return [(self.titles[candidates[i]], score) for i, score in matches]
+
+    def search(self, query, limit=5, score_cutoff=0, normalized=None):
+        """Score every distinct title and return up to `limit` (title, score) pairs.
+
+        normalized may be a copy of self.normalized taken earlier, so the
+        scoring can run while the index changes: titles are only ever
+        appended, and removed ones blanked.
+        """
+        if normalized is None:
+            normalized = self.normalized
+        query = self.normalize(query)
+        if not query:
+            return []
+        
+        matches = self.scorer.extract(query, normalized, limit, score_cutoff)
+        return [(self.titles[i], score) for i, score in matches if normalized[i]]
+
+class IdentifierIndex:
+    """Sorted identifiers (school IDs, barcodes) for logarithmic prefix lookups.
+
+    Substring lookups fall back to a trigram posting list, which may be shared
+    between several indexes over subsets of the same identifiers.
+    """
+    def __init__(self, identifiers=(), postings=None, ngram_size=3):
+        self.ngram_size = ngram_size
+        self.keys = sorted((identifier.lower(), identifier) for identifier in identifiers)
+        if postings is None:
+            postings = self.build_postings(identifier for _, identifier in self.keys)
+        self.universe, self.postings = postings
+
+    @staticmethod
+    def build_postings(identifiers, ngram_size=3):
+        """Return (identifiers, trigram -> array of positions in identifiers)."""
+        universe = list(identifiers)
+        postings = {}
+        for position, identifier in enumerate(universe):
+            lower = identifier.lower()
+            for gram in {lower[i:i + ngram_size] for i in range(len(lower) - ngram_size + 1)}:
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array('i')
+                posting.append(position)
+        return universe, postings
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Keys become positions in the (shared) universe to keep the snapshot small
+        positions = {identifier: i for i, identifier in enumerate(self.universe)}
+        if all(identifier in positions for _, identifier in self.keys):
+            state['keys'] = array('i', [positions[identifier] for _, identifier in self.keys])
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if isinstance(self.keys, array):
+            identifiers = list(map(self.universe.__getitem__, self.keys))
+            self.keys = list(zip(map(str.lower, identifiers), identifiers))
+
+    def index(self, identifier):
+        """Make a new identifier findable by substring; postings may be shared, so once is enough."""
+        position = len(self.universe)
+        self.universe.append(identifier)
+        lower = identifier.lower()
+        n = self.ngram_size
+        for gram in {lower[i:i + n] for i in range(len(lower) - n + 1)}:
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array('i')
+            posting.append(position)
+
+    def add(self, identifier):
+        bisect.insort(self.keys, (identifier.lower(), identifier))
+
+    def remove(self, identifier):
+        key = (identifier.lower(), identifier)
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+
+    def contains(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def search(self, text, limit=10):
+        """Return up to `limit` identifiers starting with, then containing, the text."""
+        text = text.lower()
+        results = []
+        
+        # Prefix matches: one bisect plus a contiguous range
+        start = bisect.bisect_left(self.keys, (text,))
+        for lower, identifier in self.keys[start:start + limit]:
+            if not lower.startswith(text):
+                break
+            results.append(identifier)
+        if len(results) >= limit:
+            return results
+        
+        # Substring matches
+        seen = set(results)
+        n = self.ngram_size
+        if len(text) < n:
+            # Short fragments match almost everything; a bounded scan fills up fast
+            candidates = self.keys
+        else:
+            grams = [text[i:i + n] for i in range(len(text) - n + 1)]
+            if any(g not in self.postings for g in grams):
+                return results
+            # Walk the rarest trigram's posting list
+            posting = min((self.postings[g] for g in grams), key=len)
+            candidates = ((identifier.lower(), identifier) for identifier in map(self.universe.__getitem__, posting))
+        
+        for key in candidates:
+            lower, identifier = key
+            if text in lower and identifier not in seen and (candidates is self.keys or self.contains(key)):
+                results.append(identifier)
+                seen.add(identifier)
+                if len(results) >= limit:
+                    break
+        return results
+
+def diff_rows(current, rows, key, fields):
+    """Compare freshly read rows with loaded records (a dict by key).
+
+    Returns (inserted rows, [(record, row)] whose `fields` differ, deleted records).
+    """
+    inserted = []
+    updated = []
+    seen = set()
+    for row in rows:
+        seen.add(row[key])
+        record = current.get(row[key])
+        if record is None:
+            inserted.append(row)
+        elif any(record[field] != row[field] for field in fields):
+            updated.append((record, row))
+    deleted = [record for record_key, record in current.items() if record_key not in seen]
+    return inserted, updated, deleted
+
+class LibraryCatalog:
+    """In-memory catalog of books and students with hash indexes for desk lookups."""
+    def __init__(self, students, books, scorer=None):
+        self.students = students
+        self.books = books
+        # Held while the indexes change or are read; the desk's I/O, UI and
+        # autocomplete threads share the catalog
+        self.lock = threading.RLock()
+
+        # Hash indexes
+        self.students_by_id = {}
+        self.students_by_class = {}
+        self.books_by_barcode = {}
+        books_by_title = {}
+
+        for student in self.students:
+            self.students_by_id.setdefault(student['school_id'], student)
+            self.students_by_class.setdefault(student['class'], []).append(student)
+
+        for book in self.books:
+            self.books_by_barcode.setdefault(book['barcode'], book)
+            books_by_title.setdefault(book['title'], []).append(book)
+
+        # Identifier indexes for autocomplete; barcodes are split by status
+        # and share one trigram posting list
+        self.student_ids = IdentifierIndex(self.students_by_id)
+        barcode_postings = IdentifierIndex.build_postings(self.books_by_barcode)
+        self.available_barcodes = IdentifierIndex(
+            (b for b, book in self.books_by_barcode.items() if book['is_purchased'] == 0),
+            postings=barcode_postings
+        )
+        self.checked_out_barcodes = IdentifierIndex(
+            (b for b, book in self.books_by_barcode.items() if book['is_purchased'] != 0),
+            postings=barcode_postings
+        )
+
+        # Title search index for autocomplete
+        self.title_index = TitleSearchIndex(books_by_title, scorer=scorer)
+
+        # Feed of changes for catalog replicas (see LibraryService): barcodes whose
+        # status changed, None for any row-level change; off unless set to a list
+        self.change_log = None
+
+        # Title-level aggregates keyed by normalized title, so spelling
+        # variants of one title share a record
+        self.title_records = {}
+        self.packed_records = {}  # Records not yet rebuilt after loading a snapshot
+        for title, copies in books_by_title.items():
+            key = self.title_index.key_for(title)
+            record = self.title_records.get(key)
+            if record is None:
+                record = self.title_records[key] = {'title': title, 'copies': [], 'available': {}}
+            record['copies'].extend(copies)
+            for book in copies:
+                if book['is_purchased'] == 0:
+                    record['available'][id(book)] = book
+
+    def __getstate__(self):
+        # Books are stored as columns and the indexes over them as positions;
+        # rebuilding dicts from columns is much faster than unpickling them
+        state = self.__dict__.copy()
+        positions = {id(book): i for i, book in enumerate(self.books)}
+        shared = {}  # One string object per distinct title/topic, so each is pickled once
+        state['books'] = (
+            [book['barcode'] for book in self.books],
+            [shared.setdefault(book['title'], book['title']) for book in self.books],
+            [shared.setdefault(book['topic'], book['topic']) for book in self.books],
+            array('q', [book['is_purchased'] for book in self.books])
+        )
+        state['title_records'] = {}
+        state['packed_records'] = dict(self.packed_records)
+        state['change_log'] = None  # Belongs to the running service
+        del state['lock']
+        for key, record in self.title_records.items():
+            state['packed_records'][key] = (record['title'], array('i', [positions[id(book)] for book in record['copies']]))
+        del state['books_by_barcode']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        books = self.books = [
+            {'barcode': barcode, 'title': title, 'topic': topic, 'is_purchased': is_purchased}
+            for barcode, title, topic, is_purchased in zip(*state['books'])
+        ]
+        # First copy of a barcode wins, as in __init__
+        self.books_by_barcode = dict(zip(reversed(state['books'][0]), reversed(books)))
+        self.lock = threading.RLock()
+
+    def find_student(self, school_id, student_class=None):
+        """Return the student with this school ID (and class, if given) or None."""
+        student = self.students_by_id.get(school_id)
+        if student and student_class is not None and student['class'] != student_class:
+            return None
+        return student
+
+    def find_book(self, barcode, is_purchased=None):
+        """Return the book copy with this barcode (and status, if given) or None."""
+        book = self.books_by_barcode.get(barcode)
+        if book and is_purchased is not None and book['is_purchased'] != is_purchased:
+            return None
+        return book
+
+    def title_record(self, title):
+        """Return the aggregate record for a title or None.
+
+        A record holds the display 'title', all 'copies' and the currently
+        'available' copies keyed by id(book).
+        """
+        return self.record_for_key(self.title_index.key_for(title))
+
+    def record_for_key(self, key):
+        """Return the aggregate record for a normalized title, unpacking it on first use."""
+        with self.lock:
+            record = self.title_records.get(key)
+            if record is None and key in self.packed_records:
+                title, positions = self.packed_records.pop(key)
+                copies = list(map(self.books.__getitem__, positions))
+                record = self.title_records[key] = {
+                    'title': title,
+                    'copies': copies,
+                    'available': {id(book): book for book in copies if book['is_purchased'] == 0}
+                }
+            return record
+
+    def copies_of(self, title):
+        """Return all copies of a title."""
+        with self.lock:
+            record = self.title_record(title)
+            return list(record['copies']) if record else []
+
+    def students_in_class(self, student_class):
+        """Return all students in a class."""
+        with self.lock:
+            return list(self.students_by_class.get(student_class, []))
+
+    def classes(self):
+        """Return the sorted list of classes."""
+        with self.lock:
+            return sorted(self.students_by_class)
+
+    def live_titles(self):
+        """Return the display titles for the search dropdown."""
+        with self.lock:
+            return list(self.title_index.live_titles())
+
+    def suggest_titles(self, text, limit=10, score_cutoff=0):
+        """Return up to `limit` (title, score) autocomplete pairs, best first."""
+        with self.lock:
+            return self.title_index.suggest(text, limit, score_cutoff)
+
+    def search_titles(self, query, limit=5, score_cutoff=0):
+        """Score every distinct title and return up to `limit` (title, score) pairs."""
+        # Only the copy is taken under the lock; scoring every title would hold
+        # up status changes on the other threads
+        with self.lock:
+            normalized = list(self.title_index.normalized)
+        return self.title_index.search(query, limit, score_cutoff, normalized)
+
+    def search_student_ids(self, text, limit=10):
+        """Return up to `limit` school IDs matching typed text."""
+        with self.lock:
+            return self.student_ids.search(text, limit)
+
+    def search_barcodes(self, text, is_purchased, limit=10):
+        """Return up to `limit` barcodes with this status matching typed text."""
+        with self.lock:
+            index = self.available_barcodes if is_purchased == 0 else self.checked_out_barcodes
+            return index.search(text, limit)
+
+    def allocate(self, student_class, titles):
+        """Plan one available copy of each title for every student in a class.
+
+        Returns (allocations, shortfalls): a list of (student, book) pairs and
+        a dict mapping each requested title to the number of students left
+        without a copy. Nothing changes until the caller applies the plan.
+        """
+        with self.lock:
+            students = self.students_in_class(student_class)
+            allocations = []
+            shortfalls = {}
+            seen = set()
+            for title in titles:
+                key = self.title_index.key_for(title)
+                if key in seen:
+                    continue
+                seen.add(key)
+                record = self.record_for_key(key)
+                available = list(itertools.islice(record['available'].values(), len(students))) if record else []
+                allocations.extend(zip(students, available))
+                if len(available) < len(students):
+                    shortfalls[title] = len(students) - len(available)
+            return allocations, shortfalls
+
+    def apply_student_rows(self, rows):
+        """Bring the students in line with freshly read rows, touching only the ones that differ.
+
+        Returns (inserted, updated, deleted) counts. Student dicts are updated in
+        place, so references held elsewhere stay valid.
+        """
+        inserted, updated, deleted = diff_rows(self.students_by_id, rows, 'school_id', ('name', 'class'))
+        with self.lock:
+            for student, row in updated:
+                if row['class'] != student['class']:
+                    self.students_by_class[student['class']].remove(student)
+                    self.students_by_class.setdefault(row['class'], []).append(student)
+                student.update(row)
+            for student in deleted:
+                del self.students_by_id[student['school_id']]
+                self.students_by_class[student['class']].remove(student)
+                if not self.students_by_class[student['class']]:
+                    del self.students_by_class[student['class']]
+                self.student_ids.remove(student['school_id'])
+            if deleted:
+                gone = set(map(id, deleted))
+                self.students[:] = [student for student in self.students if id(student) not in gone]
+            for student in inserted:
+                self.students.append(student)
+                self.students_by_id[student['school_id']] = student
+                self.students_by_class.setdefault(student['class'], []).append(student)
+                self.student_ids.index(student['school_id'])
+                self.student_ids.add(student['school_id'])
+            if self.change_log is not None and (inserted or updated or deleted):
+                self.change_log.append(None)
+            return len(inserted), len(updated), len(deleted)
+
+    def apply_book_rows(self, rows):
+        """Bring the books in line with freshly read rows, touching only the ones that differ.
+
+        Title and topic edits apply to existing copies; their checkout status is
+        left alone, since the desks own it. New rows arrive with the status in
+        the file. Returns (inserted, updated, deleted) counts.
+        """
+        inserted, updated, deleted = diff_rows(self.books_by_barcode, rows, 'barcode', ('title', 'topic'))
+        with self.lock:
+            for book, row in updated:
+                if row['title'] != book['title']:
+                    self.detach_book(book)
+                    book['title'] = row['title']
+                    self.attach_book(book)
+                book['topic'] = row['topic']
+            if deleted:
+                # Packed records point at list positions, which are about to shift
+                for key in list(self.packed_records):
+                    self.record_for_key(key)
+            for book in deleted:
+                self.detach_book(book)
+                del self.books_by_barcode[book['barcode']]
+                (self.available_barcodes if book['is_purchased'] == 0 else self.checked_out_barcodes).remove(book['barcode'])
+            if deleted:
+                gone = set(map(id, deleted))
+                self.books[:] = [book for book in self.books if id(book) not in gone]
+            for book in inserted:
+                self.books.append(book)
+                self.books_by_barcode[book['barcode']] = book
+                self.attach_book(book)
+                self.available_barcodes.index(book['barcode'])  # Shared with checked_out_barcodes
+                (self.available_barcodes if book['is_purchased'] == 0 else self.checked_out_barcodes).add(book['barcode'])
+            if self.change_log is not None and (inserted or updated or deleted):
+                self.change_log.append(None)
+            return len(inserted), len(updated), len(deleted)
+
+    def attach_book(self, book):
+        """Add a copy to its title record, indexing the title if it is new."""
+        self.title_index.add(book['title'])
+        key = self.title_index.key_for(book['title'])
+        record = self.record_for_key(key)
+        if record is None:
+            record = self.title_records[key] = {'title': book['title'], 'copies': [], 'available': {}}
+        record['copies'].append(book)
+        if book['is_purchased'] == 0:
+            record['available'][id(book)] = book
+
+    def detach_book(self, book):
+        """Remove a copy from its title record, dropping the title once no copies are left."""
+        key = self.title_index.key_for(book['title'])
+        record = self.record_for_key(key)
+        record['copies'] = [copy for copy in record['copies'] if copy is not book]
+        record['available'].pop(id(book), None)
+        if not record['copies']:
+            del self.title_records[key]
+            self.title_index.remove_key(key)
+
+    def set_purchased(self, book, is_purchased):
+        """Flip a copy's checkout status and keep the indexes in sync."""
+        with self.lock:
+            if book['is_purchased'] == is_purchased:
+                return
+            book['is_purchased'] = is_purchased
+            if self.change_log is not None:
+                self.change_log.append(book['barcode'])
+        
+            record = self.title_record(book['title'])
+            if is_purchased == 0:
+                record['available'][id(book)] = book
+            else:
+                record['available'].pop(id(book), None)
+        
+            if self.books_by_barcode.get(book['barcode']) is book:
+                if is_purchased == 0:
+                    self.checked_out_barcodes.remove(book['barcode'])
+                    self.available_barcodes.add(book['barcode'])
+                else:
+                    self.available_barcodes.remove(book['barcode'])
+                    self.checked_out_barcodes.add(book['barcode'])
+
+def stat_files(paths):
+    """Return (mtime_ns, size) of each file; None for a missing one."""
+    stats = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stats.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stats.append(None)
+    return tuple(stats)
+
+class CatalogUnpickler(pickle.Unpickler):
+    """Unpickler that only builds the classes a catalog snapshot holds.
+
+    The snapshot sits in the shared data folder, so anyone who can write
+    there must not be able to run code on the desks through it.
+    """
+    ALLOWED = {
+        (__name__, 'LibraryCatalog'), (__name__, 'TitleSearchIndex'), (__name__, 'IdentifierIndex'),
+        ('array', 'array'), ('array', '_array_reconstructor'),
+        ('builtins', 'set'), ('builtins', 'frozenset'), ('builtins', 'bytearray'),
+    }
+
+    def find_class(self, module, name):
+        if (module, name) not in self.ALLOWED:
+            raise pickle.UnpicklingError(f"{module}.{name} is not allowed in a catalog snapshot")
+        return super().find_class(module, name)
+
+class CatalogCache:
+    """Pickled LibraryCatalog snapshot, valid while its source files are unchanged.
+
+    A source matches when its size and mtime match; if only the mtime moved,
+    its content hash decides, so a touched but identical file still hits.
+    """
+    VERSION = 2
+
+    def __init__(self, path, sources):
+        self.path = path
+        self.sources = sources
+
+    @staticmethod
+    def content_hash(path):
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def matches(self, fingerprints):
+        """Check cached (path, size, mtime_ns, hash) fingerprints against the files."""
+        if [entry[0] for entry in fingerprints] != list(self.sources):
+            return False
+        for path, size, mtime_ns, content_hash in fingerprints:
+            stat = os.stat(path)
+            if stat.st_size != size:
+                return False
+            if stat.st_mtime_ns != mtime_ns and self.content_hash(path) != content_hash:
+                return False
+        return True
+
+    def header_matches(self, header, scorer_name):
+        return (
+            header['version'] == self.VERSION and header['scorer'] == scorer_name
+            and self.matches(header['sources'])
+        )
+
+    def is_fresh(self, scorer_name):
+        """Check whether load() would hit, reading only the snapshot's header."""
+        try:
+            with open(self.path, 'rb') as f:
+                return self.header_matches(CatalogUnpickler(f).load(), scorer_name)
+        except Exception:
+            return False
+
+    def load(self, scorer_name):
+        """Return the cached catalog, or None if it is missing or stale."""
+        try:
+            with open(self.path, 'rb') as f:
+                data = io.BytesIO(f.read())
+        except OSError:
+            return None
+
+        gc.disable()  # Unpickling builds millions of objects; skip the collector passes
+        try:
+            if not self.header_matches(CatalogUnpickler(data).load(), scorer_name):
+                return None
+            return CatalogUnpickler(data).load()
+        except Exception:
+            return None  # Unreadable or from an incompatible version; rebuild it
+        finally:
+            gc.enable()
+
+    def save(self, catalog, stats):
+        """Snapshot a catalog built from the sources as they were at `stats`.
+
+        stats holds stat_files() of the sources, taken when the catalog last
+        read or wrote them. If a source has changed since, nothing is saved and
+        False is returned: the catalog may not reflect that change yet.
+        """
+        if None in stats:
+            return False
+        fingerprints = []
+        for path, (mtime_ns, size) in zip(self.sources, stats):
+            content_hash = self.content_hash(path)
+            # Checked after hashing, so the hash is of the content the catalog saw
+            if stat_files([path])[0] != (mtime_ns, size):
+                return False
+            fingerprints.append((path, size, mtime_ns, content_hash))
+        header = {'version': self.VERSION, 'scorer': catalog.title_index.scorer.name, 'sources': fingerprints}
+        
+        temp_path = f"{self.path}.{os.getpid()}.tmp"  # Desks sharing a folder may save at once
+        with open(temp_path, 'wb') as f:
+            # The header goes first on its own so is_fresh() can stop after it
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            with catalog.lock:
+                pickle.dump(catalog, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+        return True
+
+class FileLock:
+    """Advisory lock shared by every process using the same data folder.
+
+    Locks a side file with fcntl (POSIX) or msvcrt (Windows); re-entrant
+    within one owner. The file also holds the snapshot generation, bumped on
+    every CSV rewrite, so a process can tell another one replaced the snapshot,
+    and the file stats that rewrite started from and produced (see rewrite_stats()).
+    waited/acquired count the time spent blocked and the lock acquisitions.
+    """
+    # Windows byte-range locks are mandatory, so the locked byte lies far past
+    # the generation number, which other processes read without the lock
+    LOCK_OFFSET = 1 << 30
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self.depth = 0
+        self.waited = 0.0
+        self.acquired = 0
+        self._file = None
+
+    def acquire(self):
+        if self.depth:
+            self.depth += 1
+            return
+        # Read-write without O_APPEND, so bump_generation() can rewrite in place
+        self._file = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT), 'r+b')
+        started = time.perf_counter()
+        while True:
+            try:
+                self._lock()
+                break
+            except OSError:
+                if time.perf_counter() - started > self.timeout:
+                    self._file.close()
+                    self._file = None
+                    raise TimeoutError(f"Timed out waiting for {self.path}; another desk is holding it")
+                time.sleep(0.005)
+        self.waited += time.perf_counter() - started
+        self.acquired += 1
+        self.depth = 1
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            self._unlock()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    if os.name == 'nt':
+        def _lock(self):
+            self._file.seek(self.LOCK_OFFSET)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+
+        def _unlock(self):
+            self._file.seek(self.LOCK_OFFSET)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        def _lock(self):
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        def _unlock(self):
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def read_record(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return [int(field) for field in f.read().split()]
+        except (OSError, ValueError):
+            return []
+
+    def generation(self):
+        """Return the snapshot generation (0 if never written); readable without the lock."""
+        record = self.read_record()
+        return record[0] if record else 0
+
+    def rewrite_stats(self):
+        """Return (based_on, written) stat_files() entries of the latest rewrite, or None."""
+        record = self.read_record()
+        if len(record) != 5:
+            return None
+        return tuple(record[1:3]), tuple(record[3:5])
+
+    def bump_generation(self, based_on=None, written=None):
+        """Record a new snapshot; call while holding the lock.
+
+        based_on and written are the (mtime_ns, size) of the file before and
+        after the rewrite, letting other processes tell it from a hand edit.
+        """
+        generation = self.generation() + 1
+        fields = [generation, *(based_on or (0, 0)), *(written or (0, 0))]
+        # One fixed-width write over the old record: a reader never sees the file empty
+        self._file.seek(0)
+        self._file.write(' '.join(f"{field:020d}" for field in fields).encode('ascii'))
+        self._file.truncate()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return generation
+
+class ConcurrentUpdateError(ValueError):
+    """Another process changed books this one was about to write.
+
+    The catalog already holds their current status, so callers must not roll
+    these books back; `barcodes` names them.
+    """
+    def __init__(self, barcodes):
+        self.barcodes = set(barcodes)
+        super().__init__(
+            f"Book(s) {', '.join(sorted(self.barcodes))} were just changed at another desk; "
+            "the catalog has been refreshed, please try again"
+        )
+
+def revert_status(catalog, books, is_purchased, error):
+    """Roll back an optimistic status change after a failed write.
+
+    Books named by a ConcurrentUpdateError keep the status it loaded.
+    """
+    refreshed = error.barcodes if isinstance(error, ConcurrentUpdateError) else ()
+    for book in books:
+        if book['barcode'] not in refreshed:
+            catalog.set_purchased(book, is_purchased)
+
+class BookJournal:
+    """Append-only journal of book status changes layered over the CSV snapshot."""
+    def __init__(self, path):
+        self.path = path
+        self.entries = 0
+        self._file = None
+
+    def append(self, barcode, is_purchased):
+        """Durably append one status change."""
+        self.append_many([(barcode, is_purchased)])
+
+    def append_many(self, changes):
+        """Durably append several (barcode, is_purchased) changes with one fsync."""
+        if self._file is None:
+            self._file = open(self.path, 'a+', newline='', encoding='utf-8')
+            # Terminate a torn trailing record so the next one starts cleanly
+            if self._file.tell() > 0:
+                self._file.seek(self._file.tell() - 1)
+                if self._file.read(1) != '\n':
+                    self._file.write('\r\n')
+        count = len(changes)
+        csv.writer(self._file).writerows(changes)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.entries += count
+        return self._file.tell()
+
+    def read_since(self, offset, path=None):
+        """Return ([(barcode, is_purchased)], end offset) for complete entries after offset."""
+        try:
+            with open(path or self.path, 'rb') as journal:
+                journal.seek(offset)
+                data = journal.read()
+        except FileNotFoundError:
+            return [], offset
+        # A record still being written by another process is left for next time
+        end = data.rfind(b'\n') + 1
+        changes = []
+        for row in csv.reader(data[:end].decode('utf-8').splitlines()):
+            self.entries += 1
+            try:
+                changes.append((row[0], int(row[1])))
+            except (IndexError, ValueError):
+                continue  # Torn write from an interrupted append
+        return changes, offset + end
+
+    def truncate(self):
+        """Discard all entries once they are folded into a snapshot.
+
+        The last journal is kept as <path>.prev so a process that had not read
+        all of it yet can still catch up without reloading the whole CSV.
+        """
+        self.close()
+        if os.path.exists(self.path):
+            shutil.copyfile(self.path, self.path + '.prev')
+            # Emptied in place rather than removed: other processes may hold it open for appending
+            with open(self.path, 'r+b') as journal:
+                journal.truncate()
+        else:
+            open(self.path + '.prev', 'wb').close()
+        self.entries = 0
+
+    def close(self):
+        """Close the journal file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def create_open_loans_table(conn, loans, loan_id, loan_date, returns, return_date):
+    """Create the open_loans table and history indexes, backfilling from the ledger.
+
+    open_loans holds exactly one row per checked-out barcode, so validating a
+    return is a single primary-key lookup regardless of how long the history is.
+    Table arguments name the loan/return history tables and their columns.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'open_loans'"
+    ).fetchone()
+    with conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS open_loans (
+            book_barcode TEXT PRIMARY KEY,
+            school_id TEXT NOT NULL,
+            loan_date DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_open_loans_school_id ON open_loans (school_id)')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{loans}_barcode ON {loans} (book_barcode, {loan_id})')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{loans}_school_id ON {loans} (school_id)')
+        # The returns table may live in an attached database ('schema.table')
+        schema, _, table = returns.rpartition('.')
+        prefix = f'{schema}.' if schema else ''
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {prefix}idx_{table}_barcode ON {table} (book_barcode, {return_date})')
+    if not exists:
+        rebuild_open_loans(conn, loans, loan_id, loan_date, returns, return_date)
+
+def rebuild_open_loans(conn, loans, loan_id, loan_date, returns, return_date):
+    """Recompute open_loans: each barcode's latest loan with no return after it.
+
+    Dates have one-second resolution, so a return in the same second as the
+    latest loan may have come before or after it. Loans and returns of a
+    barcode alternate, so such a loan is open while the barcode has more
+    loans than returns.
+    """
+    with conn:
+        conn.execute('DELETE FROM open_loans')
+        conn.execute(f'''
+        INSERT INTO open_loans (book_barcode, school_id, loan_date)
+        SELECT l.book_barcode, l.school_id, l.{loan_date} FROM {loans} l
+        WHERE l.{loan_id} = (SELECT MAX({loan_id}) FROM {loans} WHERE book_barcode = l.book_barcode)
+        AND NOT EXISTS (
+            SELECT 1 FROM {returns} r
+            WHERE r.book_barcode = l.book_barcode AND r.{return_date} > l.{loan_date}
+        )
+        AND (
+            NOT EXISTS (
+                SELECT 1 FROM {returns} r
+                WHERE r.book_barcode = l.book_barcode AND r.{return_date} = l.{loan_date}
+            )
+            OR (SELECT COUNT(*) FROM {returns} WHERE book_barcode = l.book_barcode)
+                < (SELECT COUNT(*) FROM {loans} WHERE book_barcode = l.book_barcode)
+        )
+        ''')
+
+# SQLite settings per durability profile:
+#   strict   - rollback journal, fsync on every commit; commits spanning the
+#              attached ledger files stay atomic across a power loss
+#   balanced - WAL with synchronous=NORMAL: a commit survives an application
+#              crash, and a power loss can only drop the last few commits
+#   bulk     - WAL without fsyncs, large cache; a power loss or OS crash can
+#              corrupt the database, so only for a private copy that can be rebuilt
+# The legacy ledgers always use the rollback journal and never go below
+# synchronous=NORMAL (see LegacyLedger), since every desk writes to them.
+DURABILITY_PROFILES = {
+    'strict': {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'cache_size': -8000,
+               'mmap_size': 0, 'busy_timeout': 5000},
+    'balanced': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -16000,
+                 'mmap_size': 64 << 20, 'busy_timeout': 5000},
+    'bulk': {'journal_mode': 'WAL', 'synchronous': 'OFF', 'cache_size': -64000,
+             'mmap_size': 256 << 20, 'busy_timeout': 30000},
+}
+
+def apply_durability(conn, profile, schemas=('main',), journal_mode=None, synchronous=None):
+    """Apply a DURABILITY_PROFILES entry to a connection and each of its (attached) schemas.
+
+    journal_mode and synchronous, if given, override the profile's.
+    """
+    if profile not in DURABILITY_PROFILES:
+        raise ValueError(f"unknown durability profile '{profile}' (expected one of: {', '.join(DURABILITY_PROFILES)})")
+    settings = dict(DURABILITY_PROFILES[profile])
+    if journal_mode:
+        settings['journal_mode'] = journal_mode
+    if synchronous:
+        settings['synchronous'] = synchronous
+    conn.execute(f"PRAGMA busy_timeout={settings['busy_timeout']}")
+    for schema in schemas:
+        # journal_mode, synchronous, cache and mmap are per database file
+        for pragma in ('journal_mode', 'synchronous', 'cache_size', 'mmap_size'):
+            conn.execute(f"PRAGMA {schema}.{pragma}={settings[pragma]}")
+
+class LibraryDatabase:
+    """Single SQLite store for books, students, loans and returns."""
+    LEDGER = ('loans', 'loan_id', 'loan_date', 'returns', 'return_date')
+
+    def __init__(self, path, durability='balanced'):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        apply_durability(self.conn, durability)
+        self.create_tables()
+
+    def create_tables(self):
+        """Create all tables if they do not exist."""
+        with self.conn:
+            self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS books (
+                barcode TEXT PRIMARY KEY,
+                title TEXT,
+                topic TEXT,
+                is_purchased INTEGER DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS students (
+                school_id TEXT PRIMARY KEY,
+                name TEXT,
+                class TEXT
+            );
+            CREATE TABLE IF NOT EXISTS loans (
+                loan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                school_id TEXT,
+                book_barcode TEXT,
+                loan_date DATETIME DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE IF NOT EXISTS returns (
+                return_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                school_id TEXT,
+                book_barcode TEXT,
+                return_date DATETIME DEFAULT CURRENT_TIMESTAMP
+            );
+            ''')
+        create_open_loans_table(self.conn, *self.LEDGER)
+
+    def is_empty(self):
+        """Return True if no books or students have been imported yet."""
+        books = self.conn.execute('SELECT COUNT(*) FROM books').fetchone()[0]
+        students = self.conn.execute('SELECT COUNT(*) FROM students').fetchone()[0]
+        return books == 0 and students == 0
+
+    def import_data(self, students, books):
+        """Import student and book rows (e.g. from the CSV files) in one transaction."""
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO students (school_id, name, class) VALUES (?, ?, ?)',
+                ((s['school_id'], s['name'], s['class']) for s in students)
+            )
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO books (barcode, title, topic, is_purchased) VALUES (?, ?, ?, ?)',
+                ((b['barcode'], b['title'], b['topic'], b['is_purchased']) for b in books)
+            )
+
+    def import_ledger(self, purchases_path, returns_path):
+        """Copy purchase and return history from the legacy ledger databases."""
+        for path, source, target, date_column in (
+            (purchases_path, 'book_purchases', 'loans (school_id, book_barcode, loan_date)', 'purchase_date'),
+            (returns_path, 'book_returns', 'returns (school_id, book_barcode, return_date)', 'return_date')
+        ):
+            if not os.path.exists(path):
+                continue
+            self.conn.execute('ATTACH DATABASE ? AS legacy', (path,))
+            try:
+                has_table = self.conn.execute(
+                    "SELECT 1 FROM legacy.sqlite_master WHERE type = 'table' AND name = ?",
+                    (source,)
+                ).fetchone()
+                if has_table:
+                    with self.conn:
+                        self.conn.execute(
+                            f'INSERT INTO {target} '
+                            f'SELECT school_id, book_barcode, {date_column} FROM legacy.{source}'
+                        )
+            finally:
+                self.conn.execute('DETACH DATABASE legacy')
+        rebuild_open_loans(self.conn, *self.LEDGER)
+
+    def load_students(self):
+        """Load all students as dictionaries."""
+        rows = self.conn.execute('SELECT school_id, name, class FROM students ORDER BY rowid')
+        return [{'school_id': r[0], 'name': r[1], 'class': r[2]} for r in rows]
+
+    def load_books(self):
+        """Load all books as dictionaries."""
+        rows = self.conn.execute('SELECT barcode, title, topic, is_purchased FROM books ORDER BY rowid')
+        return [{'barcode': r[0], 'title': r[1], 'topic': r[2], 'is_purchased': r[3]} for r in rows]
+
+    def record_loan(self, school_id, book_barcode):
+        """Mark a book checked out and record the loan in one transaction."""
+        self.record_loans([(school_id, book_barcode)])
+
+    def record_loans(self, loans):
+        """Record several (school_id, barcode) checkouts in one transaction."""
+        loan_rows = list(loans)
+        barcode_rows = [(barcode,) for _, barcode in loan_rows]
+        with self.conn:
+            self.conn.executemany('UPDATE books SET is_purchased = 1 WHERE barcode = ?', barcode_rows)
+            # Fails with IntegrityError if any book is already on loan
+            self.conn.executemany(
+                'INSERT INTO open_loans (school_id, book_barcode) VALUES (?, ?)',
+                loan_rows
+            )
+            self.conn.executemany(
+                'INSERT INTO loans (school_id, book_barcode) VALUES (?, ?)',
+                loan_rows
+            )
+
+    def record_return(self, school_id, book_barcode):
+        """Mark a book available and record the return in one transaction."""
+        self.record_transactions([('return', school_id, book_barcode)])
+
+    def record_transactions(self, transactions):
+        """Apply ('checkout'|'return', school_id, barcode) tuples in order in one transaction."""
+        execute = self.conn.execute
+        with self.conn:
+            for action, school_id, book_barcode in transactions:
+                if action == 'checkout':
+                    execute('UPDATE books SET is_purchased = 1 WHERE barcode = ?', (book_barcode,))
+                    execute(
+                        'INSERT INTO open_loans (school_id, book_barcode) VALUES (?, ?)',
+                        (school_id, book_barcode)
+                    )
+                    execute(
+                        'INSERT INTO loans (school_id, book_barcode) VALUES (?, ?)',
+                        (school_id, book_barcode)
+                    )
+                    continue
+                closed = execute(
+                    'DELETE FROM open_loans WHERE book_barcode = ? AND school_id = ?',
+                    (book_barcode, school_id)
+                ).rowcount
+                if not closed:
+                    raise ValueError(f"Book {book_barcode} is not on loan to {school_id}")
+                execute('UPDATE books SET is_purchased = 0 WHERE barcode = ?', (book_barcode,))
+                execute(
+                    'INSERT INTO returns (school_id, book_barcode) VALUES (?, ?)',
+                    (school_id, book_barcode)
+                )
+
+    def open_loan_holder(self, book_barcode):
+        """Return the school ID currently holding a book, or None."""
+        row = self.conn.execute(
+            'SELECT school_id FROM open_loans WHERE book_barcode = ?',
+            (book_barcode,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def open_loans(self, school_id=None):
+        """Return (barcode, school_id, loan_date) for open loans, optionally for one student."""
+        if school_id is None:
+            return self.conn.execute('SELECT book_barcode, school_id, loan_date FROM open_loans').fetchall()
+        return self.conn.execute(
+            'SELECT book_barcode, school_id, loan_date FROM open_loans WHERE school_id = ?',
+            (school_id,)
+        ).fetchall()
+
+    def close(self):
+        """Close the database connection."""
+        self.conn.close()
+
+class LegacyLedger:
+    """Loan and return history kept in book_purchases.db and book_returns.db.
+
+    Used by the CSV backend, where book status lives in bookdata.csv. The
+    returns database is attached to the purchases connection so a return can
+    close its open loan and record itself in one transaction. Both files keep
+    the rollback journal whatever the profile: in WAL mode that transaction
+    would only be atomic per file, and WAL does not work when desks share the
+    files over a network folder. For the same reason the bulk profile's
+    synchronous=OFF is raised to NORMAL here.
+    """
+    def __init__(self, purchases_path='book_purchases.db', returns_path='book_returns.db', durability='strict'):
+        self.conn = sqlite3.connect(purchases_path)
+        self.conn.execute('ATTACH DATABASE ? AS ledger_returns', (returns_path,))
+        synchronous = 'NORMAL' if DURABILITY_PROFILES.get(durability, {}).get('synchronous') == 'OFF' else None
+        apply_durability(
+            self.conn, durability, schemas=('main', 'ledger_returns'), journal_mode='DELETE', synchronous=synchronous
+        )
+        self.create_tables()
+
+    def create_tables(self):
+        """Create the purchase and return tables if they do not exist."""
+        with self.conn:
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS book_purchases (
+                purchase_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                school_id TEXT,
+                book_barcode TEXT,
+                purchase_date DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS ledger_returns.book_returns (
+                return_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                school_id TEXT,
+                book_barcode TEXT,
+                return_date DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
+        create_open_loans_table(
+            self.conn,
+            'book_purchases', 'purchase_id', 'purchase_date',
+            'ledger_returns.book_returns', 'return_date'
+        )
+
+    def record_loans(self, loans):
+        """Record several (school_id, barcode) checkouts in one transaction."""
+        loan_rows = list(loans)
+        with self.conn:
+            # Fails with IntegrityError if any book is already on loan
+            self.conn.executemany(
+                'INSERT INTO open_loans (school_id, book_barcode) VALUES (?, ?)',
+                loan_rows
+            )
+            self.conn.executemany(
+                'INSERT INTO book_purchases (school_id, book_barcode) VALUES (?, ?)',
+                loan_rows
+            )
+
+    def record_return(self, school_id, book_barcode):
+        """Close an open loan and record the return in one transaction."""
+        self.record_transactions([('return', school_id, book_barcode)])
+
+    def record_transactions(self, transactions):
+        """Apply ('checkout'|'return', school_id, barcode) tuples in order in one transaction."""
+        execute = self.conn.execute
+        with self.conn:
+            for action, school_id, book_barcode in transactions:
+                if action == 'checkout':
+                    execute(
+                        'INSERT INTO open_loans (school_id, book_barcode) VALUES (?, ?)',
+                        (school_id, book_barcode)
+                    )
+                    execute(
+                        'INSERT INTO book_purchases (school_id, book_barcode) VALUES (?, ?)',
+                        (school_id, book_barcode)
+                    )
+                    continue
+                closed = execute(
+                    'DELETE FROM open_loans WHERE book_barcode = ? AND school_id = ?',
+                    (book_barcode, school_id)
+                ).rowcount
+                if not closed:
+                    raise ValueError(f"Book {book_barcode} is not on loan to {school_id}")
+                execute(
+                    'INSERT INTO ledger_returns.book_returns (school_id, book_barcode) VALUES (?, ?)',
+                    (school_id, book_barcode)
+                )
+
+    def open_loan_holder(self, book_barcode):
+        """Return the school ID currently holding a book, or None."""
+        row = self.conn.execute(
+            'SELECT school_id FROM open_loans WHERE book_barcode = ?',
+            (book_barcode,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def open_loans(self, school_id=None):
+        """Return (barcode, school_id, loan_date) for open loans, optionally for one student."""
+        if school_id is None:
+            return self.conn.execute('SELECT book_barcode, school_id, loan_date FROM open_loans').fetchall()
+        return self.conn.execute(
+            'SELECT book_barcode, school_id, loan_date FROM open_loans WHERE school_id = ?',
+            (school_id,)
+        ).fetchall()
+
+    def close(self):
+        """Close the database connection."""
+        self.conn.close()
+
+# Accepted header spellings for each field, and the fields a row must fill in
+CSV_COLUMNS = {
+    'students': {
+        'school_id': ('school_id', 'School ID'),
+        'name': ('name', 'Name'),
+        'class': ('class', 'Class'),
+    },
+    'books': {
+        'barcode': ('barcode', 'Barcode'),
+        'title': ('title', 'Title'),
+        'topic': ('topic', 'Topic'),
+        'is_purchased': ('is_purchased', 'Is Purchased'),
+    },
+}
+CSV_KEYS = {'students': 'school_id', 'books': 'barcode'}
+CSV_REQUIRED = {'students': ('school_id', 'class'), 'books': ('barcode', 'title')}
+
+class CsvValidationError(ValueError):
+    """Raised when a data file fails validation; `errors` lists (line, message) pairs."""
+    def __init__(self, path, errors, total):
+        self.path = path
+        self.errors = errors
+        self.total = total
+        lines = [f"line {line}: {message}" if line else message for line, message in errors]
+        if total > len(errors):
+            lines.append(f"... and {total - len(errors)} more")
+        super().__init__(f"{os.path.basename(path)} has {total} problem(s):\n" + '\n'.join(lines))
+
+def read_csv_data(path, data_type, max_errors=20):
+    """Read and validate 'students' or 'books' rows from a CSV file in one pass.
+
+    Headers may use either spelling in CSV_COLUMNS. Rows with missing required
+    values, a non 0/1 is_purchased or a duplicate barcode / school ID are
+    reported by line number; any problem raises CsvValidationError after the
+    whole file has been checked. Returns the cleaned rows.
+    """
+    columns = CSV_COLUMNS[data_type]
+    key_field = CSV_KEYS[data_type]
+    errors = []
+    total = 0
+
+    def report(line, message):
+        nonlocal total
+        total += 1
+        if len(errors) < max_errors:
+            errors.append((line, message))
+
+    data = []
+    # utf-8-sig drops the byte order mark Excel puts at the start of a saved CSV
+    with open(path, 'r', newline='', encoding='utf-8-sig') as csvfile:
+        reader = csv.reader(csvfile)
+        header = [name.strip() for name in next(reader, [])]
+        
+        # Map each field to its column, whichever header spelling is used
+        positions = {}
+        for field, aliases in columns.items():
+            position = next((header.index(alias) for alias in aliases if alias in header), None)
+            if position is None:
+                report(1, f"missing column '{field}' (expected one of: {', '.join(aliases)})")
+            positions[field] = position
+        if total:
+            raise CsvValidationError(path, errors, total)
+
+        fields = list(positions)
+        getters = list(positions.values())
+        required = CSV_REQUIRED[data_type]
+        seen = {}  # key -> first line, so a duplicate can point at the original
+        for values in reader:
+            if not any(values):
+                continue  # Blank line
+            line = reader.line_num
+            if len(values) < len(header):
+                values += [''] * (len(header) - len(values))
+            row = dict(zip(fields, (values[i].strip() for i in getters)))
+            
+            missing = [field for field in required if not row[field]]
+            if missing:
+                report(line, f"missing {', '.join(missing)}")
+                continue
+            
+            if data_type == 'books':
+                if row['is_purchased'] not in ('0', '1'):
+                    report(line, f"is_purchased must be 0 or 1, got '{row['is_purchased']}'")
+                    continue
+                row['is_purchased'] = int(row['is_purchased'])
+            
+            key = row[key_field]
+            first = seen.setdefault(key, line)
+            if first != line:
+                report(line, f"duplicate {key_field} '{key}' (first on line {first})")
+                continue
+            data.append(row)
+
+    if total:
+        raise CsvValidationError(path, errors, total)
+    if not data:
+        raise CsvValidationError(path, [(None, "file is empty or contains only headers")], 1)
+    return data
+
+def preflight_csv(students_path='studentdetails.csv', books_path='bookdata.csv', scorer_name=None):
+    """Validate both CSV files ahead of LibraryEngine.load() for the CSV backend.
+
+    Returns the (students, books) rows to pass to load(), so each file is read
+    once, or (None, None) when the catalog cache is fresh: those files were
+    validated when the cache was built. Raises CsvValidationError.
+    """
+    cache = CatalogCache(books_path + '.cache', [students_path, books_path])
+    if cache.is_fresh(scorer_name or get_scorer().name):
+        return None, None
+    return read_csv_data(students_path, 'students'), read_csv_data(books_path, 'books')
+
+def fsync_directory(path):
+    """Make a rename into the folder holding path durable (POSIX; Windows has no directory fsync)."""
+    if os.name == 'nt':
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_book_csv(path, books):
+    """Rewrite the book CSV, keeping the previous file as a .bak backup.
+
+    The new file is written beside the old one and swapped in with os.replace,
+    so a reader in another process sees either the old or the new snapshot.
+    Both the file and the rename are on disk when this returns, so the
+    journal it replaces can be truncated.
+    """
+    backup_path = path + '.bak'
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, 'w', newline='', encoding='utf-8') as csvfile:
+            fieldnames = ['barcode', 'title', 'topic', 'is_purchased']
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(books)
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+        
+        # Keep a backup, then swap the new snapshot in
+        if os.path.exists(path):
+            shutil.copyfile(path, backup_path)
+        os.replace(temp_path, path)
+        fsync_directory(path)
+    except Exception:
+        # Leave the current snapshot untouched
+        if os.path.exists(temp_path):
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+        raise
+
+def read_transactions(path):
+    """Yield (line_number, fields) for each transaction in a CSV or JSONL file.
+
+    Each transaction has 'action' ('checkout' or 'return'), 'class',
+    'school_id' and 'barcode'. Unparseable JSONL lines yield fields=None.
+    """
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        if path.lower().endswith(('.jsonl', '.json')):
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    fields = json.loads(line)
+                except ValueError:
+                    fields = None
+                yield line_number, fields if isinstance(fields, dict) else None
+            return
+        
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+
+def process_transactions(catalog, store, transactions, group_size=5000, on_commit=None):
+    """Validate and apply offline checkouts and returns in grouped transactions.
+
+    Applies the same checks as the desk forms: the student must match the
+    class, a checkout needs an available copy and a return needs an open loan
+    held by that student. Valid rows are written through
+    store.record_transactions() every group_size rows; on_commit(books) is
+    called after each group with the copies whose status changed. Returns a
+    list of (line_number, action, school_id, barcode, status, message).
+    """
+    results = []
+    group = []
+    holders = {}  # Open-loan holders changed by this batch, by barcode
+    
+    def flush():
+        ops = [op for op, _, _ in group]
+        try:
+            store.record_transactions(ops)
+        except Exception as e:
+            # Undo the group in memory; the store rolled it back
+            for (action, _, barcode), book, index in reversed(group):
+                catalog.set_purchased(book, 0 if action == 'checkout' else 1)
+                holders.pop(barcode, None)
+                results[index] = results[index][:4] + ('error', f"group not recorded: {e}")
+        else:
+            if on_commit:
+                on_commit([book for _, book, _ in group])
+        group.clear()
+    
+    for line_number, fields in transactions:
+        if fields is None:
+            results.append((line_number, '', '', '', 'error', 'malformed line'))
+            continue
+        action = str(fields.get('action') or '').strip().lower()
+        student_class = str(fields.get('class') or '').strip()
+        school_id = str(fields.get('school_id') or '').strip()
+        book_barcode = str(fields.get('barcode') or '').strip()
+        
+        def fail(message):
+            results.append((line_number, action, school_id, book_barcode, 'error', message))
+        
+        # Validate inputs
+        if action in ('purchase', 'loan'):
+            action = 'checkout'
+        if action not in ('checkout', 'return'):
+            fail("unknown action")
+            continue
+        if not all([student_class, school_id, book_barcode]):
+            fail("missing information")
+            continue
+        
+        # Validate student
+        if not catalog.find_student(school_id, student_class):
+            fail("invalid student details")
+            continue
+        
+        if action == 'checkout':
+            book = catalog.find_book(book_barcode, is_purchased=0)
+            if not book:
+                fail("book not available")
+                continue
+            catalog.set_purchased(book, 1)
+            holders[book_barcode] = school_id
+        else:
+            holder = holders[book_barcode] if book_barcode in holders else store.open_loan_holder(book_barcode)
+            if holder != school_id:
+                fail("no purchase record for this student and book")
+                continue
+            book = catalog.find_book(book_barcode, is_purchased=1)
+            if not book:
+                fail("book is not checked out")
+                continue
+            catalog.set_purchased(book, 0)
+            holders[book_barcode] = None
+        
+        group.append(((action, school_id, book_barcode), book, len(results)))
+        results.append((line_number, action, school_id, book_barcode, 'ok', ''))
+        if len(group) >= group_size:
+            flush()
+    
+    if group:
+        flush()
+    return results
+
+def write_batch_report(path, results):
+    """Write one result row per transaction line."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['line', 'action', 'school_id', 'barcode', 'status', 'message'])
+        writer.writerows(results)
+
+class LibraryEngine:
+    """GUI-free library core: load the catalog, validate and record transactions.
+
+    storage_backend 'csv' keeps book status in the books CSV (journaled, see
+    persistence_mode) with the legacy purchase/return ledgers; 'sqlite' keeps
+    everything in one database. durability names a DURABILITY_PROFILES entry
+    for the SQLite files; it defaults to 'strict' for the CSV backend, whose
+    ledgers desks may share over a network folder, and 'balanced' for sqlite.
+    Call load() before use. SQLite connections belong to
+    the thread that created the engine.
+
+    checkout(), checkin() and bulk_checkout() validate, update the catalog and
+    write in one call. The record_* methods only write, for callers (like the
+    desk application) that update the catalog themselves.
+    """
+    def __init__(self, storage_backend='csv', students_path='studentdetails.csv',
+                 books_path='bookdata.csv', db_path='library.db',
+                 purchases_path='book_purchases.db', returns_path='book_returns.db',
+                 scorer=None, durability=None):
+        self.storage_backend = storage_backend
+        self.students_path = students_path
+        self.books_path = books_path
+        self.purchases_path = purchases_path
+        self.returns_path = returns_path
+        self.scorer = scorer
+        self.catalog = None
+        self.book_journal = None
+        
+        # Parsed-catalog snapshot for the CSV backend, rewritten on close()
+        # whenever the CSV files changed underneath it
+        self.catalog_cache = None
+        self.cache_stale = False
+        if storage_backend != 'sqlite':
+            self.catalog_cache = CatalogCache(books_path + '.cache', [students_path, books_path])
+        
+        # Cross-process coordination for the CSV backend. Several desks may share
+        # one data folder: every write holds shared_lock and first takes in the
+        # other desks' changes. (generation, journal_offset) is how far this
+        # process has read: the snapshot it is based on and its place in the journal.
+        self.shared_lock = FileLock(books_path + '.lock') if storage_backend != 'sqlite' else None
+        self.generation = None
+        self.journal_offset = 0
+        
+        # Hot reload of the CSV files when they are edited by hand: (mtime, size)
+        # of each as last read or written by this process, the stats of an edit
+        # that failed validation, and that error for the books file (flushing
+        # and the catalog cache wait until it is fixed)
+        self.file_stats = None
+        self.rejected_stats = None
+        self.reload_error = None
+        
+        # Book status persistence for the CSV backend: 'journal' appends each
+        # change and periodically compacts, 'snapshot' rewrites the CSV every time
+        self.persistence_mode = 'journal'
+        
+        # Write-behind: journaled changes are folded into the CSV once
+        # journal_compact_threshold of them pile up or the oldest is
+        # flush_interval seconds old. With auto_flush that happens on the next
+        # write; callers with their own timer (the desk app) turn it off and
+        # call flush_book_changes() when flush_due() says so.
+        self.journal_compact_threshold = 500
+        self.flush_interval = 5.0
+        self.auto_flush = True
+        self.oldest_pending = None  # time.monotonic() of the oldest unflushed change
+        self.last_flush_seconds = None
+        # A failed flush (disk full, file locked by another program) is retried
+        # after a wait that doubles with each failure in a row, up to flush_retry_max
+        self.flush_failures = 0
+        self.flush_retry_at = None  # time.monotonic() before which flush_due() says no
+        self.flush_retry_max = 60.0
+        
+        # SQLite durability profile for the ledger; see DURABILITY_PROFILES
+        if durability is None:
+            durability = 'balanced' if storage_backend == 'sqlite' else 'strict'
+        self.durability = durability
+        if storage_backend == 'sqlite':
+            self.store = LibraryDatabase(db_path, durability)
+        else:
+            self.store = LegacyLedger(purchases_path, returns_path, durability)
+
+    def needs_import(self):
+        """Return True if load() will import the CSV files (first sqlite run)."""
+        return self.storage_backend == 'sqlite' and self.store.is_empty()
+
+    def load(self, students=None, books=None, file_stats=None):
+        """Build the catalog; students/books rows default to reading the CSV files.
+
+        Pass file_stats (stat_files() of the two files, taken before the rows
+        were read) with rows read elsewhere, so edits made since are noticed.
+        """
+        if self.storage_backend == 'sqlite':
+            # Import the CSV files on first run
+            if self.store.is_empty():
+                self.store.import_data(
+                    students if students is not None else read_csv_data(self.students_path, 'students'),
+                    books if books is not None else read_csv_data(self.books_path, 'books')
+                )
+                self.store.import_ledger(self.purchases_path, self.returns_path)
+            self.catalog = LibraryCatalog(self.store.load_students(), self.store.load_books(), scorer=self.scorer)
+        else:
+            self.generation = self.shared_lock.generation()  # Before reading the snapshot it numbers
+            if file_stats is None or students is None or books is None:
+                file_stats = self.data_file_stats()
+            self.file_stats = file_stats
+            if students is None and books is None:
+                self.catalog = self.catalog_cache.load((self.scorer or get_scorer()).name)
+            if self.catalog is None:
+                self.catalog = LibraryCatalog(
+                    students if students is not None else read_csv_data(self.students_path, 'students'),
+                    books if books is not None else read_csv_data(self.books_path, 'books'),
+                    scorer=self.scorer
+                )
+                self.cache_stale = True
+            self.book_journal = BookJournal(self.books_path + '.journal')
+            with self.shared_lock:
+                self.sync_shared_changes()
+        return self.catalog
+
+    # Queries
+
+    def search(self, query, limit=5):
+        """Fuzzy-search titles; return dicts with title, score, copies, available and barcodes."""
+        return self.describe_titles(self.catalog.search_titles(query, limit=limit))
+
+    def describe_titles(self, matches):
+        """Attach copy counts and available barcodes to (title, score) matches."""
+        results = []
+        with self.catalog.lock:
+            for title, score in matches:
+                record = self.catalog.title_record(title)
+                if record is None:
+                    continue  # Its last copy was removed since the search
+                results.append({
+                    'title': title,
+                    'score': score,
+                    'copies': len(record['copies']),
+                    'available': len(record['available']),
+                    'available_barcodes': [b['barcode'] for b in record['available'].values()]
+                })
+        return results
+
+    def suggest_titles(self, text, limit=10, score_cutoff=40):
+        """Return autocomplete title suggestions."""
+        return [title for title, score in self.catalog.suggest_titles(text, limit=limit) if score > score_cutoff]
+
+    def open_loans(self, school_id=None):
+        """Return open loans as dicts, optionally only those of one student."""
+        return [
+            {'barcode': barcode, 'school_id': holder, 'loan_date': loan_date}
+            for barcode, holder, loan_date in self.store.open_loans(school_id)
+        ]
+
+    def open_loan_holder(self, book_barcode):
+        """Return the school ID currently holding a book, or None."""
+        return self.store.open_loan_holder(book_barcode)
+
+    def has_purchase_record(self, school_id, book_barcode):
+        """Check that this student currently has this book on loan."""
+        return self.open_loan_holder(book_barcode) == school_id
+
+    # Validated transactions
+
+    def checkout(self, school_id, book_barcode, student_class=None):
+        """Check a book out to a student and return the book; raises ValueError if invalid."""
+        if not self.catalog.find_student(school_id, student_class):
+            raise ValueError("Invalid student details")
+        return self.checkout_many([(school_id, book_barcode)])[0]
+
+    def checkout_many(self, loans):
+        """Check out (school_id, barcode) pairs in one transaction, all or nothing.
+
+        Returns the books; raises ValueError naming the first invalid pair.
+        """
+        self.refresh_if_stale()
+        books = []
+        chosen = set()
+        for school_id, book_barcode in loans:
+            if not self.catalog.find_student(school_id):
+                raise ValueError(f"Unknown student {school_id}")
+            book = self.catalog.find_book(book_barcode, is_purchased=0)
+            if not book or book_barcode in chosen:
+                raise ValueError(f"Book {book_barcode} is not available")
+            chosen.add(book_barcode)
+            books.append((school_id, book))
+        
+        for _, book in books:
+            self.catalog.set_purchased(book, 1)
+        try:
+            self.record_checkouts(books)
+        except Exception as e:
+            revert_status(self.catalog, [book for _, book in books], 0, e)
+            raise
+        return [book for _, book in books]
+
+    def checkin(self, book_barcode, school_id=None):
+        """Return a book and the borrower's school ID; raises ValueError if not on loan.
+
+        Without school_id the book is returned to whoever holds it.
+        """
+        self.refresh_if_stale()
+        book = self.catalog.find_book(book_barcode, is_purchased=1)
+        if not book:
+            raise ValueError(f"Book {book_barcode} is not checked out")
+        holder = self.open_loan_holder(book_barcode)
+        if holder is None or (school_id is not None and holder != school_id):
+            raise ValueError(f"Book {book_barcode} is not on loan to {school_id or 'anyone'}")
+        
+        self.catalog.set_purchased(book, 0)
+        try:
+            self.record_return(holder, book)
+        except Exception as e:
+            revert_status(self.catalog, [book], 1, e)
+            raise
+        return holder
+
+    def bulk_checkout(self, student_class, titles):
+        """Give every student in a class one available copy of each title.
+
+        All loans are written in one transaction. Returns (allocations,
+        shortfalls) as described in LibraryCatalog.allocate().
+        """
+        self.refresh_if_stale()
+        allocations, shortfalls = self.catalog.allocate(student_class, titles)
+        for _, book in allocations:
+            self.catalog.set_purchased(book, 1)
+        try:
+            self.record_checkouts([(student['school_id'], book) for student, book in allocations])
+        except Exception as e:
+            revert_status(self.catalog, [book for _, book in allocations], 0, e)
+            raise
+        return allocations, shortfalls
+
+    def apply_transactions(self, transactions, group_size=5000):
+        """Validate and apply (line_number, fields) transactions; see process_transactions()."""
+        on_commit = None
+        if self.storage_backend != 'sqlite':
+            # Journal every group; the snapshot is rewritten once, by close()
+            on_commit = self.journal_book_changes
+        return process_transactions(self.catalog, self.store, transactions, group_size, on_commit)
+
+    # Writes for catalog changes made by the caller
+
+    def record_checkouts(self, loans):
+        """Record several (school_id, book) checkouts in one transaction and one flush.
+
+        Raises ConcurrentUpdateError if another desk changed one of the books first.
+        """
+        if not loans:
+            return
+        books = [book for _, book in loans]
+        with self.shared_write(books, was_purchased=0):
+            try:
+                self.store.record_loans([(school_id, book['barcode']) for school_id, book in loans])
+            except sqlite3.IntegrityError:
+                self.raise_ledger_conflicts(books, was_purchased=0)
+                raise
+            self.persist_book_changes(books)
+
+    def record_return(self, school_id, book):
+        """Record a return in the ledger and persist the book status."""
+        with self.shared_write([book], was_purchased=1):
+            try:
+                self.store.record_return(school_id, book['barcode'])
+            except ValueError:
+                self.raise_ledger_conflicts([book], was_purchased=1)
+                raise
+            self.persist_book_changes([book])
+
+    def record_express_return(self, book):
+        """Return a book to its current borrower and return the borrower's school ID."""
+        school_id = self.open_loan_holder(book['barcode'])
+        if school_id is None:
+            self.raise_ledger_conflicts([book], was_purchased=1)
+            raise ValueError("no open loan found for this barcode")
+        self.record_return(school_id, book)
+        return school_id
+
+    def raise_ledger_conflicts(self, books, was_purchased):
+        """After the ledger rejected a write, take its word for books another desk changed.
+
+        A refresh that runs after the desk flipped a book in memory cannot tell
+        another desk's identical change from ours, so the journal alone misses
+        the conflict. The open loans decide instead: books whose status differs
+        from `was_purchased` get it in the catalog, and ConcurrentUpdateError
+        names them. Returns if there are none.
+        """
+        changed = [
+            book for book in books
+            if (self.store.open_loan_holder(book['barcode']) is not None) != bool(was_purchased)
+        ]
+        for book in changed:
+            self.catalog.set_purchased(book, 1 - was_purchased)
+        if changed:
+            raise ConcurrentUpdateError(book['barcode'] for book in changed)
+
+    # Book status persistence (CSV backend)
+
+    @contextmanager
+    def shared_write(self, books, was_purchased):
+        """Hold the shared lock around a status change, after taking in other desks' changes.
+
+        The caller has already flipped `books` away from `was_purchased` in
+        memory; if another desk changed any of them since this process last
+        looked, ConcurrentUpdateError is raised before anything is written.
+        """
+        if self.shared_lock is None:
+            yield  # SQLite locks and validates the shared database itself
+            return
+        with self.shared_lock:
+            self.sync_shared_changes({book['barcode']: was_purchased for book in books})
+            yield
+
+    def sync_shared_changes(self, pending=None):
+        """Apply book status changes other processes made since this one last looked.
+
+        Call with shared_lock held. pending maps the barcodes this process is
+        about to write to the status it read them with (None: keep ours). A
+        pending book someone else changed gets their status and raises
+        ConcurrentUpdateError. Returns the other books that changed.
+        """
+        pending = pending or {}
+        current = {}
+        generation = self.shared_lock.generation()
+        if generation != self.generation:
+            # Another process rewrote the snapshot and restarted the journal
+            self.book_journal.close()
+            if generation == self.generation + 1 and os.path.exists(self.book_journal.path + '.prev'):
+                # Only one rewrite since we looked: it holds exactly the old journal,
+                # so reading the rest of that is enough
+                changes, _ = self.book_journal.read_since(self.journal_offset, self.book_journal.path + '.prev')
+                current.update(changes)
+            else:
+                current = {row['barcode']: row['is_purchased'] for row in read_csv_data(self.books_path, 'books')}
+            self.generation = generation
+            self.journal_offset = 0
+            self.book_journal.entries = 0
+        changes, self.journal_offset = self.book_journal.read_since(self.journal_offset)
+        current.update(changes)
+        if changes and self.oldest_pending is None:
+            self.oldest_pending = time.monotonic()  # Flush other desks' entries on the usual schedule
+        
+        changed = []
+        conflicts = []
+        for barcode, is_purchased in current.items():
+            book = self.catalog.find_book(barcode)
+            if book is None:
+                continue
+            expected = pending.get(barcode, book['is_purchased'])
+            if barcode in pending and expected is None:
+                continue  # Ours; already in memory
+            if is_purchased != expected:
+                self.catalog.set_purchased(book, is_purchased)
+                (conflicts if barcode in pending else changed).append(book)
+        if conflicts:
+            raise ConcurrentUpdateError(book['barcode'] for book in conflicts)
+        return changed
+
+    def shared_changes_waiting(self):
+        """Cheap check (no lock) for changes from other processes not yet taken in."""
+        if self.shared_lock is None or self.book_journal is None:
+            return False
+        try:
+            size = os.path.getsize(self.book_journal.path)
+        except OSError:
+            size = 0
+        return size != self.journal_offset or self.shared_lock.generation() != self.generation
+
+    def refresh_shared_changes(self):
+        """Take in other processes' changes; returns the books that changed."""
+        if self.shared_lock is None:
+            return []
+        with self.shared_lock:
+            return self.sync_shared_changes()
+
+    def refresh_if_stale(self):
+        """Validate against fresh data: take in other processes' changes and hand edits, if any."""
+        if self.shared_changes_waiting():
+            self.refresh_shared_changes()
+        if self.data_files_changed():
+            self.apply_data_file_edits()
+
+    # Hand edits to the CSV files (CSV backend)
+
+    def data_file_stats(self):
+        """Return stat_files() of the students and books files."""
+        return stat_files((self.students_path, self.books_path))
+
+    def data_files_changed(self):
+        """Cheap check (no lock, no reading) for CSV files changed since this process read them.
+
+        A books file rewritten by another desk from the same rows this process
+        has (only statuses differ, which the journal carries) is not a change,
+        nor is an edit that already failed validation, until it is saved again.
+        """
+        if self.file_stats is None:
+            return False
+        stats = self.data_file_stats()
+        if stats[1] != self.file_stats[1] and self.shared_lock.rewrite_stats() == (self.file_stats[1], stats[1]):
+            self.adopt_books_stat(stats[1])
+        return stats != self.file_stats and stats != self.rejected_stats
+
+    def adopt_books_stat(self, stat):
+        """Record a books file rewritten from this catalog's rows as already read."""
+        self.file_stats = (self.file_stats[0], stat)
+        if self.rejected_stats is not None:
+            # Only the students file can still be waiting for a fix
+            self.rejected_stats = (self.rejected_stats[0], stat)
+
+    def reload_data_files(self):
+        """Apply edits made to the CSV files outside the app, row by row.
+
+        Changed files are re-read and diffed against the catalog by school ID
+        and barcode; only inserted, updated and deleted rows are applied (see
+        LibraryCatalog.apply_student_rows/apply_book_rows). Returns
+        {'students'/'books': (inserted, updated, deleted)} for the files that
+        changed, or None if a file is still being saved or is locked by another
+        program; try again later. An invalid file raises CsvValidationError
+        and is not retried until it changes again.
+        """
+        if not self.data_files_changed():
+            return {}
+        with self.shared_lock:
+            stats = self.data_file_stats()
+            try:
+                students = read_csv_data(self.students_path, 'students') if stats[0] != self.file_stats[0] else None
+                books = read_csv_data(self.books_path, 'books') if stats[1] != self.file_stats[1] else None
+            except CsvValidationError as e:
+                # file_stats keeps the last valid files: the catalog does not reflect this edit
+                self.rejected_stats = stats
+                if e.path == self.books_path:
+                    self.reload_error = e
+                raise
+            except OSError:
+                return None
+            if self.data_file_stats() != stats:
+                return None  # Changed while we read it; the save is not finished
+            
+            changes = {}
+            if students is not None:
+                changes['students'] = self.catalog.apply_student_rows(students)
+            if books is not None:
+                self.sync_shared_changes()
+                new = {row['barcode'] for row in books if row['barcode'] not in self.catalog.books_by_barcode}
+                changes['books'] = self.catalog.apply_book_rows(books)
+                # Another desk may already have journaled loans of copies that are new to us;
+                # re-reading entries we have counted must not count them again
+                entries = self.book_journal.entries
+                journaled = dict(self.book_journal.read_since(0)[0])
+                self.book_journal.entries = entries
+                for barcode in new & journaled.keys():
+                    book = self.catalog.find_book(barcode)
+                    if book['is_purchased'] != journaled[barcode]:
+                        self.catalog.set_purchased(book, journaled[barcode])
+            self.file_stats = stats
+            self.rejected_stats = None
+            self.reload_error = None
+        if any(any(counts) for counts in changes.values()):
+            self.cache_stale = True
+        return changes
+
+    def apply_data_file_edits(self):
+        """Take in pending hand edits; return False if that is not possible right now."""
+        try:
+            return self.reload_data_files() is not None
+        except CsvValidationError:
+            return False
+
+    def journal_book_changes(self, books):
+        """Journal status changes that are already committed to the ledger."""
+        with self.shared_lock:
+            self.sync_shared_changes({book['barcode']: None for book in books})
+            self.journal_offset = self.book_journal.append_many(
+                [(book['barcode'], book['is_purchased']) for book in books]
+            )
+
+    def persist_book_changes(self, books):
+        """Persist book status changes with a single journal flush or CSV rewrite."""
+        if self.storage_backend == 'sqlite':
+            return  # Written with the ledger rows
+        
+        # Journaled first even in 'snapshot' mode: every CSV rewrite is a compaction
+        # of the journal, which other processes rely on to catch up (see truncate())
+        self.journal_book_changes(books)
+        if self.oldest_pending is None:
+            self.oldest_pending = time.monotonic()
+        if self.persistence_mode != 'journal' or (self.auto_flush and self.flush_due()):
+            self.flush_book_changes()
+
+    def pending_journal_entries(self):
+        """Return the number of journaled changes not yet folded into the CSV."""
+        return self.book_journal.entries if self.book_journal else 0
+
+    def flush_due(self):
+        """Return True once enough journaled changes have piled up or aged to rewrite the CSV."""
+        entries = self.pending_journal_entries()
+        if not entries or self.reload_error:
+            return False  # Rewriting now would overwrite a hand edit still waiting to be fixed
+        if self.flush_retry_at is not None and time.monotonic() < self.flush_retry_at:
+            return False  # The last flush failed; the changes are safe in the journal meanwhile
+        if entries >= self.journal_compact_threshold or self.oldest_pending is None:
+            return True  # Over the threshold, or left over from the last session
+        return time.monotonic() - self.oldest_pending >= self.flush_interval
+
+    def flush_book_changes(self):
+        """Fold pending changes into the CSV and record how long it took."""
+        if not self.pending_journal_entries() or self.reload_error:
+            return
+        started = time.perf_counter()
+        try:
+            self.compact_book_journal()
+        except Exception:
+            self.flush_failures += 1
+            delay = min(self.flush_interval * 2 ** (self.flush_failures - 1), self.flush_retry_max)
+            self.flush_retry_at = time.monotonic() + delay
+            raise
+        self.flush_failures = 0
+        self.flush_retry_at = None
+        self.last_flush_seconds = time.perf_counter() - started
+
+    def compact_book_journal(self):
+        """Fold the journal into a fresh CSV snapshot."""
+        with self.shared_lock:
+            if not self.apply_data_file_edits():
+                return  # bookdata.csv is being edited by hand; fold the journal in once it is saved and valid
+            self.update_book_csv()
+            self.book_journal.truncate()
+            self.journal_offset = 0
+        self.oldest_pending = None
+
+    def update_book_csv(self):
+        """Update the book CSV file with current data, including other desks' changes."""
+        with self.shared_lock:
+            self.sync_shared_changes()
+            based_on = self.file_stats[1]
+            write_book_csv(self.books_path, self.catalog.books)
+            self.adopt_books_stat(self.data_file_stats()[1])
+            self.generation = self.shared_lock.bump_generation(based_on, self.file_stats[1])
+        self.cache_stale = True
+
+    def close(self):
+        """Leave a compact snapshot behind and close the journal and database."""
+        try:
+            self.flush_book_changes()
+            # A snapshot of a catalog missing an unapplied or invalid hand edit would
+            # hide that edit: the next start would skip validating the file
+            if (self.catalog_cache and self.cache_stale and self.catalog is not None
+                    and self.rejected_stats is None and not self.data_files_changed()):
+                try:
+                    self.catalog_cache.save(self.catalog, self.file_stats)
+                except OSError:
+                    pass  # The cache is only a startup shortcut
+        finally:
+            if self.book_journal:
+                self.book_journal.close()
+            self.store.close()
@@ -0,0 +1,466 @@
+"""Local HTTP/JSON service so several desks share one library engine.
+
+One process owns the data files: every engine call runs on a single writer
+thread, so desks can no longer overwrite each other's bookdata.csv. Requests
+are served by a fixed thread pool over keep-alive (HTTP/1.1) connections;
+between requests a connection waits in a selector, not on a pool thread.
+
+    python libraryFront.py serve --port 8765
+    python libraryFront.py --server http://127.0.0.1:8765
+"""
+import http.client
+import json
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+from library_engine import ConcurrentUpdateError, LibraryCatalog
+
+class LibraryService(HTTPServer):
+    """HTTP server that hands requests to a thread pool and engine calls to one writer."""
+    CHANGE_LOG_LIMIT = 100000  # Entries kept for GET /changes; older callers reload the catalog
+    IDLE_TIMEOUT = 120  # Seconds a keep-alive connection may sit idle before it is closed
+
+    def __init__(self, address, engine_factory, workers=16):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='library-http')
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='library-writer')
+        # The engine and its SQLite connections belong to the writer thread
+        self.engine = self.writer.submit(engine_factory).result()
+        # Catalog changes are numbered from change_base, the number of the first
+        # entry still in the log
+        self.change_base = 0
+        self.engine.catalog.change_log = []
+        super().__init__(address, LibraryRequestHandler)
+
+        # Idle keep-alive connections are parked in a selector; one thread hands
+        # them back to the pool when their next request arrives
+        self.idle = selectors.DefaultSelector()
+        self.idle_lock = threading.Lock()
+        self.parked = []
+        self.closing = False
+        self.wakeup, self.waker = socket.socketpair()
+        self.idle.register(self.wakeup, selectors.EVENT_READ)
+        self.idle_watcher = threading.Thread(target=self.watch_idle, name='library-idle', daemon=True)
+        self.idle_watcher.start()
+
+    def call(self, func, *args):
+        """Run an engine call on the writer thread and return its result."""
+        return self.writer.submit(func, *args).result()
+
+    def change_seq(self):
+        return self.change_base + len(self.engine.catalog.change_log)
+
+    def changes_since(self, since):
+        """Return the current status of books changed since change number `since`.
+
+        {'seq', 'books': [[barcode, is_purchased], ...]}, or {'seq', 'reset': True}
+        if rows changed or `since` is too old: the caller must fetch /catalog.
+        Run on the writer thread.
+        """
+        log = self.engine.catalog.change_log
+        seq = self.change_seq()
+        if not self.change_base <= since <= seq:
+            return {'seq': seq, 'reset': True}
+        entries = log[since - self.change_base:]
+        if None in entries:
+            return {'seq': seq, 'reset': True}
+        books = []
+        for barcode in dict.fromkeys(entries):
+            book = self.engine.catalog.find_book(barcode)
+            if book is not None:
+                books.append([barcode, book['is_purchased']])
+        if len(log) > self.CHANGE_LOG_LIMIT:
+            dropped = len(log) - self.CHANGE_LOG_LIMIT // 2
+            del log[:dropped]
+            self.change_base += dropped
+        return {'seq': seq, 'books': books}
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        """Serve one request, then park the connection if the client keeps it open."""
+        keep_alive = False
+        try:
+            keep_alive = not self.RequestHandlerClass(request, client_address, self).close_connection
+        except Exception:
+            self.handle_error(request, client_address)
+        if keep_alive:
+            self.park(request, client_address)
+        else:
+            self.shutdown_request(request)
+
+    def park(self, request, client_address):
+        with self.idle_lock:
+            if self.closing:
+                self.shutdown_request(request)
+                return
+            self.parked.append((request, client_address))
+        self.waker.send(b'x')
+
+    def watch_idle(self):
+        """Hand parked connections back to the pool once readable; close long-idle ones."""
+        while not self.closing:
+            for key, _ in self.idle.select(timeout=1.0):
+                if key.fileobj is self.wakeup:
+                    self.wakeup.recv(4096)
+                    with self.idle_lock:
+                        parked, self.parked = self.parked, []
+                    for request, client_address in parked:
+                        self.idle.register(request, selectors.EVENT_READ, (client_address, time.monotonic()))
+                else:
+                    self.idle.unregister(key.fileobj)
+                    self.pool.submit(self.process_request_thread, key.fileobj, key.data[0])
+            now = time.monotonic()
+            for key in list(self.idle.get_map().values()):
+                if key.data and now - key.data[1] > self.IDLE_TIMEOUT:
+                    self.idle.unregister(key.fileobj)
+                    self.shutdown_request(key.fileobj)
+
+    def server_close(self):
+        super().server_close()
+        with self.idle_lock:
+            self.closing = True
+        self.waker.send(b'x')
+        self.idle_watcher.join()
+        # Idle desks are disconnected right away; they reconnect on their next request
+        for key in list(self.idle.get_map().values()):
+            if key.data:
+                self.shutdown_request(key.fileobj)
+        for request, _ in self.parked:
+            self.shutdown_request(request)
+        self.idle.close()
+        self.wakeup.close()
+        self.waker.close()
+        self.pool.shutdown(wait=True)
+        self.call(self.engine.close)
+        self.writer.shutdown(wait=True)
+
+class LibraryRequestHandler(BaseHTTPRequestHandler):
+    """JSON endpoints over LibraryEngine; see ROUTES."""
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so desks reuse their connection
+    timeout = 60  # Free the pool thread of a desk that stalls mid-request
+    disable_nagle_algorithm = True  # Headers and body go out as separate writes
+
+    def handle(self):
+        # One request per pool task; LibraryService parks the connection in between
+        self.close_connection = True
+        self.handle_one_request()
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        route = ROUTES.get((method, url.path))
+        if route is None:
+            self.send_json(404, {'error': f"no such endpoint: {method} {url.path}"})
+            return
+
+        try:
+            if method == 'POST':
+                length = int(self.headers.get('Content-Length', 0))
+                params = json.loads(self.rfile.read(length) or b'{}')
+            else:
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            self.send_json(200, route(self.server, params))
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # One line per request is too noisy at desk volumes
+
+def get_health(service, params):
+    return {'status': 'ok'}
+
+def get_catalog(service, params):
+    def snapshot():
+        return {
+            'seq': service.change_seq(),  # Pass to GET /changes to follow on from this snapshot
+            'students': [dict(student) for student in service.engine.catalog.students],
+            'books': [dict(book) for book in service.engine.catalog.books]
+        }
+    return service.call(snapshot)
+
+def get_changes(service, params):
+    return service.call(service.changes_since, int(params.get('since', 0)))
+
+def get_search(service, params):
+    # Scoring works on a copy of the titles, so it runs on the request thread
+    # without holding up the writer; just the availability lookup queues for it
+    matches = service.engine.catalog.search_titles(params['q'], limit=int(params.get('limit', 5)))
+    return {'results': service.call(service.engine.describe_titles, matches)}
+
+def get_loans(service, params):
+    if 'barcode' in params:
+        holder = service.call(service.engine.open_loan_holder, params['barcode'])
+        return {'barcode': params['barcode'], 'school_id': holder}
+    return {'loans': service.call(service.engine.open_loans, params.get('school_id'))}
+
+def post_checkout(service, params):
+    """Body: {"loans": [{"school_id", "barcode"}, ...]} or a single {"school_id", "barcode", "class"}."""
+    if 'loans' in params:
+        loans = [(loan['school_id'], loan['barcode']) for loan in params['loans']]
+        books = service.call(service.engine.checkout_many, loans)
+    else:
+        books = [service.call(
+            service.engine.checkout, params['school_id'], params['barcode'], params.get('class')
+        )]
+    return {'checked_out': [book['barcode'] for book in books]}
+
+def post_return(service, params):
+    """Body: {"barcode", "school_id"}; without school_id the current holder returns it."""
+    holder = service.call(service.engine.checkin, params['barcode'], params.get('school_id'))
+    return {'barcode': params['barcode'], 'school_id': holder}
+
+def post_allocate(service, params):
+    allocations, shortfalls = service.call(service.engine.bulk_checkout, params['class'], params['titles'])
+    return {'allocated': len(allocations), 'shortfalls': shortfalls}
+
+ROUTES = {
+    ('GET', '/health'): get_health,
+    ('GET', '/catalog'): get_catalog,
+    ('GET', '/changes'): get_changes,
+    ('GET', '/search'): get_search,
+    ('GET', '/loans'): get_loans,
+    ('POST', '/checkout'): post_checkout,
+    ('POST', '/return'): post_return,
+    ('POST', '/allocate'): post_allocate,
+}
+
+class LibraryClient:
+    """Client for LibraryService; keeps one keep-alive connection per thread.
+
+    Rejected requests (HTTP 400) raise ValueError with the server's message.
+    """
+    def __init__(self, base_url, timeout=10):
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def request(self, method, path, params=None):
+        """Send a request and return the decoded JSON response."""
+        body = None
+        headers = {}
+        if method == 'GET' and params:
+            path += '?' + urlencode(params)
+        elif method == 'POST':
+            body = json.dumps(params or {}).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+
+        for attempt in range(2):
+            conn = self.connection()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                payload = json.loads(response.read() or b'{}')
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server dropped an idle keep-alive connection; reconnect once
+                self.close()
+                if attempt:
+                    raise
+
+        if response.status == 400:
+            raise ValueError(payload.get('error', 'request rejected'))
+        if response.status != 200:
+            raise RuntimeError(f"{method} {path} failed ({response.status}): {payload.get('error', '')}")
+        return payload
+
+    def close(self):
+        """Close this thread's connection."""
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    def search(self, query, limit=5):
+        return self.request('GET', '/search', {'q': query, 'limit': limit})['results']
+
+    def changes(self, since):
+        return self.request('GET', '/changes', {'since': since})
+
+    def open_loans(self, school_id=None):
+        return self.request('GET', '/loans', {'school_id': school_id} if school_id else None)['loans']
+
+    def open_loan_holder(self, book_barcode):
+        return self.request('GET', '/loans', {'barcode': book_barcode})['school_id']
+
+    def checkout(self, school_id, book_barcode, student_class=None):
+        params = {'school_id': school_id, 'barcode': book_barcode}
+        if student_class:
+            params['class'] = student_class
+        return self.request('POST', '/checkout', params)['checked_out']
+
+    def checkout_many(self, loans):
+        params = {'loans': [{'school_id': school_id, 'barcode': barcode} for school_id, barcode in loans]}
+        return self.request('POST', '/checkout', params)['checked_out']
+
+    def checkin(self, book_barcode, school_id=None):
+        params = {'barcode': book_barcode}
+        if school_id:
+            params['school_id'] = school_id
+        return self.request('POST', '/return', params)['school_id']
+
+    def bulk_checkout(self, student_class, titles):
+        return self.request('POST', '/allocate', {'class': student_class, 'titles': titles})
+
+class RemoteEngine:
+    """Drop-in for LibraryEngine in the desk application, backed by a LibraryService.
+
+    The catalog is a local replica fetched at load(), kept in step with this
+    desk's own changes and, through refresh_shared_changes(), with GET /changes.
+    The server re-validates every write, so a copy taken at another desk is
+    rejected instead of double-issued.
+    """
+    storage_backend = 'remote'
+
+    def __init__(self, base_url, scorer=None):
+        self.client = LibraryClient(base_url)
+        self.scorer = scorer
+        self.catalog = None
+        self.seq = 0  # Server change number the replica is up to date with
+
+    def needs_import(self):
+        return False
+
+    def load(self, students=None, books=None, file_stats=None):
+        """Build the local catalog replica from the server."""
+        snapshot = self.client.request('GET', '/catalog')
+        self.catalog = LibraryCatalog(snapshot['students'], snapshot['books'], scorer=self.scorer)
+        self.seq = snapshot['seq']
+        return self.catalog
+
+    def search(self, query, limit=5):
+        return self.client.search(query, limit)
+
+    def suggest_titles(self, text, limit=10, score_cutoff=40):
+        return [title for title, score in self.catalog.suggest_titles(text, limit=limit) if score > score_cutoff]
+
+    def open_loans(self, school_id=None):
+        return self.client.open_loans(school_id)
+
+    def open_loan_holder(self, book_barcode):
+        return self.client.open_loan_holder(book_barcode)
+
+    def has_purchase_record(self, school_id, book_barcode):
+        return self.open_loan_holder(book_barcode) == school_id
+
+    def record_checkouts(self, loans):
+        if not loans:
+            return
+        try:
+            self.client.checkout_many([(school_id, book['barcode']) for school_id, book in loans])
+        except ValueError:
+            self.raise_server_conflicts([book for _, book in loans], was_purchased=0)
+            raise
+
+    def record_return(self, school_id, book):
+        try:
+            self.client.checkin(book['barcode'], school_id)
+        except ValueError:
+            self.raise_server_conflicts([book], was_purchased=1)
+            raise
+
+    def record_express_return(self, book):
+        try:
+            return self.client.checkin(book['barcode'])
+        except ValueError:
+            self.raise_server_conflicts([book], was_purchased=1)
+            raise
+
+    def raise_server_conflicts(self, books, was_purchased):
+        """After the server rejected a write, take its word for books another desk changed.
+
+        As LibraryEngine.raise_ledger_conflicts: a refresh that ran after the
+        desk flipped a book cannot tell another desk's identical change from
+        ours, so the server's open loans decide. Returns if no book differs.
+        """
+        changed = [
+            book for book in books
+            if (self.client.open_loan_holder(book['barcode']) is not None) != bool(was_purchased)
+        ]
+        for book in changed:
+            self.catalog.set_purchased(book, 1 - was_purchased)
+        if changed:
+            raise ConcurrentUpdateError(book['barcode'] for book in changed)
+
+    last_flush_seconds = None
+    flush_failures = 0
+
+    def pending_journal_entries(self):
+        return 0  # The server owns persistence
+
+    def flush_due(self):
+        return False
+
+    def shared_changes_waiting(self):
+        return True  # Only the server knows; asking it is refresh_shared_changes()
+
+    def refresh_shared_changes(self):
+        """Apply changes made through the server since the replica last looked; returns the books that changed."""
+        payload = self.client.changes(self.seq)
+        if payload.get('reset'):
+            return self.reload_replica()
+        changed = []
+        for barcode, is_purchased in payload['books']:
+            book = self.catalog.find_book(barcode)
+            if book is not None and book['is_purchased'] != is_purchased:
+                self.catalog.set_purchased(book, is_purchased)
+                changed.append(book)
+        self.seq = payload['seq']
+        return changed
+
+    def reload_replica(self):
+        """Bring the replica in line with a fresh /catalog snapshot, in place."""
+        snapshot = self.client.request('GET', '/catalog')
+        self.catalog.apply_student_rows(snapshot['students'])
+        self.catalog.apply_book_rows(snapshot['books'])
+        changed = []
+        for row in snapshot['books']:
+            # apply_book_rows() leaves the status of known copies alone
+            book = self.catalog.find_book(row['barcode'])
+            if book['is_purchased'] != row['is_purchased']:
+                self.catalog.set_purchased(book, row['is_purchased'])
+                changed.append(book)
+        self.seq = snapshot['seq']
+        return changed
+
+    def data_files_changed(self):
+        return False  # The server takes in edits to its own data files
+
+    def reload_data_files(self):
+        return {}
+
+    def flush_book_changes(self):
+        pass
+
+    def compact_book_journal(self):
+        pass
+
+    def close(self):
+        self.client.close()
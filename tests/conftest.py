@@ -0,0 +1,62 @@
+import csv
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_engine import LibraryEngine
+
+
+STUDENTS = [
+    {'school_id': 'S1', 'name': 'Ada', 'class': '7A'},
+    {'school_id': 'S2', 'name': 'Ben', 'class': '7A'},
+    {'school_id': 'S3', 'name': 'Cleo', 'class': '8B'},
+]
+
+BOOKS = [
+    {'barcode': 'B1', 'title': 'Algebra Basics', 'topic': 'Maths', 'is_purchased': 0},
+    {'barcode': 'B2', 'title': 'Algebra Basics', 'topic': 'Maths', 'is_purchased': 0},
+    {'barcode': 'B3', 'title': 'World Atlas', 'topic': 'Geography', 'is_purchased': 0},
+    {'barcode': 'B4', 'title': 'Chemistry Today', 'topic': 'Science', 'is_purchased': 1},
+]
+
+
+def write_csv(path, rows, fieldnames=None):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames or list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def touch_later(path):
+    """Move a file's mtime forward, so an edit is noticed even on a coarse clock."""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2_000_000_000))
+
+
+def open_engine(directory, backend='csv'):
+    return LibraryEngine(
+        backend,
+        students_path=os.path.join(directory, 'studentdetails.csv'),
+        books_path=os.path.join(directory, 'bookdata.csv'),
+        db_path=os.path.join(directory, 'library.db'),
+        purchases_path=os.path.join(directory, 'book_purchases.db'),
+        returns_path=os.path.join(directory, 'book_returns.db')
+    )
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    write_csv(tmp_path / 'studentdetails.csv', STUDENTS)
+    write_csv(tmp_path / 'bookdata.csv', BOOKS)
+    return tmp_path
+
+
+@pytest.fixture
+def engine(data_dir):
+    engine = open_engine(data_dir)
+    engine.load()
+    yield engine
+    engine.close()
@@ -0,0 +1,78 @@
+import pytest
+
+from conftest import write_csv
+from library_engine import CsvValidationError, read_csv_data, read_transactions
+
+
+def test_reads_and_cleans_rows(tmp_path):
+    path = tmp_path / 'bookdata.csv'
+    path.write_text('barcode,title,topic,is_purchased\n B1 , Atlas ,Maps,1\n\nB2,Algebra,,0\n', encoding='utf-8')
+    assert read_csv_data(str(path), 'books') == [
+        {'barcode': 'B1', 'title': 'Atlas', 'topic': 'Maps', 'is_purchased': 1},
+        {'barcode': 'B2', 'title': 'Algebra', 'topic': '', 'is_purchased': 0},
+    ]
+
+
+def test_accepts_either_header_spelling_and_a_byte_order_mark(tmp_path):
+    path = tmp_path / 'studentdetails.csv'
+    path.write_bytes('\ufeffSchool ID,Name,Class\nS1,Ada,7A\n'.encode('utf-8'))
+    assert read_csv_data(str(path), 'students') == [{'school_id': 'S1', 'name': 'Ada', 'class': '7A'}]
+
+
+def test_missing_column(tmp_path):
+    path = tmp_path / 'bookdata.csv'
+    write_csv(path, [{'barcode': 'B1', 'title': 'Atlas', 'is_purchased': 0}])
+    with pytest.raises(CsvValidationError) as error:
+        read_csv_data(str(path), 'books')
+    assert error.value.errors == [(1, "missing column 'topic' (expected one of: topic, Topic)")]
+
+
+def test_reports_every_bad_row_by_line(tmp_path):
+    path = tmp_path / 'bookdata.csv'
+    path.write_text(
+        'barcode,title,topic,is_purchased\n'
+        'B1,Atlas,Maps,0\n'
+        'B2,,Maps,0\n'
+        'B3,Algebra,Maths,yes\n'
+        'B1,Atlas again,Maps,0\n',
+        encoding='utf-8'
+    )
+    with pytest.raises(CsvValidationError) as error:
+        read_csv_data(str(path), 'books')
+    assert error.value.total == 3
+    assert error.value.errors == [
+        (3, 'missing title'),
+        (4, "is_purchased must be 0 or 1, got 'yes'"),
+        (5, "duplicate barcode 'B1' (first on line 2)"),
+    ]
+
+
+def test_caps_the_errors_listed(tmp_path):
+    path = tmp_path / 'studentdetails.csv'
+    path.write_text('school_id,name,class\n' + 'S1,Ada,\n' * 30, encoding='utf-8')
+    with pytest.raises(CsvValidationError) as error:
+        read_csv_data(str(path), 'students', max_errors=5)
+    assert error.value.total == 30
+    assert len(error.value.errors) == 5
+    assert '... and 25 more' in str(error.value)
+
+
+def test_header_only_file(tmp_path):
+    path = tmp_path / 'studentdetails.csv'
+    path.write_text('school_id,name,class\n', encoding='utf-8')
+    with pytest.raises(CsvValidationError, match='empty'):
+        read_csv_data(str(path), 'students')
+
+
+def test_read_transactions_csv_and_jsonl(tmp_path):
+    csv_path = tmp_path / 'transactions.csv'
+    csv_path.write_text('action,class,school_id,barcode\ncheckout,7A,S1,B1\n', encoding='utf-8')
+    jsonl_path = tmp_path / 'transactions.jsonl'
+    jsonl_path.write_text('{"action": "return", "class": "7A", "school_id": "S1", "barcode": "B1"}\nnot json\n', encoding='utf-8')
+    assert list(read_transactions(str(csv_path))) == [
+        (2, {'action': 'checkout', 'class': '7A', 'school_id': 'S1', 'barcode': 'B1'})
+    ]
+    assert list(read_transactions(str(jsonl_path))) == [
+        (1, {'action': 'return', 'class': '7A', 'school_id': 'S1', 'barcode': 'B1'}),
+        (2, None)
+    ]
@@ -0,0 +1,44 @@
+import sqlite3
+
+import pytest
+
+from library_engine import LegacyLedger, LibraryDatabase, apply_durability
+
+
+def pragmas(conn, schema='main'):
+    return (
+        conn.execute(f'PRAGMA {schema}.journal_mode').fetchone()[0],
+        conn.execute(f'PRAGMA {schema}.synchronous').fetchone()[0],
+    )
+
+
+@pytest.mark.parametrize('profile, expected', [
+    ('strict', ('delete', 2)),
+    ('balanced', ('wal', 1)),
+    ('bulk', ('wal', 0)),
+])
+def test_profiles_set_the_journal_and_sync_level(tmp_path, profile, expected):
+    database = LibraryDatabase(str(tmp_path / 'library.db'), profile)
+    try:
+        assert pragmas(database.conn) == expected
+    finally:
+        database.conn.close()
+
+
+@pytest.mark.parametrize('profile, synchronous', [('strict', 2), ('balanced', 1), ('bulk', 1)])
+def test_legacy_ledgers_keep_the_rollback_journal(tmp_path, profile, synchronous):
+    ledger = LegacyLedger(str(tmp_path / 'book_purchases.db'), str(tmp_path / 'book_returns.db'), profile)
+    try:
+        for schema in ('main', 'ledger_returns'):
+            assert pragmas(ledger.conn, schema) == ('delete', synchronous)
+    finally:
+        ledger.conn.close()
+
+
+def test_unknown_profile(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'library.db'))
+    try:
+        with pytest.raises(ValueError, match='unknown durability profile'):
+            apply_durability(conn, 'fast')
+    finally:
+        conn.close()
@@ -0,0 +1,52 @@
+from library_engine import IdentifierIndex, TitleSearchIndex
+
+
+def test_prefix_matches_come_before_substring_matches():
+    index = IdentifierIndex(['B100', 'A-B10', 'b105', 'C7', 'XB10Y'])
+    assert index.search('b10') == ['B100', 'b105', 'A-B10', 'XB10Y']
+    assert index.search('b10', limit=2) == ['B100', 'b105']
+    assert index.search('c') == ['C7']  # Shorter than a trigram
+    assert index.search('b1z') == []
+
+
+def test_indexes_sharing_postings_only_return_their_own_identifiers():
+    postings = IdentifierIndex.build_postings(['B100', 'B200', 'AB100'])
+    available = IdentifierIndex(['B100', 'AB100'], postings)
+    checked_out = IdentifierIndex(['B200'], postings)
+    assert sorted(available.search('100')) == ['AB100', 'B100']
+    assert checked_out.search('100') == []
+
+    # A copy moving between indexes is found in its new one only
+    available.remove('B100')
+    checked_out.add('B100')
+    assert available.search('100') == ['AB100']
+    assert checked_out.search('100') == ['B100']
+
+    # A new identifier is indexed once for both
+    available.index('XB300')
+    available.add('XB300')
+    assert available.search('b30') == ['XB300']
+    assert checked_out.search('b30') == []
+    assert not checked_out.contains(('xb300', 'XB300'))
+
+
+def test_removed_titles_drop_out_without_shifting_ids():
+    index = TitleSearchIndex(['World Atlas', 'World History', 'Algebra Basics', 'Atlas of Birds'])
+    ids = dict(index.ids)
+    word_starts = len(index.word_starts)
+    index.remove_key(index.key_for('World Atlas'))
+    index.remove_key(index.key_for('Unknown Title'))  # Ignored
+
+    assert index.live_titles() == ['World History', 'Algebra Basics', 'Atlas of Birds']
+    assert len(index.word_starts) == word_starts - 2
+    assert {key: ids[key] for key in index.ids} == index.ids
+    assert [title for title, _ in index.suggest('wor')] == ['World History']  # Word-prefix scan
+    assert 'World Atlas' not in [title for title, _ in index.suggest('world atlas')]  # N-gram candidates
+    assert 'World Atlas' not in [title for title, _ in index.search('world atlas', limit=10)]
+
+    # Adding it back gives it a new id
+    index.add('World Atlas')
+    assert index.ids[index.key_for('World Atlas')] == len(ids)
+    assert index.search('world atlas', limit=1)[0][0] == 'World Atlas'
+    texts = [index.word_start_text(entry) for entry in index.word_starts]
+    assert texts == sorted(texts)
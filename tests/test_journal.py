@@ -0,0 +1,177 @@
+import os
+
+import pytest
+
+from conftest import open_engine
+import library_engine
+from library_engine import BookJournal, ConcurrentUpdateError, read_csv_data
+
+
+def statuses(path):
+    return {row['barcode']: row['is_purchased'] for row in read_csv_data(str(path), 'books')}
+
+
+@pytest.fixture
+def desks(data_dir):
+    """Two desks sharing one data folder, flushing only when told to."""
+    engines = [open_engine(data_dir), open_engine(data_dir)]
+    for engine in engines:
+        engine.auto_flush = False
+        engine.load()
+    yield engines
+    for engine in engines:
+        engine.close()
+
+
+def test_changes_are_journaled_not_rewritten(engine, data_dir):
+    engine.auto_flush = False
+    engine.checkout('S1', 'B1')
+    engine.checkout('S2', 'B2')
+    engine.checkin('B2')
+    assert statuses(data_dir / 'bookdata.csv')['B1'] == 0
+    assert engine.pending_journal_entries() == 3
+    assert BookJournal(engine.book_journal.path).read_since(0) == (
+        [('B1', 1), ('B2', 1), ('B2', 0)], os.path.getsize(engine.book_journal.path)
+    )
+
+
+def test_journal_is_replayed_on_load(engine, data_dir):
+    engine.auto_flush = False
+    engine.checkout('S1', 'B1')
+    engine.checkout('S2', 'B2')
+    engine.checkin('B2')
+
+    # As after a crash: the CSV was never rewritten
+    restarted = open_engine(data_dir)
+    restarted.load()
+    try:
+        assert restarted.catalog.find_book('B1')['is_purchased'] == 1
+        assert restarted.catalog.find_book('B2')['is_purchased'] == 0
+        assert restarted.pending_journal_entries() == 3  # Folded into the CSV on the usual schedule
+    finally:
+        restarted.close()
+
+
+def test_compaction_folds_the_journal_into_the_csv(engine, data_dir):
+    engine.auto_flush = False
+    engine.checkout('S1', 'B1')
+    generation = engine.shared_lock.generation()
+    engine.flush_book_changes()
+
+    assert statuses(data_dir / 'bookdata.csv') == {'B1': 1, 'B2': 0, 'B3': 0, 'B4': 1}
+    assert os.path.getsize(engine.book_journal.path) == 0
+    assert BookJournal(engine.book_journal.path + '.prev').read_since(0)[0] == [('B1', 1)]
+    assert engine.shared_lock.generation() == generation + 1
+    assert engine.pending_journal_entries() == 0
+    assert not engine.flush_due()
+    assert engine.last_flush_seconds is not None
+
+
+def test_snapshot_is_on_disk_before_the_journal_is_truncated(engine, monkeypatch):
+    engine.auto_flush = False
+    engine.checkout('S1', 'B1')
+    events = []
+    fsync, replace, truncate = os.fsync, os.replace, BookJournal.truncate
+    monkeypatch.setattr(library_engine.os, 'fsync', lambda fd: (events.append('fsync'), fsync(fd))[1])
+    monkeypatch.setattr(library_engine.os, 'replace', lambda *args: (events.append('replace'), replace(*args))[1])
+    monkeypatch.setattr(BookJournal, 'truncate', lambda self: (events.append('truncate'), truncate(self))[1])
+    engine.flush_book_changes()
+    replaced = events.index('replace')
+    assert events[replaced - 1] == 'fsync'  # The new snapshot's data
+    assert replaced < events.index('truncate')
+    if os.name != 'nt':
+        assert 'fsync' in events[replaced:events.index('truncate')]  # The rename
+
+
+def test_failed_flush_backs_off_until_it_succeeds(engine, data_dir, monkeypatch):
+    engine.auto_flush = False
+    engine.checkout('S1', 'B1')
+
+    def disk_full(path, books):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(library_engine, 'write_book_csv', disk_full)
+    engine.oldest_pending -= engine.flush_interval
+    assert engine.flush_due()
+    with pytest.raises(OSError):
+        engine.flush_book_changes()
+    assert engine.flush_failures == 1
+    assert not engine.flush_due()  # Not retried on the next check
+
+    engine.flush_retry_at -= engine.flush_interval
+    assert engine.flush_due()
+    with pytest.raises(OSError):
+        engine.flush_book_changes()
+    assert engine.flush_failures == 2
+    engine.flush_retry_at -= engine.flush_interval
+    assert not engine.flush_due()  # The wait doubled
+
+    monkeypatch.undo()
+    engine.flush_book_changes()  # close() still flushes right away
+    assert engine.flush_failures == 0 and engine.flush_retry_at is None
+    assert statuses(data_dir / 'bookdata.csv')['B1'] == 1
+
+
+def test_auto_flush_compacts_at_the_threshold(engine, data_dir):
+    engine.journal_compact_threshold = 2
+    engine.checkout('S1', 'B1')
+    assert statuses(data_dir / 'bookdata.csv')['B1'] == 0
+    engine.checkout('S2', 'B2')
+    assert statuses(data_dir / 'bookdata.csv')['B2'] == 1
+    assert engine.pending_journal_entries() == 0
+
+
+def test_torn_entries_are_skipped(tmp_path):
+    path = str(tmp_path / 'bookdata.csv.journal')
+    journal = BookJournal(path)
+    journal.append('B1', 1)
+    journal.close()
+    with open(path, 'ab') as f:
+        f.write(b'B2,')  # Interrupted append
+
+    assert BookJournal(path).read_since(0)[0] == [('B1', 1)]
+    journal = BookJournal(path)
+    journal.append('B3', 1)
+    journal.close()
+    assert BookJournal(path).read_since(0)[0] == [('B1', 1), ('B3', 1)]
+
+
+def test_desks_see_each_others_changes(desks):
+    first, second = desks
+    first.checkout('S1', 'B1')
+    assert second.shared_changes_waiting()
+    assert [book['barcode'] for book in second.refresh_shared_changes()] == ['B1']
+    assert second.catalog.find_book('B1')['is_purchased'] == 1
+    with pytest.raises(ValueError):
+        second.checkout('S2', 'B1')
+
+
+def test_stale_desk_write_is_rejected(desks):
+    first, second = desks
+    first.checkout('S1', 'B3')
+
+    # The second desk flips its stale copy in memory, as the desk app does, then writes
+    book = second.catalog.find_book('B3')
+    second.catalog.set_purchased(book, 1)
+    with pytest.raises(ConcurrentUpdateError) as error:
+        second.record_checkouts([('S2', book)])
+    assert error.value.barcodes == {'B3'}
+    assert second.open_loan_holder('B3') == 'S1'
+    assert book['is_purchased'] == 1
+
+
+def test_another_desks_compaction_is_not_a_hand_edit(desks, data_dir):
+    first, second = desks
+    first.checkout('S1', 'B1')
+    first.flush_book_changes()
+
+    assert not second.data_files_changed()
+    second.refresh_shared_changes()
+    assert second.catalog.find_book('B1')['is_purchased'] == 1
+
+    second.checkout('S2', 'B2')
+    second.flush_book_changes()
+    assert statuses(data_dir / 'bookdata.csv') == {'B1': 1, 'B2': 1, 'B3': 0, 'B4': 1}
+    assert not first.data_files_changed()
+    first.refresh_shared_changes()
+    assert first.catalog.find_book('B2')['is_purchased'] == 1
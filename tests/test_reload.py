@@ -0,0 +1,199 @@
+import os
+import pickle
+
+import pytest
+
+from conftest import BOOKS, STUDENTS, open_engine, touch_later, write_csv
+from library_engine import (
+    CatalogCache, CsvValidationError, LibraryCatalog, get_scorer, preflight_csv, read_csv_data, stat_files
+)
+
+
+def cache_for(directory):
+    return CatalogCache(
+        os.path.join(directory, 'bookdata.csv.cache'),
+        [os.path.join(directory, 'studentdetails.csv'), os.path.join(directory, 'bookdata.csv')]
+    )
+
+
+def test_close_leaves_a_snapshot_the_next_load_uses(engine, data_dir):
+    engine.checkout('S1', 'B1')
+    engine.close()
+    assert cache_for(data_dir).is_fresh(get_scorer().name)
+
+    reopened = open_engine(data_dir)
+    reopened.load()
+    try:
+        assert not reopened.cache_stale  # Loaded from the snapshot
+        assert reopened.catalog.find_book('B1')['is_purchased'] == 1
+        assert reopened.catalog.title_record('algebra basics')['title'] == 'Algebra Basics'
+        assert len(reopened.catalog.copies_of('Algebra Basics')) == 2
+        assert reopened.catalog.suggest_titles('atl')[0][0] == 'World Atlas'
+    finally:
+        reopened.close()
+
+
+def test_snapshot_is_ignored_once_a_source_changes(engine, data_dir):
+    engine.close()
+    books = [dict(book) for book in BOOKS]
+    books[2]['title'] = 'World Atlas (2nd edition)'
+    write_csv(data_dir / 'bookdata.csv', books)
+    touch_later(data_dir / 'bookdata.csv')
+    assert not cache_for(data_dir).is_fresh(get_scorer().name)
+
+    reopened = open_engine(data_dir)
+    reopened.load()
+    try:
+        assert reopened.cache_stale
+        assert reopened.catalog.find_book('B3')['title'] == 'World Atlas (2nd edition)'
+    finally:
+        reopened.close()
+
+
+def test_touched_but_identical_source_still_hits(engine, data_dir):
+    engine.close()
+    touch_later(data_dir / 'studentdetails.csv')
+    assert cache_for(data_dir).is_fresh(get_scorer().name)
+
+
+def test_save_refuses_a_catalog_older_than_its_sources(data_dir):
+    cache = cache_for(data_dir)
+    stats = stat_files(cache.sources)
+    catalog = LibraryCatalog([dict(student) for student in STUDENTS], read_csv_data(cache.sources[1], 'books'))
+    write_csv(data_dir / 'bookdata.csv', BOOKS[:3])
+    assert not cache.save(catalog, stats)
+    assert not os.path.exists(cache.path)
+    assert not cache.save(catalog, (stats[0], None))
+    assert cache.save(catalog, stat_files(cache.sources))
+    assert cache.is_fresh(get_scorer().name)
+
+
+class RunsCode:
+    def __reduce__(self):
+        return (os.remove, (self.path,))
+
+
+def test_snapshot_cannot_run_code(engine, data_dir):
+    engine.close()
+    cache = cache_for(data_dir)
+    with open(cache.path, 'rb') as f:
+        header = pickle.load(f)
+    victim = data_dir / 'victim.txt'
+    victim.write_text('still here', encoding='utf-8')
+    payload = RunsCode()
+    payload.path = str(victim)
+    for first, second in [(header, payload), (payload, header)]:
+        with open(cache.path, 'wb') as f:
+            pickle.dump(first, f)
+            pickle.dump(second, f)
+        assert cache.load(get_scorer().name) is None
+    assert not cache.is_fresh(get_scorer().name)  # The header is read the same way
+    assert victim.exists()
+
+
+def test_close_does_not_snapshot_over_a_pending_hand_edit(engine, data_dir):
+    write_csv(data_dir / 'bookdata.csv', BOOKS[:3])
+    touch_later(data_dir / 'bookdata.csv')
+    engine.close()
+    assert not cache_for(data_dir).is_fresh(get_scorer().name)
+
+
+def test_hand_edits_are_applied_row_by_row(engine, data_dir):
+    engine.auto_flush = False
+    engine.checkout('S1', 'B1')
+    algebra = engine.catalog.find_book('B1')
+
+    students = [dict(student) for student in STUDENTS]
+    students[1]['class'] = '8B'
+    students.append({'school_id': 'S4', 'name': 'Dev', 'class': '9C'})
+    books = [dict(book) for book in BOOKS if book['barcode'] != 'B2']
+    books[1]['title'] = 'World Atlas (2nd edition)'
+    books.append({'barcode': 'B5', 'title': 'Poetry Now', 'topic': 'English', 'is_purchased': 0})
+    write_csv(data_dir / 'studentdetails.csv', students)
+    write_csv(data_dir / 'bookdata.csv', books)
+    touch_later(data_dir / 'studentdetails.csv')
+    touch_later(data_dir / 'bookdata.csv')
+
+    assert engine.data_files_changed()
+    assert engine.reload_data_files() == {'students': (1, 1, 0), 'books': (1, 1, 1)}
+    assert not engine.data_files_changed()
+
+    catalog = engine.catalog
+    assert catalog.find_book('B1') is algebra and algebra['is_purchased'] == 1  # Desks own the status
+    assert catalog.find_book('B2') is None
+    assert catalog.copies_of('Algebra Basics') == [algebra]
+    assert catalog.title_record('World Atlas') is None
+    assert catalog.search_titles('poetry now', limit=1)[0][0] == 'Poetry Now'
+    assert 'World Atlas (2nd edition)' in catalog.live_titles()
+    assert catalog.search_barcodes('B5', is_purchased=0) == ['B5']
+    assert [student['school_id'] for student in catalog.students_in_class('8B')] == ['S3', 'S2']
+    assert catalog.classes() == ['7A', '8B', '9C']
+    assert catalog.search_student_ids('S4') == ['S4']
+    engine.checkout('S4', 'B5', student_class='9C')
+
+
+def test_invalid_hand_edit_holds_back_the_flush_until_fixed(engine, data_dir):
+    engine.auto_flush = False
+    engine.checkout('S1', 'B1')
+    books = BOOKS + [dict(BOOKS[0])]  # Duplicate barcode
+    write_csv(data_dir / 'bookdata.csv', books)
+    touch_later(data_dir / 'bookdata.csv')
+
+    with pytest.raises(CsvValidationError, match='duplicate barcode'):
+        engine.reload_data_files()
+    assert engine.reload_error is not None
+    assert not engine.flush_due()
+    engine.flush_book_changes()
+    assert (data_dir / 'bookdata.csv').read_text().count('B1,') == 2  # Left for the person fixing it
+
+    write_csv(data_dir / 'bookdata.csv', BOOKS)
+    touch_later(data_dir / 'bookdata.csv')
+    assert engine.apply_data_file_edits()
+    assert engine.reload_error is None
+    engine.flush_book_changes()
+    assert read_csv_data(str(data_dir / 'bookdata.csv'), 'books')[0]['is_purchased'] == 1
+
+
+def test_invalid_hand_edit_survives_a_restart(engine, data_dir):
+    engine.auto_flush = False
+    engine.checkout('S1', 'B1')
+    books = BOOKS + [{'barcode': 'B5', 'title': 'Poetry Now', 'topic': 'English', 'is_purchased': 0}, dict(BOOKS[0])]
+    write_csv(data_dir / 'bookdata.csv', books)
+    touch_later(data_dir / 'bookdata.csv')
+    with pytest.raises(CsvValidationError):
+        engine.reload_data_files()
+    assert not engine.data_files_changed()  # Reported once, not on every check
+    engine.close()
+
+    assert not cache_for(data_dir).is_fresh(get_scorer().name)
+    paths = (str(data_dir / 'studentdetails.csv'), str(data_dir / 'bookdata.csv'))
+    with pytest.raises(CsvValidationError, match='duplicate barcode'):
+        preflight_csv(*paths)
+    assert 'B5' in (data_dir / 'bookdata.csv').read_text()
+
+    # Once fixed, the next start takes in the edit and the journaled checkout
+    write_csv(data_dir / 'bookdata.csv', books[:-1])
+    preflight_csv(*paths)
+    restarted = open_engine(data_dir)
+    restarted.load()
+    try:
+        assert restarted.catalog.find_book('B5') is not None
+        assert restarted.catalog.find_book('B1')['is_purchased'] == 1
+    finally:
+        restarted.close()
+
+
+def test_invalid_students_edit_waits_without_blocking_the_books_flush(engine, data_dir):
+    engine.auto_flush = False
+    engine.checkout('S1', 'B1')
+    (data_dir / 'studentdetails.csv').write_text('school_id,name,class\nS1,Ada,\n', encoding='utf-8')
+    touch_later(data_dir / 'studentdetails.csv')
+    with pytest.raises(CsvValidationError):
+        engine.reload_data_files()
+    assert engine.reload_error is None
+
+    engine.flush_book_changes()
+    assert read_csv_data(str(data_dir / 'bookdata.csv'), 'books')[0]['is_purchased'] == 1
+    assert not engine.data_files_changed()
+    engine.close()
+    assert not cache_for(data_dir).is_fresh(get_scorer().name)
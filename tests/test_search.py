@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+from conftest import BOOKS, STUDENTS
+from library_engine import LibraryCatalog, RapidFuzzScorer
+
+rapidfuzz = pytest.importorskip('rapidfuzz')
+
+
+@pytest.fixture
+def scorer(monkeypatch):
+    scorer = RapidFuzzScorer()
+    scorer.parallel = False
+    monkeypatch.setattr(scorer, 'CHUNK_SIZE', 3)
+    return scorer
+
+
+@pytest.mark.parametrize('limit, score_cutoff', [(1, 0), (3, 0), (5, 60), (20, 0)])
+def test_sliced_extract_matches_one_call(scorer, limit, score_cutoff):
+    titles = [scorer.preprocess(title) for title in (
+        'Algebra Basics', 'World Atlas', 'Algebra Basics', 'Chemistry Today', '', 'Algebra for Beginners',
+        'Basic Algebra', 'Atlas of the World', 'Poetry Now', 'Algebra Basics Workbook'
+    )]
+    for query in ('algebra basics', 'atlas', 'chem', 'zzz'):
+        expected = rapidfuzz.process.extract(
+            query, titles, scorer=rapidfuzz.fuzz.WRatio, processor=None, score_cutoff=score_cutoff, limit=limit
+        )
+        assert scorer.extract(query, titles, limit, score_cutoff) == [(index, round(score)) for _, score, index in expected]
+
+
+def test_full_search_scores_without_holding_the_catalog_lock(monkeypatch):
+    catalog = LibraryCatalog([dict(student) for student in STUDENTS], [dict(book) for book in BOOKS])
+    scorer = catalog.title_index.scorer
+    extract = scorer.extract
+    flipped = []
+
+    def extract_while_flipping(query, choices, limit=5, score_cutoff=0):
+        # A status change from another thread (the desk's UI) must not wait for the scoring
+        book = catalog.find_book('B3')
+        flipper = threading.Thread(target=lambda: flipped.append(catalog.set_purchased(book, 1)))
+        flipper.start()
+        flipper.join(timeout=5)
+        # Meanwhile a hand edit drops a title; the copy being scored is unaffected
+        catalog.apply_book_rows([dict(row) for row in BOOKS if row['title'] != 'Chemistry Today'])
+        return extract(query, choices, limit, score_cutoff)
+
+    monkeypatch.setattr(scorer, 'extract', extract_while_flipping)
+    matches = catalog.search_titles('chemistry today', limit=4)
+    assert flipped == [None]
+    assert catalog.find_book('B3')['is_purchased'] == 1
+    assert matches[0] == ('Chemistry Today', 100)
+    assert catalog.title_record('Chemistry Today') is None
@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+
+from conftest import BOOKS, STUDENTS, open_engine, touch_later, write_csv
+from library_engine import ConcurrentUpdateError, revert_status
+from library_service import LibraryService, RemoteEngine, get_catalog
+
+
+@pytest.fixture
+def service(data_dir):
+    def start_engine():
+        engine = open_engine(data_dir)
+        engine.load()
+        return engine
+
+    service = LibraryService(('127.0.0.1', 0), start_engine, workers=4)
+    threading.Thread(target=service.serve_forever, daemon=True).start()
+    yield service
+    service.shutdown()
+    service.server_close()
+
+
+@pytest.fixture
+def desks(service):
+    url = f'http://127.0.0.1:{service.server_address[1]}'
+    engines = [RemoteEngine(url), RemoteEngine(url)]
+    for engine in engines:
+        engine.load()
+    yield engines
+    for engine in engines:
+        engine.close()
+
+
+def test_replicas_follow_the_changes_feed(desks):
+    first, second = desks
+    book = first.catalog.find_book('B1')
+    first.catalog.set_purchased(book, 1)
+    first.record_checkouts([('S1', book)])
+
+    assert [book['barcode'] for book in second.refresh_shared_changes()] == ['B1']
+    assert second.catalog.find_book('B1')['is_purchased'] == 1
+    assert second.open_loan_holder('B1') == 'S1'
+    assert second.refresh_shared_changes() == []
+
+    # A stale replica is refused by the server
+    stale = first.catalog.find_book('B1')
+    with pytest.raises(ValueError):
+        second.record_checkouts([('S2', stale)])
+
+    assert first.record_express_return(book) == 'S1'
+    assert [book['barcode'] for book in second.refresh_shared_changes()] == ['B1']
+    assert second.catalog.find_book('B1')['is_purchased'] == 0
+
+
+def test_rejected_write_takes_the_servers_status(desks):
+    first, second = desks
+    book = first.catalog.find_book('B1')
+    first.catalog.set_purchased(book, 1)
+    first.record_checkouts([('S1', book)])
+
+    # The second desk flips B1 for its own checkout, then a refresh consumes the
+    # first desk's identical change before the write reaches the server
+    stale = second.catalog.find_book('B1')
+    second.catalog.set_purchased(stale, 1)
+    assert second.refresh_shared_changes() == []
+    with pytest.raises(ConcurrentUpdateError) as error:
+        second.record_checkouts([('S2', stale)])
+    revert_status(second.catalog, [stale], 0, error.value)
+    assert stale['is_purchased'] == 1
+    assert second.record_express_return(stale) == 'S1'
+
+    # And the other way round: a return another desk already made
+    second.catalog.set_purchased(stale, 0)
+    first.catalog.set_purchased(book, 0)
+    with pytest.raises(ConcurrentUpdateError):
+        first.record_return('S1', book)
+    assert book['is_purchased'] == 0
+
+
+def test_rejection_without_a_conflict_stays_a_plain_error(desks):
+    first, _ = desks
+    book = first.catalog.find_book('B1')
+    first.catalog.set_purchased(book, 1)
+    with pytest.raises(ValueError) as error:
+        first.record_checkouts([('S9', book)])
+    assert not isinstance(error.value, ConcurrentUpdateError)
+
+
+def test_row_changes_reset_the_replica(service, desks, data_dir):
+    first, _ = desks
+    write_csv(data_dir / 'bookdata.csv', BOOKS + [{'barcode': 'B5', 'title': 'Poetry Now', 'topic': 'English', 'is_purchased': 1}])
+    touch_later(data_dir / 'bookdata.csv')
+    assert service.call(service.engine.reload_data_files) == {'books': (1, 0, 0)}
+
+    assert service.changes_since(first.seq)['reset']
+    assert first.refresh_shared_changes() == []  # New copies are not status changes
+    assert first.catalog.find_book('B5') == {'barcode': 'B5', 'title': 'Poetry Now', 'topic': 'English', 'is_purchased': 1}
+    assert first.catalog.suggest_titles('poetry')[0][0] == 'Poetry Now'
+    assert not service.changes_since(first.seq).get('reset')
+
+
+def test_catalog_snapshot_is_a_copy(service, data_dir):
+    snapshot = get_catalog(service, {})
+    students = [dict(student) for student in STUDENTS]
+    students[1]['class'] = '8B'
+    students.append({'school_id': 'S4', 'name': 'Dev', 'class': '9C'})
+    write_csv(data_dir / 'studentdetails.csv', students)
+    touch_later(data_dir / 'studentdetails.csv')
+    service.call(service.engine.reload_data_files)
+
+    assert snapshot['students'] == STUDENTS
@@ -0,0 +1,152 @@
+import pytest
+
+from conftest import open_engine
+from library_engine import process_transactions
+
+
+@pytest.fixture(params=['csv', 'sqlite'])
+def engine(request, data_dir):
+    engine = open_engine(data_dir, request.param)
+    engine.load()
+    yield engine
+    engine.close()
+
+
+def test_checkout_and_checkin(engine):
+    book = engine.checkout('S1', 'B1', student_class='7A')
+    assert book['is_purchased'] == 1
+    assert engine.open_loan_holder('B1') == 'S1'
+    assert [(loan['barcode'], loan['school_id']) for loan in engine.open_loans()] == [('B1', 'S1')]
+    assert engine.open_loans('S2') == []
+    assert 'B1' not in engine.catalog.search_barcodes('B', is_purchased=0)
+
+    assert engine.checkin('B1') == 'S1'
+    assert engine.catalog.find_book('B1')['is_purchased'] == 0
+    assert engine.open_loan_holder('B1') is None
+    assert engine.open_loans() == []
+    assert 'B1' in engine.catalog.search_barcodes('B', is_purchased=0)
+
+
+@pytest.mark.parametrize('school_id, barcode, student_class', [
+    ('S9', 'B1', None),   # Unknown student
+    ('S1', 'B1', '8B'),   # Wrong class
+    ('S1', 'B4', None),   # Already checked out
+    ('S1', 'B9', None),   # Unknown book
+])
+def test_checkout_rejects_invalid_requests(engine, school_id, barcode, student_class):
+    with pytest.raises(ValueError):
+        engine.checkout(school_id, barcode, student_class)
+    assert engine.open_loans() == []
+
+
+def test_checkin_rejects_invalid_requests(engine):
+    engine.checkout('S1', 'B1')
+    with pytest.raises(ValueError):
+        engine.checkin('B1', school_id='S2')
+    with pytest.raises(ValueError):
+        engine.checkin('B2')
+    assert engine.open_loan_holder('B1') == 'S1'
+
+
+def test_checkout_many_is_all_or_nothing(engine):
+    with pytest.raises(ValueError, match='B4'):
+        engine.checkout_many([('S1', 'B1'), ('S2', 'B4')])
+    assert engine.catalog.find_book('B1')['is_purchased'] == 0
+    assert engine.open_loans() == []
+
+    engine.checkout_many([('S1', 'B1'), ('S2', 'B3')])
+    assert sorted(loan['barcode'] for loan in engine.open_loans()) == ['B1', 'B3']
+
+
+def test_bulk_checkout_reports_shortfalls(engine):
+    allocations, shortfalls = engine.bulk_checkout('7A', ['Algebra Basics', 'World Atlas'])
+    assert sorted((student['school_id'], book['title']) for student, book in allocations) == [
+        ('S1', 'Algebra Basics'), ('S1', 'World Atlas'), ('S2', 'Algebra Basics')
+    ]
+    assert shortfalls == {'World Atlas': 1}
+    assert len(engine.open_loans()) == 3
+
+
+def test_loans_survive_a_restart(engine, data_dir):
+    engine.checkout('S1', 'B1')
+    engine.checkout('S2', 'B2')
+    engine.checkin('B2')
+    engine.close()
+
+    reopened = open_engine(data_dir, engine.storage_backend)
+    reopened.load()
+    try:
+        assert reopened.catalog.find_book('B1')['is_purchased'] == 1
+        assert reopened.catalog.find_book('B2')['is_purchased'] == 0
+        assert [(loan['barcode'], loan['school_id']) for loan in reopened.open_loans()] == [('B1', 'S1')]
+    finally:
+        reopened.close()
+
+
+def test_import_orders_a_return_and_loan_in_the_same_second(data_dir):
+    desk = open_engine(data_dir)
+    desk.load()
+    desk.checkout('S1', 'B1')
+    desk.checkin('B1')
+    desk.checkout('S2', 'B1')  # Back out again straight away
+    desk.checkout('S1', 'B2')
+    desk.checkin('B2')
+    with desk.store.conn:
+        desk.store.conn.execute("UPDATE book_purchases SET purchase_date = '2026-09-01 08:00:00'")
+        desk.store.conn.execute("UPDATE ledger_returns.book_returns SET return_date = '2026-09-01 08:00:00'")
+    desk.close()
+
+    imported = open_engine(data_dir, 'sqlite')
+    imported.load()
+    try:
+        assert [(loan['barcode'], loan['school_id']) for loan in imported.open_loans()] == [('B1', 'S2')]
+    finally:
+        imported.close()
+
+
+def rows(*lines):
+    return [
+        (number, dict(zip(('action', 'class', 'school_id', 'barcode'), line.split(','))))
+        for number, line in enumerate(lines, start=2)
+    ]
+
+
+def test_batch_applies_rows_in_order(engine):
+    committed = []
+    results = process_transactions(engine.catalog, engine.store, rows(
+        'checkout,7A,S1,B1',
+        'return,7A,S1,B1',   # Returned within the batch...
+        'checkout,7A,S2,B1',  # ...and out again to someone else
+        'return,7A,S1,B1',   # No longer S1's
+        'checkout,8B,S3,B1',  # No copy left
+    ), group_size=2, on_commit=committed.append)
+    assert [(result[0], result[4]) for result in results] == [(2, 'ok'), (3, 'ok'), (4, 'ok'), (5, 'error'), (6, 'error')]
+    assert [len(books) for books in committed] == [2, 1]
+    assert engine.open_loan_holder('B1') == 'S2'
+    assert engine.catalog.find_book('B1')['is_purchased'] == 1
+
+
+def test_failed_group_is_rolled_back_in_memory(engine, monkeypatch):
+    record = engine.store.record_transactions
+    calls = []
+
+    def fail_second_group(ops):
+        calls.append(ops)
+        if len(calls) == 2:
+            raise OSError('disk I/O error')
+        record(ops)
+
+    monkeypatch.setattr(engine.store, 'record_transactions', fail_second_group)
+    results = process_transactions(engine.catalog, engine.store, rows(
+        'checkout,7A,S1,B1',
+        'checkout,7A,S2,B2',
+        'return,7A,S1,B1',
+        'checkout,8B,S3,B3',
+        'return,7A,S2,B2',   # Its checkout was committed, so this is checked against the store
+    ), group_size=2)
+    assert [result[4] for result in results] == ['ok', 'ok', 'error', 'error', 'ok']
+    assert results[2][5] == 'group not recorded: disk I/O error'
+    assert engine.catalog.find_book('B1')['is_purchased'] == 1  # The undone return
+    assert engine.catalog.find_book('B3')['is_purchased'] == 0  # The undone checkout
+    assert engine.catalog.find_book('B2')['is_purchased'] == 0
+    assert [(loan['barcode'], loan['school_id']) for loan in engine.open_loans()] == [('B1', 'S1')]